@@ -0,0 +1,310 @@
+"""多帧动画（GIF/APNG/WebP）的逐帧流式处理
+
+每次只解码、处理并写出一帧，长动画的内存占用与帧数无关。
+GIF输出使用所有帧共享的全局调色板，APNG输出逐帧编码后拼接数据块，
+WebP输出把逐帧生成的图像包装为多帧图像（FrameSequence），编码器取下一帧时才处理它；
+libwebp 在内存中组装整个文件，WebP输出的内存占用随压缩后的大小增长，但不再保留解码后的帧。
+"""
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+from pipeline import apply_edits, adjust_colors
+from auto_levels import analyze_levels
+from background_io import TaskCancelled, atomic_open
+from quantize import PALETTE_TRANSPARENT_INDEX, apply_palette, build_palette, palette_image
+
+# 支持动画输出的格式
+ANIMATED_FORMATS = ("GIF", "PNG", "WEBP")
+
+# GIF帧的透明色索引（共享调色板只使用前255种颜色）
+GIF_TRANSPARENT_INDEX = PALETTE_TRANSPARENT_INDEX
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def is_animated(image):
+    """判断已打开的图像是否包含多帧"""
+    return getattr(image, "is_animated", False) and getattr(image, "n_frames", 1) > 1
+
+
+def iter_frames(image):
+    """逐帧读取动画，每次只保留当前帧
+
+    Args:
+        image: 已打开的PIL图像对象
+
+    Yields:
+        (frame, duration, disposal)：RGBA模式的完整帧、显示时长（毫秒）、
+        GIF语义的处置方式（0~3）
+    """
+    for index in range(getattr(image, "n_frames", 1)):
+        image.seek(index)
+
+        # 读取处置方式并统一为GIF的编码（APNG的编码比GIF小1）
+        if image.format == "GIF":
+            disposal = getattr(image, "disposal_method", 0)
+        elif image.format == "PNG" and "disposal" in image.info:
+            disposal = image.info["disposal"] + 1
+        else:
+            disposal = 0
+
+        frame = image.convert("RGBA")
+        # WebP 在载入帧时才更新 info 中的时长，必须在 convert 载入当前帧之后读取
+        duration = image.info.get("duration", 100)
+
+        # 解码得到的是合成后的完整帧，含透明像素时必须先清除上一帧
+        if frame.getextrema()[3][0] < 255:
+            disposal = 2
+
+        yield frame, duration, disposal
+
+
+def build_shared_palette(image, edits=None, samples=8, sample_size=128):
+    """从均匀抽样的若干帧缩略图中生成所有帧共享的调色板
+
+    抽样会移动帧指针，调用方应使用单独打开的图像对象。
+
+    Args:
+        image: 已打开的PIL图像对象
+        edits: 编辑参数，其中的色彩调整会先应用到缩略图上
+        samples: 抽样帧数
+        sample_size: 缩略图最长边
+
+    Returns:
+        P模式的调色板图像，最多包含255种颜色
+    """
+    edits = edits or {}
+    n_frames = getattr(image, "n_frames", 1)
+    step = max(1, n_frames // samples)
+    indices = list(range(0, n_frames, step))[:samples]
+
+    thumbnails = []
+    for index in indices:
+        image.seek(index)
+        thumb = image.convert("RGB")
+        thumb.thumbnail((sample_size, sample_size), Image.BILINEAR)
+        thumbnails.append(adjust_colors(
+            thumb,
+            edits.get("brightness", 1.0),
+            edits.get("contrast", 1.0),
+            edits.get("saturation", 1.0),
+            edits.get("levels"),
+        ))
+
+    # 全部缩略图一起量化
+    return build_palette(thumbnails, GIF_TRANSPARENT_INDEX, transparent=True)
+
+
+class GifStreamWriter:
+    """使用共享全局调色板逐帧写出GIF"""
+
+    def __init__(self, fp, palette_image, loop=0):
+        self.fp = fp
+        self.palette_image = palette_image
+        self.loop = loop
+        self.header_written = False
+
+    def add_frame(self, frame, duration=100, disposal=0):
+        """量化并写出一帧"""
+        indexed = apply_palette(frame, self.palette_image, dither=True)
+
+        params = {"duration": duration, "disposal": disposal}
+        if "transparency" in indexed.info:
+            params["transparency"] = indexed.info["transparency"]
+
+        from PIL import GifImagePlugin
+
+        if not self.header_written:
+            header, _ = GifImagePlugin.getheader(indexed.copy(), info={"loop": self.loop, "optimize": False})
+            for block in header:
+                self.fp.write(block)
+            self.header_written = True
+
+        for block in GifImagePlugin.getdata(indexed, **params):
+            self.fp.write(block)
+
+    def close(self):
+        self.fp.write(b";")
+
+
+class ApngStreamWriter:
+    """逐帧编码并写出APNG
+
+    每帧单独编码为PNG后提取IDAT数据，首帧作为IDAT写出，后续帧改写为fdAT块。
+    """
+
+    def __init__(self, fp, frame_count, loop=0):
+        self.fp = fp
+        self.frame_count = frame_count
+        self.loop = loop
+        self.sequence = 0
+        self.frames_written = 0
+        self.actl_offset = None
+
+    def _write_chunk(self, chunk_type, data):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(chunk_type)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    @staticmethod
+    def _encode_frame(frame):
+        """把单帧编码为PNG并返回(IHDR数据, IDAT数据列表)"""
+        buffer = io.BytesIO()
+        frame.save(buffer, format="PNG")
+        data = buffer.getvalue()
+        ihdr = None
+        idats = []
+        pos = len(PNG_SIGNATURE)
+        while pos < len(data):
+            length = struct.unpack(">I", data[pos:pos + 4])[0]
+            chunk_type = data[pos + 4:pos + 8]
+            chunk_data = data[pos + 8:pos + 8 + length]
+            if chunk_type == b"IHDR":
+                ihdr = chunk_data
+            elif chunk_type == b"IDAT":
+                idats.append(chunk_data)
+            pos += length + 12
+        return ihdr, idats
+
+    def add_frame(self, frame, duration=100, disposal=0):
+        """编码并写出一帧"""
+        frame = frame if frame.mode == "RGBA" else frame.convert("RGBA")
+        ihdr, idats = self._encode_frame(frame)
+
+        if self.frames_written == 0:
+            self.fp.write(PNG_SIGNATURE)
+            self._write_chunk(b"IHDR", ihdr)
+            if self.fp.seekable():
+                self.actl_offset = self.fp.tell()
+            self._write_chunk(b"acTL", struct.pack(">II", self.frame_count, self.loop))
+
+        # GIF语义的处置方式转换为APNG编码
+        dispose_op = max(0, min(2, disposal - 1))
+        self._write_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, frame.width, frame.height, 0, 0,
+            int(duration), 1000, dispose_op, 0))
+        self.sequence += 1
+
+        for data in idats:
+            if self.frames_written == 0:
+                self._write_chunk(b"IDAT", data)
+            else:
+                self._write_chunk(b"fdAT", struct.pack(">I", self.sequence) + data)
+                self.sequence += 1
+        self.frames_written += 1
+
+    def close(self):
+        self._write_chunk(b"IEND", b"")
+
+        # 实际帧数与预估不一致时修正acTL
+        if self.frames_written != self.frame_count and self.actl_offset is not None:
+            end = self.fp.tell()
+            self.fp.seek(self.actl_offset)
+            self.frame_count = self.frames_written
+            self._write_chunk(b"acTL", struct.pack(">II", self.frame_count, self.loop))
+            self.fp.seek(end)
+
+
+class FrameSequence:
+    """逐帧产生的图像，按多帧图像的接口（n_frames/seek）交给 Pillow 的 WebP 动画编码器
+
+    编码器按顺序 seek 每一帧再读取当前帧，这里每次只生成并保留当前帧；
+    各帧时长在生成时追加到 durations，编码器加入一帧之后才读取这一帧的时长。
+    """
+
+    def __init__(self, frames, n_frames, durations=None):
+        self.frames = iter(frames)
+        self.n_frames = n_frames
+        self.durations = durations if durations is not None else []
+        self.index = -1
+        self.frame = None
+
+    def seek(self, index):
+        if index == self.index:
+            return
+        if index != self.index + 1:
+            raise ValueError("逐帧生成的动画只能按顺序读取")
+        self.frame, duration, _ = next(self.frames)
+        self.durations.append(duration)
+        self.index = index
+
+    def __getattr__(self, name):
+        # mode、convert、getim 等都取当前帧的
+        return getattr(self.frame, name)
+
+
+def process_animation(source, output_path, format_code, edits=None, loop=None, palette_samples=8,
+                      progress=None, cancel_event=None, palette=None):
+    """逐帧处理动画并保存，保留每帧时长和处置方式
+
+    Args:
+        source: 源文件路径或文件对象
+        output_path: 输出文件路径
+        format_code: 'GIF'、'PNG'（APNG）或 'WEBP'
+        edits: 传给 apply_edits 的编辑参数
+        loop: 循环次数，None表示沿用源文件设置
+        palette_samples: 生成GIF共享调色板时抽样的帧数
+        progress: 进度回调，参数为0~1之间的完成比例
+        cancel_event: 取消标志（threading.Event），每帧处理前检查
+        palette: 预先生成的GIF调色板图像或 palette_values 列表（见 quantize.py），多个动画共用时提供，不再抽样
+
+    Returns:
+        写出的帧数
+    """
+    edits = edits or {}
+    if format_code not in ANIMATED_FORMATS:
+        raise ValueError(f"不支持的动画格式: {format_code}")
+
+    if edits.get("auto_levels") and not edits.get("levels"):
+        # 只分析第一帧，各帧使用同一张查找表，避免逐帧分析造成闪烁
+        with Image.open(source) as first:
+            levels = analyze_levels(first.convert("RGBA"), edits["auto_levels"])
+        if hasattr(source, "seek"):
+            source.seek(0)
+        edits = dict(edits, levels=levels, auto_levels=None)
+
+    if format_code == "GIF" and palette is None:
+        with Image.open(source) as sample:
+            palette = build_shared_palette(sample, edits, palette_samples)
+        if hasattr(source, "seek"):
+            source.seek(0)
+    elif palette is not None and not isinstance(palette, Image.Image):
+        palette = palette_image(palette)
+
+    with Image.open(source) as image:
+        if loop is None:
+            loop = image.info.get("loop", 0)
+        n_frames = getattr(image, "n_frames", 1)
+
+        def processed_frames():
+            for index, (frame, duration, disposal) in enumerate(iter_frames(image)):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TaskCancelled()
+                yield apply_edits(frame, **edits), duration, disposal
+                if progress:
+                    progress((index + 1) / n_frames)
+
+        with atomic_open(output_path) as fp:
+            if format_code == "WEBP":
+                # WebP动画编码器从 append_images 中逐帧读取，其余帧不必同时保留在内存中
+                frames = processed_frames()
+                first, duration, _ = next(frames)
+                rest = FrameSequence(frames, n_frames - 1, [duration])
+                first.save(fp, format="WEBP", save_all=True, append_images=[rest],
+                           duration=rest.durations, loop=loop)
+                return len(rest.durations)
+
+            if format_code == "GIF":
+                writer = GifStreamWriter(fp, palette, loop)
+            else:
+                writer = ApngStreamWriter(fp, n_frames, loop)
+            count = 0
+            for frame, duration, disposal in processed_frames():
+                writer.add_frame(frame, duration, disposal)
+                count += 1
+            writer.close()
+        return count
@@ -1,25 +1,59 @@
 import os
 import sys
 import io
-import tempfile
-import subprocess
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, Scale
-from PIL import Image, ImageTk, ImageEnhance, ImageOps
+from PIL import Image, ImageTk
 import threading
 
-# 添加TkinterDnD2支持
-try:
-    from tkinterdnd2 import DND_FILES, TkinterDnD
-except ImportError:
-    # 如果没有安装tkinterdnd2，给出友好提示
-    class TkinterDnD:
-        @staticmethod
-        def Tk():
-            root = tk.Tk()
-            messagebox.showwarning("缺少依赖", "未检测到tkinterdnd2库，拖放功能将不可用。\n请使用pip install tkinterdnd2安装。")
-            return root
-    DND_FILES = "<<DROP>>"
+from smart_crop import SmartCropper
+from pipeline import CROP_PRESETS, ratio_crop_size, to_output_mode, to_working_mode, transform_box, transform_geometry
+from tiling import adjust_colors_tiled, apply_edits_tiled
+from animation import ANIMATED_FORMATS, is_animated, process_animation
+from encoders import DEFAULT_PROFILE, PROFILE_LABELS, encoder_params, output_formats, save_to_size
+from background_io import BackgroundTask, atomic_open, load_image_file, save_image_file
+from mapped_image import source_of
+from memory_budget import DEFAULT_GOVERNOR, image_bytes
+from auto_levels import AUTO_METHODS, analyze_levels
+from histogram import HISTOGRAM_CHANNELS, LiveHistogram, clipping, display_peak, histogram_points
+from speculative import SPECULATIVE_CACHE_SIZE, SPECULATIVE_DELAY_MS, SpeculativeRenderer, preview_state, render_state
+from split_view import SplitView
+
+# 界面同时保留原图、显示图和预览等整图副本，加载时按内存预算的这一比例估算
+GUI_IMAGE_COPIES = 3
+
+# 色彩调整面板中直方图的尺寸和各通道的颜色
+HISTOGRAM_WIDTH = 256
+HISTOGRAM_HEIGHT = 80
+HISTOGRAM_COLORS = {"L": "gray60", "R": "red", "G": "green", "B": "blue"}
+
+# 分屏对比时分隔线的颜色和宽度
+SPLIT_LINE_COLOR = "yellow"
+SPLIT_LINE_WIDTH = 2
+
+# 自动调整按钮的文字
+AUTO_LABELS = {"levels": "自动色阶", "contrast": "自动对比度", "white_balance": "自动白平衡"}
+
+# 拖放事件类型，create_root 加载tkinterdnd2后替换为其中的定义
+DND_FILES = "<<DROP>>"
+
+
+def create_root():
+    """创建主窗口，安装了tkinterdnd2时使用支持拖放的Tk
+
+    tkinterdnd2 在这里才导入，导入本模块（以及批量/服务等无界面入口）时不会加载它。
+    """
+    global DND_FILES
+    try:
+        from tkinterdnd2 import DND_FILES, TkinterDnD
+    except ImportError:
+        # 如果没有安装tkinterdnd2，在窗口显示后给出友好提示
+        root = tk.Tk()
+        root.after_idle(lambda: messagebox.showwarning(
+            "缺少依赖", "未检测到tkinterdnd2库，拖放功能将不可用。\n请使用pip install tkinterdnd2安装。"))
+        return root
+    return TkinterDnD.Tk()
+
 
 class ImageTrimmerApp:
     def __init__(self, root):
@@ -32,12 +66,18 @@ class ImageTrimmerApp:
         self.target_path = tk.StringVar()
         self.new_filename = tk.StringVar()
         self.format_type = tk.StringVar(value="PNG")
+        self.encode_profile = tk.StringVar(value=PROFILE_LABELS[DEFAULT_PROFILE])
+        self.max_kb = tk.StringVar(value="")
+        self.fit_allow_resize = tk.BooleanVar(value=False)
         self.width = tk.IntVar()
         self.height = tk.IntVar()
         self.original_image = None
         self.display_image = None
+        self.loaded_path = None      # 原始图像对应的源文件，应用更改后清空
+        self.source_mode = None      # 源文件解码后的模式，保存时据此转换回合适的模式
         self.original_width = 0
         self.original_height = 0
+        self.source_is_animated = False  # 源文件是否为多帧动画
         self.crop_rect = None        # 裁剪矩形框引用
         self.crop_start = None       # 裁剪起始点
         self.is_cropping = False     # 是否正在裁剪标志
@@ -49,11 +89,26 @@ class ImageTrimmerApp:
         self.crop_offset = (0, 0)  # 添加这一行，用于跟踪裁剪框拖动偏移量
         self.image_on_canvas = None   # 画布上的图像引用
         self.preview_image = None     # 预览图像引用
+        self.io_task = None           # 正在执行的后台读写任务
+        self.speculative = SpeculativeRenderer()  # 空闲时预渲染相邻的旋转/翻转状态
+        self.speculation_job = None   # 尚未开始的预渲染定时任务
+        self.live_histogram = None    # 当前原图的实时直方图
+        self.histogram_lines = {}     # 直方图各通道的折线
+        self.levels = None            # 自动色阶得到的查找表，None表示不调整
+        self.split_view = SplitView() # 分屏对比的修改前图像缓存和分隔线位置
+        self.preview_crop = None      # "预览更改"的结果图像及其裁剪区域（原图坐标）
+        self.split_before = None      # 当前显示的修改前图像，None表示没有分屏
+        self.split_items = []         # 分屏对比的画布图元
+        self.split_photo = None       # 分隔线左侧的修改前图像
+        self.dragging_divider = False # 是否正在拖动分隔线
         
         # 添加图像变换相关变量
         self.rotation_angle = 0  # 旋转角度
         self.is_flipped_h = False  # 水平翻转标志
         self.is_flipped_v = False  # 垂直翻转标志
+        self.fine_angle = tk.DoubleVar(value=0.0)     # 在90度步进之外的微调角度（拉直）
+        self.auto_crop = tk.BooleanVar(value=False)   # 任意角度旋转后裁去空白角
+        self.compare_mode = tk.BooleanVar(value=False)  # 分屏对比修改前后
         
         # 添加色彩调整相关变量
         self.brightness_value = tk.DoubleVar(value=1.0)  # 亮度值
@@ -65,6 +120,7 @@ class ImageTrimmerApp:
         
         # 添加裁剪预设
         self.crop_preset = tk.StringVar(value="自定义")
+        self.smart_crop = tk.BooleanVar(value=False)  # 是否自动将裁剪框放置到显著区域
         
         # 创建界面
         self.create_widgets()
@@ -99,10 +155,17 @@ class ImageTrimmerApp:
         # 格式选择 - 添加图标格式
         ttk.Label(control_frame, text="输出格式:").grid(row=3, column=0, sticky=tk.W, pady=5)
         format_combobox = ttk.Combobox(control_frame, textvariable=self.format_type, 
-                                    values=["PNG", "JPEG", "GIF", "BMP", "TIFF", "ICO", "ICNS", "PNG图标集"])
-        format_combobox.grid(row=3, column=1, columnspan=2, pady=5, sticky=tk.W)
+                                    values=["PNG", "JPEG", "GIF", "BMP", "TIFF"]
+                                           + [f for f in output_formats() if f in ("WEBP", "AVIF")]
+                                           + ["ICO", "ICNS", "PNG图标集"])
+        format_combobox.grid(row=3, column=1, pady=5, sticky=tk.W)
         format_combobox.current(0)
         
+        # 编码档位：在编码速度和文件大小之间取舍
+        profile_combobox = ttk.Combobox(control_frame, textvariable=self.encode_profile, width=6,
+                                        values=list(PROFILE_LABELS.values()), state="readonly")
+        profile_combobox.grid(row=3, column=2, padx=5, pady=5, sticky=tk.W)
+        
         # 操作模式选择
         mode_frame = ttk.LabelFrame(control_frame, text="操作模式", padding="5")
         mode_frame.grid(row=4, column=0, columnspan=3, pady=10, sticky=tk.W+tk.E)
@@ -120,11 +183,10 @@ class ImageTrimmerApp:
         
         ttk.Label(preset_frame, text="裁剪预设:").pack(side=tk.LEFT, padx=5)
         preset_combobox = ttk.Combobox(preset_frame, textvariable=self.crop_preset, 
-                                      values=["自定义", "正方形 (1:1)", "Instagram (4:5)", 
-                                              "Facebook (16:9)", "Twitter (2:1)", 
-                                              "LinkedIn (1.91:1)", "微信 (4:3)"])
+                                      values=list(CROP_PRESETS))
         preset_combobox.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         preset_combobox.bind("<<ComboboxSelected>>", self.apply_crop_preset)
+        ttk.Checkbutton(preset_frame, text="智能定位", variable=self.smart_crop).pack(side=tk.LEFT, padx=5)
         
         # 添加显示裁剪框按钮
         self.show_crop_button = ttk.Button(control_frame, text="显示裁剪框", command=self.show_crop_box)
@@ -141,6 +203,12 @@ class ImageTrimmerApp:
         ttk.Label(size_frame, text="高度:").grid(row=1, column=0, sticky=tk.W, pady=5)
         ttk.Entry(size_frame, textvariable=self.height, width=10).grid(row=1, column=1, sticky=tk.W, pady=5)
         
+        # 文件大小上限：留空表示不限制
+        ttk.Label(size_frame, text="大小上限(KB):").grid(row=2, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(size_frame, textvariable=self.max_kb, width=10).grid(row=2, column=1, sticky=tk.W, pady=5)
+        ttk.Checkbutton(size_frame, text="必要时缩小尺寸", variable=self.fit_allow_resize).grid(
+            row=2, column=2, sticky=tk.W, padx=5, pady=5)
+        
         # 基础编辑模块 - 移到按钮上方
         basic_edit_frame = ttk.LabelFrame(control_frame, text="基础编辑", padding="5")
         basic_edit_frame.grid(row=7, column=0, columnspan=3, pady=10, sticky=tk.W+tk.E)
@@ -155,6 +223,20 @@ class ImageTrimmerApp:
         ttk.Button(transform_frame, text="水平翻转", command=self.flip_horizontal).pack(side=tk.LEFT, padx=2)
         ttk.Button(transform_frame, text="垂直翻转", command=self.flip_vertical).pack(side=tk.LEFT, padx=2)
         
+        # 任意角度微调（拉直），拖动时按显示分辨率预览
+        straighten_frame = ttk.Frame(basic_edit_frame)
+        straighten_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        ttk.Label(straighten_frame, text="微调角度:").pack(side=tk.LEFT, padx=5)
+        ttk.Scale(straighten_frame, from_=-45, to=45, variable=self.fine_angle,
+                  command=self.update_fine_angle).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        angle_spinbox = ttk.Spinbox(straighten_frame, from_=-45, to=45, increment=0.1, width=6,
+                                    textvariable=self.fine_angle, command=self.update_fine_angle)
+        angle_spinbox.pack(side=tk.LEFT, padx=2)
+        angle_spinbox.bind("<Return>", self.update_fine_angle)
+        ttk.Checkbutton(straighten_frame, text="裁去空白角", variable=self.auto_crop,
+                        command=self.update_fine_angle).pack(side=tk.LEFT, padx=2)
+        
         # 添加色彩调整滑块
         color_frame = ttk.Frame(basic_edit_frame)
         color_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -186,6 +268,20 @@ class ImageTrimmerApp:
                                      length=150, command=self.update_color_adjustments)
         saturation_slider.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        # 直方图：拖动滑块时实时更新，查看暗部和高光是否被截断
+        self.histogram_canvas = tk.Canvas(color_frame, width=HISTOGRAM_WIDTH, height=HISTOGRAM_HEIGHT,
+                                          bg="white", highlightthickness=0)
+        self.histogram_canvas.pack(pady=2)
+        self.clipping_label = ttk.Label(color_frame, text="截断: -")
+        self.clipping_label.pack()
+        
+        # 自动调整：分析直方图得到色阶查找表，之后仍可用滑块微调
+        auto_frame = ttk.Frame(color_frame)
+        auto_frame.pack(fill=tk.X, pady=2)
+        for method in AUTO_METHODS:
+            ttk.Button(auto_frame, text=AUTO_LABELS[method],
+                       command=lambda m=method: self.auto_adjust(m)).pack(side=tk.LEFT, padx=2)
+        
         # 重置色彩按钮
         reset_color_button = ttk.Button(color_frame, text="重置色彩", command=self.reset_color_adjustments)
         reset_color_button.pack(pady=5)
@@ -198,6 +294,9 @@ class ImageTrimmerApp:
         ttk.Button(buttons_frame, text="应用更改", command=self.apply_changes).grid(row=0, column=1, padx=5)
         ttk.Button(buttons_frame, text="保存图片", command=self.save_image).grid(row=0, column=2, padx=5)
         ttk.Button(buttons_frame, text="复原图片", command=self.reset_image).grid(row=0, column=3, padx=5)
+        ttk.Button(buttons_frame, text="按配方导出...", command=self.export_recipe).grid(row=1, column=0, columnspan=4, pady=5)
+        ttk.Checkbutton(buttons_frame, text="分屏对比修改前后", variable=self.compare_mode,
+                        command=self.toggle_compare).grid(row=2, column=0, columnspan=4)
         
         # 图片信息
         self.info_frame = ttk.LabelFrame(control_frame, text="图片信息", padding="5")
@@ -256,10 +355,19 @@ class ImageTrimmerApp:
         self.canvas.bind("<ButtonRelease-1>", self.end_crop)
         
         # 状态栏
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        
         self.status_var = tk.StringVar()
         self.status_var.set("就绪")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # 后台读写进度条和取消按钮
+        self.cancel_button = ttk.Button(status_frame, text="取消", command=self.cancel_io_task, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT)
+        self.progress_bar = ttk.Progressbar(status_frame, mode="determinate", maximum=100, length=200)
+        self.progress_bar.pack(side=tk.RIGHT, padx=5)
         
         # 绑定窗口大小调整事件
         self.root.bind("<Configure>", self.on_window_resize)
@@ -296,29 +404,57 @@ class ImageTrimmerApp:
             self.canvas.delete(self.drag_prompt)
             self.drag_prompt = None
         
+        path = self.source_path.get()
+        if not path or not os.path.exists(path):
+            messagebox.showerror("错误", "请选择有效的图片文件")
+            self.status_var.set("就绪")
+            return
+        
+        # 在后台线程中解码，完成后回到界面线程更新显示
+        self.status_var.set("正在加载图片...")
+        self.run_io_task(
+            lambda progress, cancel: self.read_image(path, progress, cancel),
+            lambda loaded: self.on_image_loaded(path, *loaded),
+            "加载图片时出错", "加载失败"
+        )
+    
+    def read_image(self, path, progress=None, cancel_event=None):
+        """解码图片（可在后台线程中调用），返回 (源图像, 工作模式的图像)"""
+        image = load_image_file(path, progress, cancel_event, budget=DEFAULT_GOVERNOR.budget // GUI_IMAGE_COPIES)
+        # 解码后立即转换为规范的工作模式，之后的编辑不再做隐式的模式转换
+        # （内存映射读取的图像保持原样，避免整图复制）
+        return image, image if source_of(image) else to_working_mode(image)
+    
+    def on_image_loaded(self, path, image, working):
+        """图片解码完成后更新界面状态
+
+        Args:
+            image: 解码得到的源图像
+            working: 转换为工作模式后的图像
+        """
         try:
-            self.status_var.set("正在加载图片...")
-            self.root.update()
-            
-            path = self.source_path.get()
-            if not path or not os.path.exists(path):
-                messagebox.showerror("错误", "请选择有效的图片文件")
-                self.status_var.set("就绪")
-                return
-            
-            # 使用PIL打开图片
-            self.original_image = Image.open(path)
+            # 超出内存预算的图像以缩小的代理图像载入，此时像素不再与源文件对应
+            factor = getattr(image, "proxy_factor", 1)
+            self.speculative.clear()
+            self.split_view.clear()
+            self.compare_mode.set(False)
+            self.original_image = working
+            self.loaded_path = path if factor == 1 else None
+            self.source_mode = image.mode
             self.original_width, self.original_height = self.original_image.size
             
+            # 动画只在界面中编辑第一帧，保存时再逐帧处理
+            self.source_is_animated = is_animated(image)
+            
             # 更新输入框中的图片尺寸
             self.width.set(self.original_width)
             self.height.set(self.original_height)
             
             # 显示图片信息
-            self.update_image_info(path)
+            self.update_image_info(path, image)
             
-            # 调整图片以适应显示区域
-            self.display_image = self.original_image.copy()
+            # 编辑操作都生成新图像，不会原地修改原图，显示图像直接共用原图，不再整图复制一次
+            self.display_image = self.original_image
             self.update_preview()
             
             # 确保加载新图片时清除已有的裁剪框
@@ -331,6 +467,8 @@ class ImageTrimmerApp:
             self.rotation_angle = 0
             self.is_flipped_h = False
             self.is_flipped_v = False
+            self.fine_angle.set(0.0)
+            self.auto_crop.set(False)
             
             # 重置色彩调整
             self.brightness_value.set(1.0)
@@ -340,18 +478,77 @@ class ImageTrimmerApp:
             # 重置裁剪预设
             self.crop_preset.set("自定义")
             
-            self.status_var.set("图片已加载")
+            # 从缩小的代理图像统计一次直方图，之后拖动滑块时不再读取原图
+            self.levels = None
+            self.live_histogram = LiveHistogram(self.original_image)
+            self.refresh_histogram()
+            
+            if factor > 1:
+                self.status_var.set(f"图片超出内存预算，已按 1/{factor:g} 尺寸载入")
+            else:
+                self.status_var.set("图片已加载")
         except Exception as e:
             messagebox.showerror("错误", f"加载图片时出错: {str(e)}")
             self.status_var.set("加载失败")
     
-    def update_image_info(self, path):
+    def run_io_task(self, func, on_success, error_message, failed_status):
+        """在后台线程中执行读写任务，完成后在界面线程中调用 on_success(结果)
+        
+        Args:
+            func: 任务函数，接收 progress 回调和 cancel_event 两个参数
+            on_success: 任务成功后的回调
+            error_message: 出错时提示信息的前缀
+            failed_status: 出错时状态栏显示的文字
+        """
+        # 新任务开始时取消尚未完成的旧任务和预渲染
+        self.cancel_speculation()
+        if self.io_task and not self.io_task.done:
+            self.io_task.cancel()
+        
+        self.io_task = BackgroundTask(func).start()
+        self.progress_bar["value"] = 0
+        self.cancel_button.config(state=tk.NORMAL)
+        self.root.after(50, self.poll_io_task, self.io_task, on_success, error_message, failed_status)
+    
+    def poll_io_task(self, task, on_success, error_message, failed_status):
+        """定时检查后台任务的进度和结果"""
+        # 任务已被新任务取代
+        if task is not self.io_task:
+            return
+        
+        if not task.done:
+            if task.progress is not None:
+                self.progress_bar["value"] = task.progress * 100
+            self.root.after(50, self.poll_io_task, task, on_success, error_message, failed_status)
+            return
+        
+        self.io_task = None
+        self.progress_bar["value"] = 0
+        self.cancel_button.config(state=tk.DISABLED)
+        
+        if task.cancelled:
+            self.status_var.set("操作已取消")
+        elif task.error:
+            messagebox.showerror("错误", f"{error_message}: {str(task.error)}")
+            self.status_var.set(failed_status)
+        else:
+            on_success(task.result)
+    
+    def cancel_io_task(self):
+        """取消正在执行的后台读写任务"""
+        if self.io_task and not self.io_task.done:
+            self.io_task.cancel()
+            self.status_var.set("正在取消...")
+    
+    def update_image_info(self, path, image):
         # 获取文件大小
         file_size = os.path.getsize(path)
         size_str = self.format_file_size(file_size)
         
-        # 获取图片格式
-        img_format = self.original_image.format or "未知"
+        # 获取图片格式（工作模式的图像是转换出来的，格式信息取自解码得到的源图像）
+        img_format = image.format or "未知"
+        if self.source_is_animated:
+            img_format += f" (动画, {image.n_frames}帧)"
         
         # 更新标签
         self.file_info_label.config(text=f"文件: {os.path.basename(path)}")
@@ -422,10 +619,65 @@ class ImageTrimmerApp:
                     )
                     # 更新坐标显示
                     self.update_crop_coords_display(current_coords)
+            
+            self.draw_split()
+    
+    def toggle_compare(self):
+        """打开或关闭分屏对比"""
+        self.draw_split()
+        if self.split_before is not None:
+            self.status_var.set("分屏对比：左侧为修改前，右侧为修改后，在预览图上拖动可移动分隔线")
+    
+    def clear_split(self):
+        for item in self.split_items:
+            self.canvas.delete(item)
+        self.split_items = []
+        self.split_before = None
+        self.split_photo = None
+        self.dragging_divider = False
+    
+    def draw_split(self):
+        """分屏对比打开时，在预览图上叠加分隔线左侧的修改前图像"""
+        self.clear_split()
+        if not self.compare_mode.get() or not self.display_image or not self.image_on_canvas:
+            return
+        
+        try:
+            before = self.split_view.before(self.original_image, self.current_preview_state(), self.display_image)
+        except Exception as e:
+            messagebox.showerror("错误", f"渲染修改前的图像时出错: {str(e)}")
+            return
+        if before.size != self.display_image.size:
+            # "预览修改"按输出尺寸缩放/裁剪后的图像与编辑状态不对应，无法逐像素对比
+            self.status_var.set("当前预览不是编辑状态的显示图像，无法分屏对比")
+            return
+        
+        self.split_before = before
+        x0, y0 = self.canvas.coords(self.image_on_canvas)[:2]
+        self.split_items = [
+            self.canvas.create_image(x0, y0, anchor=tk.NW),
+            self.canvas.create_line(x0, y0, x0, y0 + before.height,
+                                    fill=SPLIT_LINE_COLOR, width=SPLIT_LINE_WIDTH),
+        ]
+        # 裁剪框保持在最上层
+        if self.crop_rect:
+            self.canvas.tag_raise(self.crop_rect)
+        self.move_divider(x0 + self.split_view.divider(before.width))
+    
+    def move_divider(self, canvas_x):
+        """把分隔线移到画布横坐标 canvas_x：只裁出修改前图像左侧的一段交给画布"""
+        x0, y0 = self.canvas.coords(self.image_on_canvas)[:2]
+        x = self.split_view.move(canvas_x - x0, self.split_before.width)
+        left = self.split_view.left_part(self.split_before)
+        image_item, line_item = self.split_items
+        self.split_photo = ImageTk.PhotoImage(left) if left is not None else None
+        self.canvas.itemconfig(image_item, image=self.split_photo or "")
+        self.canvas.coords(line_item, x0 + x, y0, x0 + x, y0 + self.split_before.height)
     
     def zoom_image(self, event):
         if not self.original_image:
             return
+        self.cancel_speculation()
         
         # 保存当前裁剪框的绝对位置（如果有）
         crop_coords = None
@@ -481,6 +733,7 @@ class ImageTrimmerApp:
         if not self.original_image:
             messagebox.showwarning("警告", "请先选择一张图片")
             return
+        self.cancel_speculation()
         
         try:
             # 获取用户输入的新尺寸
@@ -493,7 +746,8 @@ class ImageTrimmerApp:
             
             # 获取操作模式
             mode = self.operation_mode.get()
-            processed_image = self.original_image.copy()
+            processed_image = self.original_image
+            crop_box = None
             
             # 在"both"模式下的处理顺序：先缩放原图，再进行裁剪
             if mode == 'both':
@@ -540,6 +794,7 @@ class ImageTrimmerApp:
                             # 确保裁剪区域有效
                             if x2 > x1 and y2 > y1:
                                 processed_image = processed_image.crop((x1, y1, x2, y2))
+                                crop_box = tuple(v / self.zoom_scale for v in (x1, y1, x2, y2))
                                 self.status_var.set(f"应用缩放({self.zoom_scale:.1f}x)和裁剪至{processed_image.width}x{processed_image.height}")
                             else:
                                 # 如果裁剪区域太小，显示警告
@@ -597,6 +852,7 @@ class ImageTrimmerApp:
                         # 确保裁剪区域有效
                         if x2 > x1 and y2 > y1:
                             processed_image = processed_image.crop((x1, y1, x2, y2))
+                            crop_box = (x1, y1, x2, y2)
                             self.status_var.set(f"应用裁剪: {processed_image.width}x{processed_image.height}")
                         else:
                             messagebox.showwarning("警告", "裁剪框与图片的交集太小，无法应用裁剪")
@@ -611,8 +867,9 @@ class ImageTrimmerApp:
             if processed_image.size != (new_width, new_height):
                 processed_image = processed_image.resize((new_width, new_height), Image.LANCZOS)
             
-            # 更新显示
+            # 更新显示；逐帧保存动画时按记录的裁剪区域裁剪每一帧
             self.display_image = processed_image
+            self.preview_crop = (processed_image, crop_box) if crop_box else None
             self.update_preview()
             
         except Exception as e:
@@ -625,6 +882,10 @@ class ImageTrimmerApp:
             messagebox.showwarning("警告", "没有可保存的图片")
             return
         
+        # 保存时才用到的模块，不在启动时加载
+        from icon_converter import IconConverter
+        from passthrough import PassthroughPlan, matches_geometry
+        
         try:
             # 获取目标路径和文件名
             target_dir = self.target_path.get()
@@ -643,27 +904,40 @@ class ImageTrimmerApp:
             # 获取输出格式
             format_str = self.format_type.get()
             
+            # 编码在后台线程中进行，这里固定住当前要保存的图像
+            image = self.display_image
+            
             # 检查是否是图标格式
             if "ICO" in format_str:
                 # 保存为ICO图标
                 save_path = os.path.join(target_dir, f"{filename}.ico")
-                IconConverter.create_ico(self.display_image, save_path)
-                self.status_var.set(f"图标已保存到: {save_path}")
-                messagebox.showinfo("保存成功", f"图标已保存到:\n{save_path}")
+                self.status_var.set("正在保存图标...")
+                self.run_io_task(
+                    lambda progress, cancel: IconConverter.create_ico(image, save_path),
+                    lambda path: self.on_image_saved(f"图标已保存到: {path}", f"图标已保存到:\n{path}"),
+                    "保存图像时出错", "保存失败"
+                )
                 return
             elif "ICNS" in format_str:
                 # 保存为ICNS图标
                 save_path = os.path.join(target_dir, f"{filename}.icns")
-                IconConverter.create_icns(self.display_image, save_path)
-                self.status_var.set(f"图标已保存到: {save_path}")
-                messagebox.showinfo("保存成功", f"图标已保存到:\n{save_path}")
+                self.status_var.set("正在保存图标...")
+                self.run_io_task(
+                    lambda progress, cancel: IconConverter.create_icns(image, save_path),
+                    lambda path: self.on_image_saved(f"图标已保存到: {path}", f"图标已保存到:\n{path}"),
+                    "保存图像时出错", "保存失败"
+                )
                 return
             elif "PNG图标集" in format_str:
                 # 保存为PNG图标集
                 save_path = os.path.join(target_dir, f"{filename}.png")
-                icons_dir = self.export_png_icon_set(self.display_image, save_path)
-                self.status_var.set(f"PNG图标集已保存到: {icons_dir}")
-                messagebox.showinfo("保存成功", f"PNG图标集已保存到:\n{icons_dir}")
+                self.status_var.set("正在保存PNG图标集...")
+                self.run_io_task(
+                    lambda progress, cancel: self.export_png_icon_set(image, save_path),
+                    lambda icons_dir: self.on_image_saved(f"PNG图标集已保存到: {icons_dir}",
+                                                          f"PNG图标集已保存到:\n{icons_dir}"),
+                    "保存图像时出错", "保存失败"
+                )
                 return
             
             # 处理常规图像格式
@@ -672,7 +946,9 @@ class ImageTrimmerApp:
                 "JPEG": "JPEG",
                 "GIF": "GIF",
                 "BMP": "BMP",
-                "TIFF": "TIFF"
+                "TIFF": "TIFF",
+                "WEBP": "WEBP",
+                "AVIF": "AVIF"
             }
             
             # 从格式选择中提取格式代码
@@ -687,7 +963,9 @@ class ImageTrimmerApp:
                 "JPEG": ".jpg",
                 "GIF": ".gif",
                 "BMP": ".bmp",
-                "TIFF": ".tiff"
+                "TIFF": ".tiff",
+                "WEBP": ".webp",
+                "AVIF": ".avif"
             }
             
             # 选择正确的扩展名
@@ -697,16 +975,146 @@ class ImageTrimmerApp:
                 
             save_path = os.path.join(target_dir, filename)
             
-            # 保存图像
-            self.display_image.save(save_path, format=format_map[format_code])
-            self.status_var.set(f"图像已保存到: {save_path}")
-            messagebox.showinfo("保存成功", f"图像已保存到:\n{save_path}")
+            # 保存前按输出格式从工作模式转换回去（在后台线程中进行，同一图像的转换结果会被缓存）
+            source_mode = self.source_mode
+            
+            def output_image():
+                return to_output_mode(image, format_map[format_code], source_mode)
+            
+            # 像素相对源文件没有变化，或者只做了可以用方向标记表示的旋转/翻转时，不重新编码
+            plan = None
+            if self.loaded_path and not self.source_is_animated and not self.max_kb.get().strip():
+                try:
+                    plan = PassthroughPlan(self.loaded_path, self.current_edits())
+                except Exception:
+                    plan = None
+            if plan and plan.applies(format_map[format_code]):
+                original = self.original_image
+                edits = self.current_edits()
+                profile = next(key for key, label in PROFILE_LABELS.items() if label == self.encode_profile.get())
+                
+                def passthrough_or_save(progress, cancel):
+                    if matches_geometry(image, original, edits["rotation"], edits["flip_h"], edits["flip_v"]):
+                        return plan.write(save_path)
+                    return save_image_file(output_image(), save_path, format_map[format_code], progress, cancel,
+                                           **encoder_params(format_map[format_code], profile))
+                
+                self.status_var.set("正在保存图像...")
+                self.run_io_task(
+                    passthrough_or_save,
+                    lambda path: self.on_image_saved(f"图像已保存到: {path}", f"图像已保存到:\n{path}"),
+                    "保存图像时出错", "保存失败"
+                )
+                return
+            
+            # 动画源文件逐帧处理，保留动画
+            if self.source_is_animated and format_code in ANIMATED_FORMATS:
+                source = self.source_path.get()
+                edits = self.current_edits()
+                self.status_var.set("正在逐帧处理动画...")
+                self.run_io_task(
+                    lambda progress, cancel: process_animation(source, save_path, format_code, edits=edits,
+                                                               progress=progress, cancel_event=cancel),
+                    lambda frame_count: self.on_image_saved(f"动画已保存到: {save_path} ({frame_count}帧)",
+                                                            f"动画已保存到:\n{save_path}"),
+                    "保存图像时出错", "保存失败"
+                )
+                return
+            
+            # 按所选档位设置编码参数
+            profile = next(key for key, label in PROFILE_LABELS.items() if label == self.encode_profile.get())
+            params = encoder_params(format_map[format_code], profile)
+            
+            # 有大小上限时在内存中搜索编码质量，只写入最终结果
+            max_kb = self.max_kb.get().strip()
+            if max_kb:
+                try:
+                    max_bytes = int(float(max_kb) * 1024)
+                except ValueError:
+                    messagebox.showerror("错误", "大小上限必须是数字")
+                    return
+                allow_resize = self.fit_allow_resize.get()
+                self.status_var.set("正在搜索满足大小上限的编码质量...")
+                self.run_io_task(
+                    lambda progress, cancel: save_to_size(output_image(), save_path, format_map[format_code],
+                                                          max_bytes, profile, allow_resize, progress, cancel),
+                    lambda result: self.on_image_saved(
+                        f"图像已保存到: {result[0]} ({result[2][0]}x{result[2][1]}, "
+                        f"{os.path.getsize(result[0]) // 1024}KB)",
+                        f"图像已保存到:\n{result[0]}"),
+                    "保存图像时出错", "保存失败"
+                )
+                return
+            
+            # 保存图像：写入临时文件后原子重命名，中断时不会留下不完整的文件
+            self.status_var.set("正在保存图像...")
+            self.run_io_task(
+                lambda progress, cancel: save_image_file(output_image(), save_path, format_map[format_code],
+                                                         progress, cancel, **params),
+                lambda path: self.on_image_saved(f"图像已保存到: {path}", f"图像已保存到:\n{path}"),
+                "保存图像时出错", "保存失败"
+            )
             
         except Exception as e:
             messagebox.showerror("保存失败", f"保存图像时出错: {str(e)}")
             self.status_var.set("保存失败")
 
+    def export_recipe(self):
+        """按配方文件从当前图像一次性导出多个裁剪、尺寸和格式"""
+        from batch import export_variants, load_recipe
+        
+        if not self.original_image:
+            messagebox.showwarning("警告", "请先选择一张图片")
+            return
+        
+        recipe_path = filedialog.askopenfilename(
+            title="选择导出配方",
+            filetypes=[("JSON配方", "*.json"), ("所有文件", "*.*")]
+        )
+        if not recipe_path:
+            return
+        
+        target_dir = self.target_path.get()
+        if not target_dir:
+            messagebox.showerror("错误", "请指定目标文件夹")
+            return
+        
+        try:
+            recipe = load_recipe(recipe_path)
+        except Exception as e:
+            messagebox.showerror("错误", f"读取配方时出错: {str(e)}")
+            return
+        
+        # 使用界面中的编辑状态作为基础，不再按显示尺寸缩放
+        source = self.source_path.get()
+        original = self.original_image
+        edits = self.current_edits()
+        edits.pop("size", None)
+        stem = self.new_filename.get() or None
+        
+        def task(progress, cancel):
+            base = apply_edits_tiled(original, **edits)
+            return export_variants(source, recipe, target_dir, base=base, stem=stem)
+        
+        self.status_var.set("正在按配方导出...")
+        self.run_io_task(
+            task,
+            lambda paths: self.on_image_saved(f"已按配方导出 {len(paths)} 个文件到: {target_dir}",
+                                              f"已导出 {len(paths)} 个文件到:\n{target_dir}"),
+            "按配方导出时出错", "导出失败"
+        )
+
+    def on_image_saved(self, status, message):
+        """后台保存完成后更新状态并提示用户"""
+        self.status_var.set(status)
+        messagebox.showinfo("保存成功", message)
+
     def start_crop(self, event):
+        if self.split_before is not None:
+            # 分屏对比时鼠标用来拖动分隔线
+            self.dragging_divider = True
+            self.move_divider(self.canvas.canvasx(event.x))
+            return
         if self.operation_mode.get() in ['crop', 'both'] and self.display_image and self.crop_rect:
             # 获取相对于画布的坐标
             x = self.canvas.canvasx(event.x)
@@ -723,6 +1131,9 @@ class ImageTrimmerApp:
                 self.status_var.set("正在移动裁剪框...")
 
     def update_crop(self, event):
+        if self.dragging_divider:
+            self.move_divider(self.canvas.canvasx(event.x))
+            return
         if self.is_cropping and self.crop_rect:
             x = self.canvas.canvasx(event.x)
             y = self.canvas.canvasy(event.y)
@@ -756,6 +1167,9 @@ class ImageTrimmerApp:
             self.update_crop_coords_display([new_x1, new_y1, new_x2, new_y2])
 
     def end_crop(self, event):
+        if self.dragging_divider:
+            self.dragging_divider = False
+            return
         if self.is_cropping:
             self.is_cropping = False
             self.status_var.set("裁剪框位置已更新")
@@ -801,6 +1215,15 @@ class ImageTrimmerApp:
             # 计算裁剪框坐标，使其居中于画布
             x1 = (canvas_width - target_width) / 2
             y1 = (canvas_height - target_height) / 2
+            
+            # 智能定位：根据图像显著性选择裁剪框位置
+            if self.smart_crop.get() and self.image_on_canvas:
+                img_coords = self.canvas.coords(self.image_on_canvas)
+                if img_coords and len(img_coords) >= 2:
+                    left, top, _, _ = SmartCropper.find_best_crop(self.display_image, target_width, target_height)
+                    x1 = img_coords[0] + left
+                    y1 = img_coords[1] + top
+            
             x2 = x1 + target_width
             y2 = y1 + target_height
             
@@ -840,12 +1263,15 @@ class ImageTrimmerApp:
         if not self.original_image:
             messagebox.showwarning("警告", "没有可复原的图片")
             return
+        self.cancel_speculation()
         
         try:
             # 重置图像变换状态
             self.rotation_angle = 0
             self.is_flipped_h = False
             self.is_flipped_v = False
+            self.fine_angle.set(0.0)
+            self.auto_crop.set(False)
             
             # 重置色彩调整
             self.brightness_value.set(1.0)
@@ -855,8 +1281,10 @@ class ImageTrimmerApp:
             # 重置裁剪预设
             self.crop_preset.set("自定义")
             
-            # 重置显示图像为原始图像的一个副本
-            self.display_image = self.original_image.copy()
+            # 重置显示图像为原始图像
+            self.levels = None
+            self.display_image = self.original_image
+            self.refresh_histogram()
             
             # 重置缩放比例
             self.zoom_scale = 1.0
@@ -895,9 +1323,27 @@ class ImageTrimmerApp:
             if not result:
                 return
             
-            # 设置当前图像为新的原始图像
-            self.original_image = self.display_image.copy()
+            # 设置当前图像为新的原始图像，之后不再与源文件逐字节对应
+            self.speculative.clear()
+            self.split_view.clear()
+            if self.fine_angle_value():
+                # 任意角度旋转的预览只是显示分辨率的代理，新的基础图像按全分辨率重新旋转一次
+                transformed_image = transform_geometry(self.original_image, self.total_rotation(),
+                                                       self.is_flipped_h, self.is_flipped_v, self.auto_crop.get())
+                self.original_image = self.apply_color_adjustments(transformed_image)
+                self.rotation_angle = 0
+                self.is_flipped_h = False
+                self.is_flipped_v = False
+                self.fine_angle.set(0.0)
+                self.auto_crop.set(False)
+            else:
+                self.original_image = self.display_image
+            self.loaded_path = None
             self.original_width, self.original_height = self.original_image.size
+            # 色阶已经作用在新的基础图像上
+            self.levels = None
+            self.live_histogram = LiveHistogram(self.original_image)
+            self.refresh_histogram()
             
             # 重置缩放比例
             self.zoom_scale = 1.0
@@ -914,7 +1360,7 @@ class ImageTrimmerApp:
                 self.update_crop_coords_display(None)
             
             # 更新显示
-            self.display_image = self.original_image.copy()
+            self.display_image = self.original_image
             self.update_preview()
             
             # 更新状态
@@ -1038,35 +1484,13 @@ class ImageTrimmerApp:
             # 更新旋转角度
             self.rotation_angle = (self.rotation_angle + angle) % 360
             
-            # 应用旋转到原始图像
-            rotated_image = self.original_image.rotate(self.rotation_angle, expand=True, resample=Image.BICUBIC)
-            
-            # 如果有应用翻转，也要应用
-            if self.is_flipped_h:
-                rotated_image = ImageOps.mirror(rotated_image)
-            if self.is_flipped_v:
-                rotated_image = ImageOps.flip(rotated_image)
-            
-            # 应用色彩调整
-            processed_image = self.apply_color_adjustments(rotated_image)
-            
-            # 更新显示图像
-            self.original_width, self.original_height = processed_image.size
-            
-            # 调整显示图像大小
-            self.display_image = processed_image.resize(
-                (int(self.original_width * self.zoom_scale), 
-                 int(self.original_height * self.zoom_scale)), 
-                Image.LANCZOS
-            )
+            # 显示旋转后的图像（空闲时已预渲染的直接取出）
+            self.show_geometry_state()
             
             # 更新尺寸输入框
             self.width.set(self.original_width)
             self.height.set(self.original_height)
             
-            # 更新预览
-            self.update_preview()
-            
             # 更新状态
             self.status_var.set(f"图像已旋转 {angle}°，当前旋转角度: {self.rotation_angle}°")
         
@@ -1084,30 +1508,8 @@ class ImageTrimmerApp:
             # 切换水平翻转标志
             self.is_flipped_h = not self.is_flipped_h
             
-            # 应用变换到原始图像
-            flipped_image = self.original_image.rotate(self.rotation_angle, expand=True, resample=Image.BICUBIC)
-            
-            # 应用翻转
-            if self.is_flipped_h:
-                flipped_image = ImageOps.mirror(flipped_image)
-            if self.is_flipped_v:
-                flipped_image = ImageOps.flip(flipped_image)
-            
-            # 应用色彩调整
-            processed_image = self.apply_color_adjustments(flipped_image)
-            
-            # 更新显示图像
-            self.original_width, self.original_height = processed_image.size
-            
-            # 调整显示图像大小
-            self.display_image = processed_image.resize(
-                (int(self.original_width * self.zoom_scale), 
-                 int(self.original_height * self.zoom_scale)), 
-                Image.LANCZOS
-            )
-            
-            # 更新预览
-            self.update_preview()
+            # 显示翻转后的图像（空闲时已预渲染的直接取出）
+            self.show_geometry_state()
             
             # 更新状态
             self.status_var.set(f"图像已{'应用' if self.is_flipped_h else '取消'}水平翻转")
@@ -1126,30 +1528,8 @@ class ImageTrimmerApp:
             # 切换垂直翻转标志
             self.is_flipped_v = not self.is_flipped_v
             
-            # 应用变换到原始图像
-            flipped_image = self.original_image.rotate(self.rotation_angle, expand=True, resample=Image.BICUBIC)
-            
-            # 应用翻转
-            if self.is_flipped_h:
-                flipped_image = ImageOps.mirror(flipped_image)
-            if self.is_flipped_v:
-                flipped_image = ImageOps.flip(flipped_image)
-            
-            # 应用色彩调整
-            processed_image = self.apply_color_adjustments(flipped_image)
-            
-            # 更新显示图像
-            self.original_width, self.original_height = processed_image.size
-            
-            # 调整显示图像大小
-            self.display_image = processed_image.resize(
-                (int(self.original_width * self.zoom_scale), 
-                 int(self.original_height * self.zoom_scale)), 
-                Image.LANCZOS
-            )
-            
-            # 更新预览
-            self.update_preview()
+            # 显示翻转后的图像（空闲时已预渲染的直接取出）
+            self.show_geometry_state()
             
             # 更新状态
             self.status_var.set(f"图像已{'应用' if self.is_flipped_v else '取消'}垂直翻转")
@@ -1158,12 +1538,87 @@ class ImageTrimmerApp:
             messagebox.showerror("错误", f"翻转图像时出错: {str(e)}")
             self.status_var.set("翻转失败")
 
+    def fine_angle_value(self):
+        """微调角度（保留一位小数），输入框中不是数字时按0处理"""
+        try:
+            return round(self.fine_angle.get(), 1)
+        except (tk.TclError, ValueError):
+            return 0.0
+
+    def total_rotation(self):
+        """90度步进的旋转加上微调角度"""
+        fine = self.fine_angle_value()
+        return (self.rotation_angle + fine) % 360 if fine else self.rotation_angle
+
+    def update_fine_angle(self, *args):
+        """微调角度或空白角裁切改变时更新预览"""
+        if not self.original_image:
+            return
+        
+        try:
+            self.show_geometry_state()
+            
+            # 更新尺寸输入框
+            self.width.set(self.original_width)
+            self.height.set(self.original_height)
+            
+            self.status_var.set(f"当前旋转角度: {self.total_rotation():g}°")
+        
+        except Exception as e:
+            messagebox.showerror("错误", f"旋转图像时出错: {str(e)}")
+            self.status_var.set("旋转失败")
+
+    def current_preview_state(self):
+        """当前编辑状态对应的预渲染缓存键"""
+        return preview_state(self.total_rotation(), self.is_flipped_h, self.is_flipped_v,
+                             self.brightness_value.get(), self.contrast_value.get(),
+                             self.saturation_value.get(), self.zoom_scale, self.levels,
+                             self.auto_crop.get())
+
+    def show_geometry_state(self):
+        """按当前的旋转/翻转状态更新显示，优先使用空闲时预渲染的结果，之后再预渲染下一步"""
+        state = self.current_preview_state()
+        rendered = self.speculative.take(self.original_image, state)
+        # 真正的渲染开始前取消仍在进行的预渲染
+        self.cancel_speculation()
+        if rendered is None:
+            rendered = render_state(self.original_image, state)
+        self.display_image, (self.original_width, self.original_height) = rendered
+        self.update_preview()
+        self.schedule_speculation()
+
+    def schedule_speculation(self):
+        """界面空闲一段时间后开始预渲染相邻的几何状态"""
+        self.cancel_speculation()
+        self.speculation_job = self.root.after(SPECULATIVE_DELAY_MS, self.start_speculation)
+
+    def start_speculation(self):
+        self.speculation_job = None
+        if not self.original_image or not self.display_image:
+            return
+        # 每个相邻状态都要保留一张显示图像，超出内存预算时不预渲染
+        nbytes = image_bytes(self.display_image.mode, self.display_image.size) * SPECULATIVE_CACHE_SIZE
+        if nbytes > DEFAULT_GOVERNOR.budget // GUI_IMAGE_COPIES:
+            return
+        self.speculative.start(self.original_image, self.current_preview_state())
+
+    def cancel_speculation(self):
+        """有真正的任务到来时立即取消预渲染（包括尚未开始的）"""
+        if self.speculation_job:
+            self.root.after_cancel(self.speculation_job)
+            self.speculation_job = None
+        self.speculative.cancel()
+
     def update_color_adjustments(self, *args):
         """当色彩调整滑块改变时更新图像"""
         if not self.original_image:
             return
         
+        # 直方图由查找表推算，立即更新，不等待下面的延迟渲染
+        self.refresh_histogram()
+        
         # 设置重新渲染标志
+        self.cancel_speculation()
         self.need_rerender = True
         
         # 使用定时器延迟处理，避免频繁更新
@@ -1177,27 +1632,9 @@ class ImageTrimmerApp:
         self.need_rerender = False
         
         try:
-            # 从原始图像开始进行所有变换
-            transformed_image = self.original_image.rotate(self.rotation_angle, expand=True, resample=Image.BICUBIC)
-            
-            # 应用翻转
-            if self.is_flipped_h:
-                transformed_image = ImageOps.mirror(transformed_image)
-            if self.is_flipped_v:
-                transformed_image = ImageOps.flip(transformed_image)
-            
-            # 应用色彩调整
-            processed_image = self.apply_color_adjustments(transformed_image)
-            
-            # 更新显示图像
-            self.original_width, self.original_height = processed_image.size
-            
-            # 调整显示图像大小
-            self.display_image = processed_image.resize(
-                (int(self.original_width * self.zoom_scale), 
-                 int(self.original_height * self.zoom_scale)), 
-                Image.LANCZOS
-            )
+            # 从原始图像开始进行所有变换并按缩放比例缩放（缩小显示时按显示分辨率处理）
+            self.display_image, (self.original_width, self.original_height) = render_state(
+                self.original_image, self.current_preview_state())
             
             # 更新预览
             self.update_preview()
@@ -1209,36 +1646,75 @@ class ImageTrimmerApp:
             messagebox.showerror("错误", f"应用色彩调整时出错: {str(e)}")
             self.status_var.set("色彩调整失败")
 
+    def refresh_histogram(self):
+        """按当前的色彩参数重绘直方图和截断比例"""
+        if self.live_histogram is None:
+            return
+        histograms = self.live_histogram.adjusted(
+            self.brightness_value.get(), self.contrast_value.get(), self.saturation_value.get(), self.levels)
+        peak = display_peak(histograms)
+        for band in HISTOGRAM_CHANNELS:
+            points = histogram_points(histograms[band], HISTOGRAM_WIDTH, HISTOGRAM_HEIGHT, peak)
+            line = self.histogram_lines.get(band)
+            if line is None:
+                self.histogram_lines[band] = self.histogram_canvas.create_line(*points, fill=HISTOGRAM_COLORS[band])
+            else:
+                self.histogram_canvas.coords(line, *points)
+        # 任一颜色通道被截断都会丢失细节，取各通道中最大的比例
+        shadows = max(clipping(histograms[band])[0] for band in "RGB")
+        highlights = max(clipping(histograms[band])[1] for band in "RGB")
+        self.clipping_label.config(text=f"截断: 暗部 {shadows:.1%}  高光 {highlights:.1%}")
+
     def apply_color_adjustments(self, image):
         """应用色彩调整到给定图像"""
         try:
-            brightness = self.brightness_value.get()
-            contrast = self.contrast_value.get()
-            saturation = self.saturation_value.get()
-            
-            # 应用亮度
-            if brightness != 1.0:
-                enhancer = ImageEnhance.Brightness(image)
-                image = enhancer.enhance(brightness)
-            
-            # 应用对比度
-            if contrast != 1.0:
-                enhancer = ImageEnhance.Contrast(image)
-                image = enhancer.enhance(contrast)
-            
-            # 应用饱和度
-            if saturation != 1.0:
-                enhancer = ImageEnhance.Color(image)
-                image = enhancer.enhance(saturation)
-            
-            return image
+            # 超大图像分块并行处理
+            return adjust_colors_tiled(
+                image,
+                self.brightness_value.get(),
+                self.contrast_value.get(),
+                self.saturation_value.get(),
+                self.levels,
+            )
         
         except Exception as e:
             print(f"应用色彩调整时出错: {str(e)}")
             return image  # 返回原始图像
 
+    def current_edits(self):
+        """以处理核心使用的参数形式返回当前的编辑状态"""
+        edits = {
+            "rotation": self.total_rotation(),
+            "flip_h": self.is_flipped_h,
+            "flip_v": self.is_flipped_v,
+            "brightness": self.brightness_value.get(),
+            "contrast": self.contrast_value.get(),
+            "saturation": self.saturation_value.get(),
+        }
+        if self.levels:
+            edits["levels"] = self.levels
+        if self.auto_crop.get():
+            edits["auto_crop"] = True
+        if self.preview_crop and self.preview_crop[0] is self.display_image:
+            # 只在显示的仍是"预览更改"的结果时有效；裁剪区域换算到旋转/翻转之后的坐标
+            edits["crop_box"] = transform_box(self.preview_crop[1], self.original_image.size, edits["rotation"],
+                                              self.is_flipped_h, self.is_flipped_v, self.auto_crop.get())
+        if self.display_image:
+            edits["size"] = self.display_image.size
+        return edits
+
+    def auto_adjust(self, method):
+        """分析当前原图的直方图，用得到的色阶查找表代替手动调整"""
+        if not self.original_image:
+            messagebox.showwarning("警告", "请先选择一张图片")
+            return
+        self.levels = analyze_levels(self.original_image, method)
+        self.update_color_adjustments()
+        self.status_var.set(f"已应用{AUTO_LABELS[method]}")
+
     def reset_color_adjustments(self):
         """重置所有色彩调整为默认值"""
+        self.levels = None
         self.brightness_value.set(1.0)
         self.contrast_value.set(1.0)
         self.saturation_value.set(1.0)
@@ -1256,16 +1732,8 @@ class ImageTrimmerApp:
         
         preset = self.crop_preset.get()
         
-        # 定义各种预设的宽高比
-        presets = {
-            "自定义": None,  # 不做特殊处理
-            "正方形 (1:1)": (1, 1),
-            "Instagram (4:5)": (4, 5),
-            "Facebook (16:9)": (16, 9),
-            "Twitter (2:1)": (2, 1),
-            "LinkedIn (1.91:1)": (1.91, 1),
-            "微信 (4:3)": (4, 3)
-        }
+        # 各种预设的宽高比
+        presets = CROP_PRESETS
         
         if preset not in presets or presets[preset] is None:
             return
@@ -1274,18 +1742,8 @@ class ImageTrimmerApp:
             # 获取预设的宽高比
             ratio_w, ratio_h = presets[preset]
             
-            # 获取原始图像的宽高
-            orig_w, orig_h = self.original_width, self.original_height
-            
-            # 计算最适合的裁剪尺寸
-            # 先尝试用原始宽度来计算
-            crop_w = orig_w
-            crop_h = int(crop_w * ratio_h / ratio_w)
-            
-            # 如果计算出的高度超出原图，就用原始高度来计算
-            if crop_h > orig_h:
-                crop_h = orig_h
-                crop_w = int(crop_h * ratio_w / ratio_h)
+            # 根据原始图像的宽高计算最适合的裁剪尺寸
+            crop_w, crop_h = ratio_crop_size(self.original_width, self.original_height, ratio_w, ratio_h)
             
             # 更新宽高输入框
             self.width.set(crop_w)
@@ -1307,6 +1765,8 @@ class ImageTrimmerApp:
         Args:
             format_type: 'ico', 'icns' 或 'png_set'
         """
+        from icon_converter import IconConverter
+        
         if not self.original_image:
             messagebox.showwarning("警告", "请先选择一张图片")
             return
@@ -1351,11 +1811,8 @@ class ImageTrimmerApp:
             
             # 处理图像转换
             # 先应用所有编辑
-            transformed_image = self.original_image.rotate(self.rotation_angle, expand=True, resample=Image.BICUBIC)
-            if self.is_flipped_h:
-                transformed_image = ImageOps.mirror(transformed_image)
-            if self.is_flipped_v:
-                transformed_image = ImageOps.flip(transformed_image)
+            transformed_image = transform_geometry(self.original_image, self.total_rotation(),
+                                                   self.is_flipped_h, self.is_flipped_v, self.auto_crop.get())
             processed_image = self.apply_color_adjustments(transformed_image)
             
             # 导出对应格式
@@ -1371,7 +1828,8 @@ class ImageTrimmerApp:
                 
             elif format_type == 'png_set':
                 # 创建PNG图标集
-                self.export_png_icon_set(processed_image, save_path)
+                icons_dir = self.export_png_icon_set(processed_image, save_path)
+                self.status_var.set(f"已成功导出PNG图标集到: {icons_dir}")
             
             # 弹出成功消息
             messagebox.showinfo("导出成功", f"图标已成功保存到:\n{save_path}")
@@ -1413,139 +1871,14 @@ class ImageTrimmerApp:
         for size in sizes:
             resized = image.resize((size, size), Image.LANCZOS)
             icon_path = os.path.join(icons_dir, f"{base_name}_{size}x{size}.png")
-            resized.save(icon_path, 'PNG')
+            with atomic_open(icon_path) as fp:
+                resized.save(fp, 'PNG')
         
-        self.status_var.set(f"已成功导出PNG图标集到: {icons_dir}")
         return icons_dir
 
-# 添加图标转换类
-class IconConverter:
-    """用于转换图像为各种图标格式的工具类"""
-    
-    @staticmethod
-    def create_ico(image, output_path, sizes=None):
-        """将PIL图像转换为.ico格式
-        
-        Args:
-            image: PIL图像对象
-            output_path: 输出的.ico文件路径
-            sizes: 要包含的尺寸列表，默认为[16, 32, 48, 64, 128, 256]
-        """
-        if sizes is None:
-            sizes = [16, 32, 48, 64, 128, 256]
-        
-        # 确保图像是正方形，否则进行裁剪
-        width, height = image.size
-        if width != height:
-            # 取最小的边作为裁剪尺寸
-            size = min(width, height)
-            # 计算裁剪区域，使其居中
-            left = (width - size) // 2
-            top = (height - size) // 2
-            right = left + size
-            bottom = top + size
-            image = image.crop((left, top, right, bottom))
-        
-        # 创建不同尺寸的图像
-        icons = []
-        for size in sizes:
-            # 调整图像大小，保持纵横比
-            resized_img = image.resize((size, size), Image.LANCZOS)
-            icons.append(resized_img)
-        
-        # 保存为.ico文件
-        icons[0].save(
-            output_path, 
-            format='ICO', 
-            sizes=[(img.width, img.height) for img in icons],
-            append_images=icons[1:]
-        )
-        return output_path
-    
-    @staticmethod
-    def create_icns(image, output_path):
-        """将PIL图像转换为.icns格式
-        
-        Args:
-            image: PIL图像对象
-            output_path: 输出的.icns文件路径
-        """
-        # 确保输出路径以.icns结尾
-        if not output_path.lower().endswith('.icns'):
-            output_path += '.icns'
-            
-        # 创建临时目录存放图标集
-        with tempfile.TemporaryDirectory() as iconset_dir:
-            iconset_path = os.path.join(iconset_dir, 'icon.iconset')
-            os.makedirs(iconset_path, exist_ok=True)
-            
-            # 确保图像是正方形
-            width, height = image.size
-            if width != height:
-                # 取最小的边作为裁剪尺寸
-                size = min(width, height)
-                # 计算裁剪区域，使其居中
-                left = (width - size) // 2
-                top = (height - size) // 2
-                right = left + size
-                bottom = top + size
-                image = image.crop((left, top, right, bottom))
-                
-            # 创建所需的各种尺寸图标
-            icon_sizes = [16, 32, 128, 256, 512]
-            retina_sizes = [32, 64, 256, 512, 1024]
-            
-            # 生成正常尺寸图标
-            for size in icon_sizes:
-                resized = image.resize((size, size), Image.LANCZOS)
-                icon_path = os.path.join(iconset_path, f'icon_{size}x{size}.png')
-                resized.save(icon_path, 'PNG')
-            
-            # 生成Retina尺寸图标（2x分辨率）
-            for i, size in enumerate(icon_sizes):
-                retina_size = retina_sizes[i]
-                resized = image.resize((retina_size, retina_size), Image.LANCZOS)
-                icon_path = os.path.join(iconset_path, f'icon_{size}x{size}@2x.png')
-                resized.save(icon_path, 'PNG')
-            
-            # 尝试使用iconutil（macOS）转换为icns
-            try:
-                if sys.platform == 'darwin':  # macOS系统
-                    subprocess.run(['iconutil', '-c', 'icns', iconset_path, '-o', output_path], 
-                                   check=True)
-                    return output_path
-            except (subprocess.SubprocessError, FileNotFoundError):
-                pass
-            
-            # 如果iconutil失败或不是macOS，尝试使用PIL自行生成icns
-            try:
-                # 生成最大尺寸的PNG
-                max_size = 1024
-                max_image = image.resize((max_size, max_size), Image.LANCZOS)
-                
-                # 在临时目录中创建一个PNG
-                png_path = os.path.join(iconset_dir, 'temp_icon.png')
-                max_image.save(png_path, 'PNG')
-                
-                # 读取PNG数据
-                with open(png_path, 'rb') as f:
-                    png_data = f.read()
-                
-                # 创建简单的ICNS文件结构
-                # ICNS格式有点复杂，这里是简化实现
-                icns_data = b'icns' + len(png_data).to_bytes(4, byteorder='big') + b'ic10' + png_data
-                
-                # 写入ICNS文件
-                with open(output_path, 'wb') as f:
-                    f.write(icns_data)
-                
-                return output_path
-            except Exception as e:
-                raise Exception(f"无法创建ICNS文件: {str(e)}")
-
 def main():
     # 使用TkinterDnD替代标准的Tk
-    root = TkinterDnD.Tk()
+    root = create_root()
     
     # 设置应用程序图标（如果有）
     try:
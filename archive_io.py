@@ -0,0 +1,260 @@
+"""批量处理直接读写ZIP/TAR归档
+
+读取：iter_sources 按顺序逐个取出归档中的图片成员，每次只在内存中保留一个成员的文件数据
+（压缩后的图片字节），不解压到磁盘。ZIP按中央目录读取各成员，TAR（含 .tar.gz/.tar.bz2/.tar.xz）
+以流方式顺序读取，不需要回退，归档本身多大都不影响内存占用。取出的成员是带 name 属性
+（归档中的路径）的 BytesIO，可以像源文件路径一样交给 Image.open 和批量导出。
+
+写入：ArchiveWriter 由一个写入线程依次把成员追加到输出归档。各输出在编码线程中直接编码到
+内存缓冲区，编码（即图片压缩）在线程池中并行进行，中间不产生临时文件；等待写入的缓冲区
+数量有上限，写入跟不上时编码线程等待，内存占用有界。JPEG、PNG、WebP 等已经压缩过的格式
+在ZIP中以存储方式写入，不再重复压缩。内容与已写入成员相同的成员用 link 添加，
+TAR中写成硬链接成员，不重复存储数据。
+
+    with ArchiveWriter("out.zip") as archive:
+        archive.save(image, "a/b.png", "PNG")
+"""
+import io
+import os
+import posixpath
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+from background_io import atomic_open
+
+# TAR归档的扩展名及对应的压缩方式
+TAR_EXTENSIONS = {
+    ".tar": "",
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tbz2": "bz2",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+}
+
+# 归档中按图片处理的成员扩展名，其他成员跳过
+MEMBER_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp", ".avif",
+                     ".ppm", ".pgm", ".pbm", ".ico")
+
+# 已经压缩过的输出格式，写入ZIP时不再压缩
+COMPRESSED_FORMATS = ("JPEG", "PNG", "GIF", "WEBP", "AVIF")
+
+# 等待写入归档的成员数上限
+ARCHIVE_QUEUE_SIZE = 8
+
+# 通知写入线程结束或放弃的标记
+_CLOSE = "close"
+_ABORT = "abort"
+
+
+class ArchiveAborted(Exception):
+    """输出归档被放弃，临时文件已删除"""
+
+
+def archive_kind(path):
+    """按扩展名判断归档类型：返回 ("zip", "")、("tar", 压缩方式)，不是归档时返回None"""
+    if not isinstance(path, str):
+        return None
+    name = path.lower()
+    if name.endswith(".zip"):
+        return "zip", ""
+    for extension in sorted(TAR_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(extension):
+            return "tar", TAR_EXTENSIONS[extension]
+    return None
+
+
+def is_archive(path):
+    return archive_kind(path) is not None
+
+
+def member_name(name):
+    """归档中的成员名规范化为相对路径；绝对路径或包含 .. 的成员返回None，避免写到输出位置之外"""
+    name = posixpath.normpath(name.replace("\\", "/"))
+    if name.startswith("/") or name == ".." or name.startswith("../") or ":" in name.split("/")[0]:
+        return None
+    if name.startswith("__MACOSX/") or not name.lower().endswith(MEMBER_EXTENSIONS):
+        return None
+    return name
+
+
+def _member(name, data):
+    member = io.BytesIO(data)
+    member.name = name
+    return member
+
+
+def iter_members(path):
+    """逐个取出归档中的图片成员（带 name 属性的 BytesIO），同一时间只读取一个成员"""
+    kind, _ = archive_kind(path)
+    if kind == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = None if info.is_dir() else member_name(info.filename)
+                if name:
+                    yield _member(name, archive.read(info))
+        return
+    # 流模式自动识别压缩方式，只顺序读取
+    with tarfile.open(path, "r|*") as archive:
+        for info in archive:
+            name = member_name(info.name) if info.isfile() else None
+            if name:
+                yield _member(name, archive.extractfile(info).read())
+
+
+def iter_sources(sources):
+    """展开源文件列表：归档逐个产生其中的图片成员，其他路径原样产生"""
+    for source in sources:
+        if is_archive(source):
+            yield from iter_members(source)
+        else:
+            yield source
+
+
+class ArchiveWriter:
+    """在写入线程中依次把成员写入输出归档
+
+    write/save 可以在多个线程中同时调用；归档在 close 之后才原子地出现在目标位置，
+    出错或调用 abort 时删除临时文件。也可以用作上下文管理器，发生异常时自动放弃。
+    """
+
+    def __init__(self, path, max_pending=ARCHIVE_QUEUE_SIZE):
+        kind = archive_kind(path)
+        if kind is None:
+            raise ValueError(f"不支持的归档类型: {path}")
+        self.path = path
+        self.queue = queue.Queue(max_pending)
+        self.error = None
+        self.count = 0
+        self.thread = threading.Thread(target=self._run, args=kind, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, name, data, format_code=None):
+        """把 data 作为成员 name 交给写入线程，等待写入的成员过多时阻塞
+
+        Returns:
+            成员名
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((name, data, format_code))
+        return name
+
+    def save(self, image, name, format_code, **params):
+        """在调用线程中把图像编码到内存缓冲区，再交给写入线程"""
+        from encoders import save_encoded
+
+        buffer = io.BytesIO()
+        save_encoded(image, buffer, format_code, **params)
+        return self.write(name, buffer.getvalue(), format_code)
+
+    def link(self, name, target):
+        """添加内容与已写入的成员 target 相同的成员 name：TAR中为硬链接成员，ZIP中读回 target 的数据再写入"""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((name, None, target))
+        return name
+
+    def close(self):
+        """写完全部成员并关闭归档"""
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+    def abort(self):
+        """放弃输出归档，删除临时文件"""
+        self.queue.put(_ABORT)
+        self.thread.join()
+
+    def _run(self, kind, compression):
+        try:
+            # 以读写方式打开，ZIP中的链接成员需要读回已写入的数据
+            with atomic_open(self.path, "w+b") as fp:
+                if kind == "zip":
+                    archive = zipfile.ZipFile(fp, "w")
+                else:
+                    # 流模式写入，不需要回退
+                    archive = tarfile.open(fileobj=fp, mode="w|" + compression)
+                with archive:
+                    while True:
+                        item = self.queue.get()
+                        if item == _CLOSE:
+                            break
+                        if item == _ABORT:
+                            raise ArchiveAborted()
+                        name, data, format_code = item
+                        if data is None:
+                            # 链接成员的第三项是目标成员名（见 link）
+                            self._add_link(archive, name, format_code)
+                        elif kind == "zip":
+                            self._add_zip(archive, name, data, format_code)
+                        else:
+                            self._add_tar(archive, name, data)
+                        self.count += 1
+        except ArchiveAborted as e:
+            self.error = e
+        except BaseException as e:
+            self.error = e
+            # 继续取走剩余的成员，避免仍在编码的线程一直阻塞
+            item = None
+            while item not in (_CLOSE, _ABORT):
+                item = self.queue.get()
+
+    @staticmethod
+    def _add_zip(archive, name, data, format_code):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        if format_code not in COMPRESSED_FORMATS:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, data)
+
+    @staticmethod
+    def _add_link(archive, name, target):
+        if isinstance(archive, zipfile.ZipFile):
+            source = archive.getinfo(target)
+            info = zipfile.ZipInfo(name, date_time=source.date_time)
+            info.external_attr = source.external_attr
+            info.compress_type = source.compress_type
+            archive.writestr(info, archive.read(source))
+        else:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.LNKTYPE
+            info.linkname = target
+            info.mtime = time.time()
+            info.mode = 0o644
+            archive.addfile(info)
+
+    @staticmethod
+    def _add_tar(archive, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        archive.addfile(info, io.BytesIO(data))
+
+
+def source_stem(source):
+    """输出文件名中的 {stem}：源文件名去掉扩展名，归档中的成员保留其在归档中的目录"""
+    if hasattr(source, "read"):
+        return os.path.splitext(source.name)[0]
+    return os.path.splitext(os.path.basename(source))[0]
+
+
+def source_name(source):
+    """显示用的源名称：文件路径或归档中的成员名"""
+    return getattr(source, "name", source)
@@ -0,0 +1,127 @@
+"""面向NumPy等数组库的处理接口
+
+输入可以是任何同时支持缓冲区协议和 __array_interface__ 的对象（例如 numpy.ndarray），
+形状为 (高, 宽) 或 (高, 宽, 4) 的连续uint8数组会直接作为图像视图使用，不复制像素。
+Pillow内部按每像素4字节存储RGB，(高, 宽, 3) 的数组需要展开复制一次，之后的处理与RGBA相同。
+返回的 PixelArray 实现了 __array_interface__，numpy.asarray(result) 不会再次复制。
+
+    import numpy as np
+    from array_api import process_array
+    out = np.asarray(process_array(pixels, mode="both", zoom_scale=0.5, crop_box=(0, 0, 400, 300)))
+
+本模块不依赖numpy，也不依赖tkinter。
+"""
+from PIL import Image
+
+from pipeline import scale_and_crop, transform_geometry
+from tiling import adjust_colors_tiled
+
+# 通道数对应的图像模式（仅uint8）
+ARRAY_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+
+def _is_contiguous(interface, shape):
+    """判断数组是否为C顺序连续存储"""
+    strides = interface.get("strides")
+    if strides is None:
+        return True
+    expected = []
+    step = 1
+    for dim in reversed(shape):
+        expected.insert(0, step)
+        step *= dim
+    return tuple(strides) == tuple(expected)
+
+
+def image_from_array(array):
+    """把数组包装为PIL图像
+
+    连续的uint8 L/RGBA数组直接在原缓冲区上创建只读视图；RGB和其他布局会复制一次。
+    调用方在使用返回的图像期间不能修改或释放原数组。
+    """
+    if isinstance(array, PixelArray):
+        return array.image
+    interface = array.__array_interface__
+    shape = tuple(interface["shape"])
+    bands = 1 if len(shape) == 2 else shape[2] if len(shape) == 3 else 0
+    if interface["typestr"] == "|u1" and bands in ARRAY_MODES and _is_contiguous(interface, shape):
+        try:
+            buffer = memoryview(array)
+        except TypeError:
+            buffer = None
+        if buffer is not None:
+            mode = ARRAY_MODES[bands]
+            return Image.frombuffer(mode, (shape[1], shape[0]), buffer, "raw", mode, 0, 1)
+    return Image.fromarray(array)
+
+
+class PixelArray:
+    """处理结果，通过 __array_interface__ 交给numpy等库
+
+    像素在第一次访问时从PIL图像导出为一块连续内存，之后的访问都复用这块内存。
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._data = None
+
+    @property
+    def shape(self):
+        bands = len(self.image.getbands())
+        if bands == 1:
+            return (self.image.height, self.image.width)
+        return (self.image.height, self.image.width, bands)
+
+    @property
+    def __array_interface__(self):
+        if self._data is None:
+            self._data = self.image.tobytes()
+        return {
+            "version": 3,
+            "shape": self.shape,
+            "typestr": "|u1",
+            "data": self._data,
+        }
+
+
+def _result(image, source, view):
+    """图像没有变化时直接返回原数组，否则包装为 PixelArray"""
+    if image is view:
+        return source
+    if image.mode not in ARRAY_MODES.values():
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    return PixelArray(image)
+
+
+def adjust_colors_array(array, brightness=1.0, contrast=1.0, saturation=1.0, workers=None):
+    """对数组图像应用亮度、对比度和饱和度调整（与界面的色彩调整相同）"""
+    if (brightness, contrast, saturation) == (1.0, 1.0, 1.0):
+        return array
+    view = image_from_array(array)
+    return _result(adjust_colors_tiled(view, brightness, contrast, saturation, workers=workers), array, view)
+
+
+def process_array(array, mode="scale", zoom_scale=1.0, crop_box=None, size=None,
+                  rotation=0, flip_h=False, flip_v=False,
+                  brightness=1.0, contrast=1.0, saturation=1.0):
+    """对数组图像执行与界面"预览更改"相同的处理
+
+    顺序为 旋转/翻转 -> 色彩调整 -> 缩放/裁剪 -> 调整到最终尺寸。
+
+    Args:
+        array: 输入数组
+        mode: "scale"、"crop" 或 "both"，含义见 pipeline.scale_and_crop
+        zoom_scale: 缩放比例
+        crop_box: 裁剪框 (left, top, right, bottom)
+        size: 最终输出尺寸 (width, height)，None表示不调整
+
+    Returns:
+        PixelArray；没有任何修改时返回原数组本身
+    """
+    view = image_from_array(array)
+    image = transform_geometry(view, rotation, flip_h, flip_v)
+    if (brightness, contrast, saturation) != (1.0, 1.0, 1.0):
+        # 超大图像分块并行处理
+        image = adjust_colors_tiled(image, brightness, contrast, saturation)
+    image = scale_and_crop(image, mode, zoom_scale, crop_box, size)
+    return _result(image, array, view)
@@ -0,0 +1,144 @@
+"""自动色阶、自动对比度和自动白平衡
+
+分析只读取缩小的代理图像的直方图，得到每个通道256项的查找表（共768项，依次为R、G、B），
+应用时在全分辨率图像上执行一次 point()：
+
+    levels = analyze_levels(image, "levels")
+    image = apply_levels(image, levels)
+
+三种方法：
+    levels         各通道分别拉伸到0~255，同时校正偏色
+    contrast       按亮度统一拉伸各通道，不改变色彩平衡
+    white_balance  灰度世界假设：调整各通道增益使三个通道的平均值相同
+
+批量处理时可以先用 analyze_sources 汇总全部（或参考）图片的直方图得到一张查找表，
+再把它作为 "levels" 应用到每张图片，使同一组图片的色调保持一致。
+"""
+from PIL import Image
+
+from histogram import channel_histograms, histogram_proxy
+
+# 分析使用的代理图像最大边长
+AUTO_PROXY_SIZE = 512
+
+# 拉伸时两端各忽略的像素比例（百分比），避免个别极亮/极暗的像素决定结果
+AUTO_CLIP_PERCENT = 0.5
+
+# 支持的分析方法
+AUTO_METHODS = ("levels", "contrast", "white_balance")
+
+# 不改变图像的单通道查找表
+IDENTITY_TABLE = list(range(256))
+
+
+def is_identity_levels(levels):
+    """查找表为空或不改变任何取值时返回True"""
+    return not levels or list(levels) == IDENTITY_TABLE * 3
+
+
+def percentile_value(histogram, percent):
+    """直方图中累计比例达到 percent（百分比）时的取值"""
+    total = sum(histogram)
+    if not total:
+        return 0
+    target = total * percent / 100.0
+    cumulative = 0
+    for value, count in enumerate(histogram):
+        cumulative += count
+        if cumulative > target:
+            return value
+    return 255
+
+
+def stretch_table(low, high):
+    """把 low~high 线性拉伸到 0~255 的查找表，范围无效时不做改变"""
+    if high <= low:
+        return list(IDENTITY_TABLE)
+    scale = 255.0 / (high - low)
+    return [min(255, max(0, int((v - low) * scale + 0.5))) for v in range(256)]
+
+
+def gain_table(gain):
+    """按增益缩放的查找表"""
+    return [min(255, int(v * gain + 0.5)) for v in range(256)]
+
+
+def histogram_average(histogram):
+    total = sum(histogram)
+    return sum(i * c for i, c in enumerate(histogram)) / total if total else 0.0
+
+
+def levels_from_histograms(histograms, method="levels", clip=AUTO_CLIP_PERCENT):
+    """由 {通道: 直方图} 计算查找表
+
+    Returns:
+        768项的查找表（R、G、B各256项）
+    """
+    if method == "levels":
+        tables = []
+        for band in "RGB":
+            histogram = histograms[band]
+            tables.append(stretch_table(percentile_value(histogram, clip),
+                                        percentile_value(histogram, 100 - clip)))
+        return tables[0] + tables[1] + tables[2]
+    if method == "contrast":
+        luma = histograms["L"]
+        return stretch_table(percentile_value(luma, clip), percentile_value(luma, 100 - clip)) * 3
+    if method == "white_balance":
+        means = [histogram_average(histograms[band]) for band in "RGB"]
+        target = sum(means) / 3
+        tables = [gain_table(target / mean) if mean else list(IDENTITY_TABLE) for mean in means]
+        return tables[0] + tables[1] + tables[2]
+    raise ValueError(f"不支持的自动调整方法: {method}")
+
+
+def analyze_levels(image, method="levels", clip=AUTO_CLIP_PERCENT, max_size=AUTO_PROXY_SIZE):
+    """分析图像的缩小代理图像，返回768项的查找表"""
+    proxy, mask = histogram_proxy(image, max_size)
+    return levels_from_histograms(channel_histograms(proxy, mask), method, clip)
+
+
+def analyze_sources(paths, method="levels", clip=AUTO_CLIP_PERCENT, max_size=AUTO_PROXY_SIZE):
+    """汇总多张图片的直方图，得到一张共用的查找表（"分析一次，应用到全部"）
+
+    每张图片只解码到代理图像的分辨率（JPEG用 draft 缩小解码），各图片按相同的权重汇总。
+    """
+    # pipeline 依赖本模块，在这里才导入
+    from pipeline import to_working_mode
+
+    combined = {band: [0] * 256 for band in "RGBL"}
+    for path in paths:
+        with Image.open(path) as image:
+            image.draft(image.mode, (max_size, max_size))
+            proxy, mask = histogram_proxy(to_working_mode(image), max_size)
+            histograms = channel_histograms(proxy, mask)
+        total = sum(histograms["L"]) or 1
+        for band, histogram in histograms.items():
+            combined[band] = [a + b / total for a, b in zip(combined[band], histogram)]
+    return levels_from_histograms(combined, method, clip)
+
+
+def apply_levels(image, levels):
+    """在图像上执行一次 point() 应用查找表，透明通道不变；灰度图像使用第一张表"""
+    if is_identity_levels(levels):
+        return image
+    levels = list(levels)
+    bands = image.getbands()
+    if bands[:3] == ("R", "G", "B"):
+        table = levels
+    elif bands[0] == "L":
+        table = levels[:256]
+    else:
+        raise ValueError(f"不支持的图像模式: {image.mode}")
+    if "A" in bands:
+        table = table + IDENTITY_TABLE
+    return image.point(table)
+
+
+def resolve_levels(image, levels=None, auto_levels=None):
+    """返回要应用的查找表：显式给出的 levels 优先，否则按 auto_levels 分析 image"""
+    if levels:
+        return levels
+    if auto_levels:
+        return analyze_levels(image, auto_levels)
+    return None
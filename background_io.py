@@ -0,0 +1,233 @@
+"""后台读写图片：进度汇报、取消和原子写入"""
+import os
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+from mapped_image import open_mapped, should_map
+from memory_budget import DRAFT_FACTORS, load_proxy, proxy_factor, reduce_factor
+
+
+class TaskCancelled(Exception):
+    """后台任务被用户取消"""
+
+
+class ProgressReader:
+    """包装输入文件，按已读取的字节数汇报进度，并在读取时检查取消标志"""
+
+    def __init__(self, fp, total, progress=None, cancel_event=None):
+        self.fp = fp
+        self.total = max(1, total)
+        self.progress = progress
+        self.cancel_event = cancel_event
+
+    def read(self, size=-1):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TaskCancelled()
+        data = self.fp.read(size)
+        if self.progress:
+            self.progress(min(1.0, self.fp.tell() / self.total))
+        return data
+
+    def readline(self, size=-1):
+        return self.fp.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        return self.fp.tell()
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.fp.fileno()
+
+
+class ProgressWriter:
+    """包装输出文件，按已写入的字节数汇报进度，并在写入时检查取消标志
+
+    编码后的大小事先未知，estimated_size 只用于估算进度。
+    """
+
+    def __init__(self, fp, estimated_size=None, progress=None, cancel_event=None):
+        self.fp = fp
+        self.estimated_size = max(1, estimated_size or 1)
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.written = 0
+
+    def write(self, data):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TaskCancelled()
+        count = self.fp.write(data)
+        self.written += len(data)
+        if self.progress:
+            self.progress(min(0.99, self.written / self.estimated_size))
+        return count
+
+    def flush(self):
+        self.fp.flush()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        return self.fp.tell()
+
+    def seekable(self):
+        return self.fp.seekable()
+
+
+def _current_umask():
+    """读取进程的 umask（只能先设置再恢复，在导入时执行一次）"""
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+# 新建文件的默认权限（mkstemp 创建的临时文件固定为0600，重命名前改为这个权限）
+NEW_FILE_MODE = 0o666 & ~_current_umask()
+
+
+@contextmanager
+def atomic_open(path, mode="wb"):
+    """在目标目录中写临时文件，成功后原子地重命名为目标文件
+
+    写入过程中出错或被取消时删除临时文件，目标文件保持不变。
+    覆盖已有文件时沿用原文件的权限，新文件按 umask 设置权限，与直接 open 写入时相同。
+    """
+    import stat
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        try:
+            file_mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            file_mode = NEW_FILE_MODE
+        os.chmod(temp_path, file_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def open_source(source):
+    """以二进制方式打开源文件；source 已经是文件对象（例如归档中的成员，见 archive_io）时从头读取"""
+    if hasattr(source, "read"):
+        source.seek(0)
+        yield source
+    else:
+        with open(source, "rb") as f:
+            yield f
+
+
+def load_image_file(path, progress=None, cancel_event=None, budget=None):
+    """读取并解码图片，解码过程中汇报进度并响应取消
+
+    Args:
+        budget: 内存预算（字节），估算的占用超出预算的JPEG以缩小的代理尺寸解码，
+            内存映射的图像按条带缩小（不会把整个文件展开到内存中），
+            实际缩小倍数记录在返回图像的 proxy_factor 属性中
+
+    Returns:
+        已完成解码的PIL图像对象（动画只解码第一帧）
+    """
+    # 大尺寸的未压缩图像直接映射文件，像素在访问时才读入内存
+    if should_map(path):
+        source = open_mapped(path)
+        if source is not None:
+            factor = reduce_factor(source.mode, source.size, budget) if budget else 1
+            if factor == 1:
+                image = source.image()
+            else:
+                # RGB的整幅视图会把整个文件展开复制到内存中，超出预算时只生成缩小的级别
+                image = source.reduce(factor)
+                image.proxy_factor = source.width / image.width
+                image.filename = path
+            if progress:
+                progress(1.0)
+            return image
+
+    total = os.path.getsize(path)
+    with open(path, "rb") as raw:
+        image = Image.open(ProgressReader(raw, total, progress, cancel_event))
+        # 先读取帧数，让结果在关闭文件前缓存下来
+        getattr(image, "n_frames", 1)
+        # 界面中没有更小的输出尺寸可以参考，允许缩小到 draft 支持的最大倍数
+        factor = proxy_factor(image, budget, max_scale=1 / DRAFT_FACTORS[-1]) if budget else 1
+        image.proxy_factor = load_proxy(image, factor)
+    image.filename = path
+    return image
+
+
+def save_image_file(image, path, format_code, progress=None, cancel_event=None, **params):
+    """编码并原子地保存图片
+
+    Args:
+        image: PIL图像对象
+        path: 目标文件路径
+        format_code: Pillow格式名
+        params: 编码参数（见 encoders.save_encoded）
+    """
+    # encoders 依赖本模块，在这里才导入
+    from encoders import save_encoded
+
+    # 以未压缩大小估算进度
+    estimated = image.width * image.height * len(image.getbands())
+    with atomic_open(path) as fp:
+        save_encoded(image, ProgressWriter(fp, estimated, progress, cancel_event), format_code, **params)
+    if progress:
+        progress(1.0)
+    return path
+
+
+class BackgroundTask:
+    """在后台线程中执行耗时的读写操作
+
+    任务函数接收 progress(fraction) 回调和 cancel_event 两个参数。
+    界面线程定时检查 done、progress 和 result，不会被阻塞。
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.cancel_event = threading.Event()
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _set_progress(self, fraction):
+        self.progress = fraction
+
+    def _run(self):
+        try:
+            self.result = self.func(self._set_progress, self.cancel_event)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return isinstance(self.error, TaskCancelled)
@@ -0,0 +1,873 @@
+"""批量/命令行导出：一次解码，按配方生成多个不同裁剪、尺寸和格式的输出
+
+配方（recipe）是一个JSON对象：
+
+    {
+        "edits": {"rotation": 90, "brightness": 1.1},
+        "outputs": [
+            {"preset": ["正方形 (1:1)", "Instagram (4:5)"], "width": [1080, 540], "format": ["JPEG", "PNG"]},
+            {"ratio": [16, 9], "width": 1920, "smart_crop": true, "name": "{stem}_hero"}
+        ]
+    }
+
+outputs 中的每一项可以把 preset/ratio/width/height/format/profile 写成列表，会按所有组合展开；
+也可以用 "crop": [left, top, right, bottom] 指定精确的裁剪区域。
+"profile" 为编码档位 fastest/balanced/smallest（见 encoders.py），"params" 中的编码参数优先于档位。
+"max_bytes" 限制输出文件大小，自动搜索不超过上限的最高质量；"allow_resize": true 时必要时缩小尺寸。
+配方中的 "watermark" 给全部输出加水印，输出项中的 "watermark" 优先，为false时不加（见 watermark.py）。
+GIF输出和给出 "colors" 的PNG输出（PNG-8）量化为调色板模式："colors" 为颜色数，"quantize" 为
+mediancut/octree，"dither": true 使用抖动；"palette" 为 [r, g, b, ...] 的固定调色板。
+配方级的 "palette" 用于全部这些输出，命令行的 --shared-palette 先从全部源图片生成一次调色板，
+各图片颜色一致（见 quantize.py）。
+
+edits 中的 "auto_levels": "levels"/"contrast"/"white_balance" 对每张图片分别做自动色阶/对比度/白平衡；
+"levels" 为768项的色阶查找表，命令行的 --auto-once 先汇总全部源图片的直方图得到一张查找表，
+再把它作为 "levels" 应用到每张图片，同一组图片的色调保持一致（见 auto_levels.py）。
+
+源文件可以是ZIP/TAR归档，逐个读取其中的图片成员，不解压到磁盘；输出（-o）以 .zip/.tar/.tar.gz 等
+结尾时直接写入输出归档，输出文件名保留成员在源归档中的目录（见 archive_io.py）。
+
+命令行的 --dedup 按感知哈希找出重复的源图片（重新保存、改名或缩小的副本），每组只处理一张，
+其余图片的输出链接或复制自它的输出，--dedup-report 把分组写入JSON文件（见 dedup.py）。
+"""
+import io
+import itertools
+import json
+import os
+import random
+import re
+import string
+import sys
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from pipeline import (CROP_PRESETS, GRAYSCALE_MODES, adjust_colors, is_identity, ratio_crop_size, to_output_mode,
+                      to_working_mode)
+from tiling import TILED_MIN_PIXELS, apply_edits_tiled
+from smart_crop import SmartCropper
+from background_io import atomic_open, save_image_file
+from encoders import DEFAULT_PROFILE, encoder_params, fit_to_size
+from mapped_image import MappedSource, open_mapped, should_map
+from passthrough import PassthroughPlan
+from auto_levels import AUTO_METHODS, analyze_sources
+from archive_io import ArchiveWriter, is_archive, iter_sources, source_name, source_stem
+from watermark import apply_watermark
+from dedup import DEFAULT_HASH_METHOD, DEFAULT_HASH_THRESHOLD, HASH_METHODS, LINK_MODES, DuplicateIndex, link_file
+from quantize import (DEFAULT_QUANTIZE_METHOD, PALETTE_FORMATS, build_palette, palette_values, quantize_image,
+                      quantize_options, sample_proxy)
+from memory_budget import (DEFAULT_GOVERNOR, estimate_peak, geometry_size, image_bytes, load_proxy,
+                           proxy_factor, proxy_size, set_default_budget)
+
+# 输出格式对应的扩展名
+FORMAT_EXTENSIONS = {
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "GIF": ".gif",
+    "BMP": ".bmp",
+    "TIFF": ".tiff",
+    "WEBP": ".webp",
+    "AVIF": ".avif",
+}
+
+# 默认输出文件名模板
+DEFAULT_NAME = "{stem}_{ratio}_{width}x{height}"
+
+# --shared-palette 最多抽样的源图片数
+SHARED_PALETTE_SOURCES = 64
+
+# 输出项中允许写成列表并展开的字段
+EXPANDABLE_KEYS = ("preset", "ratio", "width", "height", "format", "profile")
+
+
+def expand_outputs(outputs):
+    """把输出项中的列表字段展开为所有组合"""
+    expanded = []
+    for spec in outputs:
+        keys = [k for k in EXPANDABLE_KEYS if k in spec]
+        values = []
+        for key in keys:
+            value = spec[key]
+            # ratio 本身就是 [w, h]，只有嵌套列表才表示多个取值
+            if key == "ratio":
+                value = value if value and isinstance(value[0], (list, tuple)) else [value]
+            elif not isinstance(value, list):
+                value = [value]
+            values.append(value)
+        for combo in itertools.product(*values):
+            item = dict(spec)
+            item.update(zip(keys, combo))
+            expanded.append(item)
+    return expanded
+
+
+def recipe_outputs(recipe):
+    """展开配方的输出项，并把配方级的水印和调色板填入没有单独设置的输出项"""
+    specs = expand_outputs(recipe.get("outputs", []))
+    watermark = recipe.get("watermark")
+    if watermark:
+        specs = [spec if "watermark" in spec else dict(spec, watermark=watermark) for spec in specs]
+    palette = recipe.get("palette")
+    if palette:
+        specs = [dict(spec, palette=palette) if is_quantized(spec) and "palette" not in spec else spec
+                 for spec in specs]
+    return specs
+
+
+def is_quantized(spec):
+    """输出项是否保存为调色板模式：GIF，或给出了量化参数的PNG"""
+    format_code = spec.get("format", "PNG")
+    return format_code == "GIF" or format_code in PALETTE_FORMATS and "colors" in spec
+
+
+class PyramidCache:
+    """缓存基础图像的逐级2倍缩小版本，供多个输出共享
+
+    每一级都由上一级 reduce(2) 得到，同一级只计算一次。
+    基础图像是内存映射的源文件（MappedSource）时，缩小级别直接按条带从映射中读取生成，
+    之后同样由各输出共享；需要原始分辨率的输出直接从映射读取所需的行，这种读取一次只进行一个，
+    避免多个输出同时把各自的整块区域展开到内存中。
+    """
+
+    # 缩小后的图像至少保留目标尺寸的多少倍，再交给LANCZOS完成最终缩放
+    REDUCING_GAP = 2.0
+
+    def __init__(self, image):
+        self.levels = {1: image}
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+
+    def level_for(self, box, size):
+        """为裁剪区域 box 缩放到 size 选择可用的最小级别
+
+        Returns:
+            (factor, image)：缩小倍数及对应级别的图像
+        """
+        box_w = box[2] - box[0]
+        box_h = box[3] - box[1]
+        if box_w <= 0 or box_h <= 0 or size[0] <= 0 or size[1] <= 0:
+            # 否则下面的循环不会结束
+            raise ValueError(f"裁剪区域 {tuple(box)} 或输出尺寸 {tuple(size)} 无效")
+        factor = 1
+        while box_w / (factor * 2) >= size[0] * self.REDUCING_GAP and \
+                box_h / (factor * 2) >= size[1] * self.REDUCING_GAP:
+            factor *= 2
+        return factor, self.get(factor)
+
+    def get(self, factor):
+        with self.lock:
+            return self._build(factor)
+
+    def _build(self, factor):
+        if factor not in self.levels:
+            if isinstance(self.levels[1], MappedSource):
+                # 从已有的最小级别继续缩小，没有时一次从映射按条带缩小到这一级，不生成中间级别
+                known = max(k for k in self.levels if factor % k == 0 and k > 1) \
+                    if any(factor % k == 0 and k > 1 for k in self.levels) else 1
+                if known == 1:
+                    with self.read_lock:
+                        self.levels[factor] = self.levels[1].reduce(factor)
+                else:
+                    self.levels[factor] = self.levels[known].reduce(factor // known)
+            else:
+                self.levels[factor] = self._build(factor // 2).reduce(2)
+        return self.levels[factor]
+
+
+def resolve_output(spec, base):
+    """计算单个输出项在基础图像上的裁剪区域和目标尺寸
+
+    Returns:
+        (crop_box, (width, height))
+
+    Raises:
+        ValueError: crop 不是面积为正、位于图像内的 [left, top, right, bottom]，或预设未知
+    """
+    ratio = spec.get("ratio")
+    if ratio is None and spec.get("preset"):
+        if spec["preset"] not in CROP_PRESETS:
+            raise ValueError(f"未知的裁剪预设: {spec['preset']}")
+        ratio = CROP_PRESETS[spec["preset"]]
+
+    if spec.get("crop"):
+        box = tuple(int(v) for v in spec["crop"])
+        if len(box) != 4 or not (0 <= box[0] < box[2] <= base.width and 0 <= box[1] < box[3] <= base.height):
+            raise ValueError(f"裁剪区域 {list(box)} 无效或超出图像范围 {base.width}x{base.height}")
+    elif ratio and spec.get("smart_crop"):
+        box = SmartCropper.crop_to_ratio(base, ratio[0], ratio[1])
+    elif ratio:
+        crop_w, crop_h = ratio_crop_size(base.width, base.height, ratio[0], ratio[1])
+        left = (base.width - crop_w) // 2
+        top = (base.height - crop_h) // 2
+        box = (left, top, left + crop_w, top + crop_h)
+    else:
+        box = (0, 0, base.width, base.height)
+
+    # 只给出宽或高时按裁剪区域的比例计算另一边
+    box_w = box[2] - box[0]
+    box_h = box[3] - box[1]
+    width = spec.get("width")
+    height = spec.get("height")
+    if width and not height:
+        height = max(1, int(round(box_h * width / box_w)))
+    elif height and not width:
+        width = max(1, int(round(box_w * height / box_h)))
+    elif not width and not height:
+        width, height = box_w, box_h
+    return box, (int(width), int(height))
+
+
+def output_fields(spec, stem, size):
+    """输出文件名模板中可用的字段"""
+    ratio = spec.get("ratio") or CROP_PRESETS.get(spec.get("preset"))
+    return {
+        "stem": stem,
+        "ratio": f"{ratio[0]:g}x{ratio[1]:g}" if ratio else "orig",
+        "width": size[0],
+        "height": size[1],
+        "format": spec.get("format", "PNG").lower(),
+        "profile": spec.get("profile", DEFAULT_PROFILE),
+    }
+
+
+def output_filename(spec, stem, size):
+    """根据模板生成输出文件名（含扩展名）"""
+    name = spec.get("name", DEFAULT_NAME).format(**output_fields(spec, stem, size))
+    return name + FORMAT_EXTENSIONS[spec.get("format", "PNG")]
+
+
+def prepare_for_format(image, format_code, source_mode=None, spec=None):
+    """从工作模式转换为目标格式能保存的模式，灰度源图像还原为灰度
+
+    spec 为输出项，其中的量化参数（colors/quantize/dither/palette）用于GIF和PNG-8输出。
+    """
+    options = quantize_options(spec) if spec and is_quantized(spec) else None
+    if options and image.mode in ("RGB", "RGBA") and (source_mode or getattr(image, "source_mode", None)) \
+            not in GRAYSCALE_MODES:
+        return quantize_image(image, **options)
+    return to_output_mode(image, format_code, source_mode)
+
+
+def render_output(pyramid, box, size):
+    """从共享的缩小级别中裁剪并缩放出单个输出"""
+    factor, level = pyramid.level_for(box, size)
+    scaled_box = tuple(v / factor for v in box)
+    if size == (level.width, level.height) and scaled_box == (0, 0, level.width, level.height):
+        # 多个输出会在不同线程中同时保存，Image.save 会修改图像对象的属性，因此不能共用同一个对象
+        return level.image() if isinstance(level, MappedSource) else level.copy()
+    if isinstance(level, MappedSource):
+        with pyramid.read_lock:
+            return level.resize(size, Image.LANCZOS, box=scaled_box)
+    return level.resize(size, Image.LANCZOS, box=scaled_box)
+
+
+def passthrough_plan(source, edits):
+    """读取源文件头，判断哪些输出可以跳过重新编码；无法读取时返回None"""
+    try:
+        return PassthroughPlan(source, edits)
+    except Exception:
+        return None
+
+
+def passthrough_path(plan, spec, output_dir, stem):
+    """输出项与源文件像素相同（或只差JPEG方向标记）时返回输出路径，否则返回None"""
+    if plan is None or spec.get("params") or spec.get("max_bytes") or spec.get("watermark") or quantize_options(spec):
+        return None
+    if spec.get("smart_crop") and (spec.get("ratio") or spec.get("preset")):
+        return None
+    box, size = resolve_output(spec, SimpleNamespace(width=plan.size[0], height=plan.size[1]))
+    if box != (0, 0) + tuple(plan.size) or not plan.applies(spec.get("format", "PNG"), size):
+        return None
+    return os.path.join(output_dir, output_filename(spec, stem, size))
+
+
+def written_size(spec, stem, size, path):
+    """从输出路径中读出实际写入的尺寸
+
+    max_bytes 加 allow_resize 的输出可能被缩小，文件名中的 {width}/{height} 是最终尺寸；
+    模板中没有尺寸字段或路径与模板不符时返回 size。
+    """
+    fields = dict(output_fields(spec, stem, size))
+    pattern = ""
+    for literal, field, format_spec, _ in string.Formatter().parse(spec.get("name", DEFAULT_NAME)):
+        pattern += re.escape(literal)
+        if field in ("width", "height"):
+            pattern += f"(?P={field})" if f"(?P<{field}>" in pattern else rf"(?P<{field}>\d+)"
+        elif field is not None:
+            pattern += re.escape(format(fields[field], format_spec))
+    match = re.search(pattern + re.escape(FORMAT_EXTENSIONS[spec.get("format", "PNG")]) + "$", path)
+    if match is None:
+        return size
+    return (int(match.groupdict().get("width", size[0])), int(match.groupdict().get("height", size[1])))
+
+
+def write_passthrough(plan, path, archive=None):
+    """复制源文件或改写方向标记；写入归档时先写到内存缓冲区再交给归档"""
+    if archive is None:
+        return plan.write(path)
+    buffer = io.BytesIO()
+    plan.write_to(buffer)
+    return archive.write(path, buffer.getvalue(), plan.format)
+
+
+def edited_size(size, edits):
+    """整图编辑（旋转、裁剪、缩放）之后基础图像的尺寸，只按文件头中的尺寸计算
+
+    Returns:
+        ((width, height), 整图缩放的比例)
+    """
+    width, height = geometry_size(size, edits.get("rotation", 0), edits.get("auto_crop", False))
+    if edits.get("crop_box"):
+        left, top, right, bottom = edits["crop_box"]
+        width, height = right - left, bottom - top
+    scale = 1.0
+    if edits.get("size"):
+        scale = max(edits["size"][0] / width, edits["size"][1] / height)
+        width, height = edits["size"]
+    return (width, height), scale
+
+
+def output_sizes(specs, size, edits):
+    """各输出项的目标尺寸，只按文件头中的尺寸计算（不解码、不分析画面内容）"""
+    (width, height), _ = edited_size(size, edits)
+    base = SimpleNamespace(width=width, height=height)
+    return [resolve_output(dict(spec, smart_crop=False), base)[1] for spec in specs]
+
+
+def output_scale(specs, size, edits):
+    """各输出相对源图像的最大缩放比例，决定解码时最多可以缩小多少
+
+    Args:
+        size: 源图像尺寸（来自文件头）
+    """
+    (width, height), scale = edited_size(size, edits)
+    largest = 0.0
+    for spec in specs:
+        # 只需要裁剪框的尺寸，不必分析画面内容
+        box, out = resolve_output(dict(spec, smart_crop=False), SimpleNamespace(width=width, height=height))
+        largest = max(largest, out[0] / max(1, box[2] - box[0]), out[1] / max(1, box[3] - box[1]))
+    return scale * largest
+
+
+def scale_crop(params, key, factor):
+    """把以源图像坐标表示的裁剪框换算到缩小 factor 倍的代理图像上"""
+    if not params.get(key) or factor == 1:
+        return params
+    return dict(params, **{key: [v / factor for v in params[key]]})
+
+
+def decode_source(source, edits, specs, workers=None, governor=DEFAULT_GOVERNOR):
+    """在内存预算内解码源文件并执行整图编辑
+
+    先从文件头估算峰值，按估算值向 governor 预留额度（总量超出预算时等待其他任务）；
+    单个任务超出预算时，JPEG 以输出分辨率允许的最大倍数缩小解码，色彩调整分块进行。
+
+    Returns:
+        (基础图像, 源图像模式, 缩小倍数, 预留的字节数)，基础图像用完后由调用方 release 预留的字节数
+    """
+    with Image.open(source) as image:
+        factor = proxy_factor(image, governor.budget, edits, output_scale(specs, image.size, edits))
+        size = proxy_size(image.size, factor)
+        tiled = size[0] * size[1] >= TILED_MIN_PIXELS
+        reserved = governor.acquire(estimate_peak(image.mode, size, edits, tiled))
+        try:
+            factor = load_proxy(image, factor)
+            base = apply_edits_tiled(to_working_mode(image), workers=workers,
+                                     **scale_crop(edits, "crop_box", factor))
+        except BaseException:
+            governor.release(reserved)
+            raise
+        return base, image.mode, factor, reserved
+
+
+def export_variants(source, recipe, output_dir, workers=None, base=None, stem=None, passthrough=None,
+                    source_mode=None, archive=None):
+    """按配方从同一次解码生成全部输出
+
+    源图像只解码一次，并只做一次旋转/翻转和色彩调整；
+    各输出共享同一组缩小级别，裁剪缩放和编码在线程池中并发执行。
+    与源文件像素相同的输出直接复制源文件（JPEG的90度旋转/翻转只改写方向标记），
+    全部输出都是这种情况时不解码源文件。
+
+    Args:
+        source: 源文件路径，或从归档中取出的成员（见 archive_io.iter_sources）
+        recipe: 配方字典
+        output_dir: 输出目录
+        workers: 并发线程数，None表示使用默认值
+        base: 已处理好的基础图像（或 MappedSource），提供时不再读取 source
+        stem: 输出文件名中的 {stem}，默认取源文件名
+        passthrough: 是否允许跳过重新编码，默认只在未提供 base 时允许
+            （base 由 source 按配方中的编辑得到时也可以传入True）
+        source_mode: 源图像解码后的模式，灰度源图像保存时还原为灰度；未提供 base 时自动取得
+        archive: 输出归档（ArchiveWriter），提供时忽略 output_dir，各输出在编码线程中编码到内存后写入归档
+
+    未提供 base 时在进程内的内存预算中解码（见 decode_source），超出预算的JPEG以缩小的代理图像处理。
+
+    Returns:
+        输出文件路径（写入归档时为成员名）列表，顺序与展开后的输出项一致
+    """
+    edits = recipe.get("edits", {})
+    stem = stem or source_stem(source)
+    if archive is None:
+        # 归档中的成员保留其目录
+        os.makedirs(os.path.join(output_dir, os.path.dirname(stem)), exist_ok=True)
+    else:
+        output_dir = ""
+    specs = recipe_outputs(recipe)
+
+    if passthrough is None:
+        passthrough = base is None
+    plan = passthrough_plan(source, edits) if passthrough else None
+    paths = [None] * len(specs)
+    pending = []
+    for index, spec in enumerate(specs):
+        path = passthrough_path(plan, spec, output_dir, stem)
+        if path:
+            paths[index] = write_passthrough(plan, path, archive)
+        else:
+            pending.append(index)
+    if not pending:
+        return paths
+
+    reserved = 0
+    if base is None:
+        mapped = open_mapped(source) if should_map(source) else None
+        if mapped is not None:
+            # 没有整图编辑时直接从映射中读取各输出需要的区域
+            base = mapped if is_identity(**edits) else apply_edits_tiled(mapped.image(), workers=workers, **edits)
+            source_mode = mapped.mode
+        else:
+            base, source_mode, factor, reserved = decode_source(source, edits, [specs[i] for i in pending], workers)
+            specs = [scale_crop(spec, "crop", factor) for spec in specs]
+
+    try:
+        return _render_variants(base, specs, pending, paths, output_dir, stem, source_mode, workers, archive)
+    finally:
+        DEFAULT_GOVERNOR.release(reserved)
+
+
+def _render_variants(base, specs, pending, paths, output_dir, stem, source_mode, workers, archive=None):
+    """从基础图像裁剪、缩放并编码 pending 中的各输出项，结果填入 paths"""
+    pyramid = PyramidCache(base)
+
+    def run(spec):
+        format_code = spec.get("format", "PNG")
+        if format_code not in FORMAT_EXTENSIONS:
+            raise ValueError(f"不支持的格式: {format_code}")
+        box, size = resolve_output(spec, base)
+        # 水印按输出尺寸缓存，每个输出只合成一次
+        image = apply_watermark(render_output(pyramid, box, size), spec.get("watermark"))
+        image = prepare_for_format(image, format_code, source_mode, spec)
+        profile = spec.get("profile", DEFAULT_PROFILE)
+        if spec.get("max_bytes"):
+            buffer, _, size = fit_to_size(image, format_code, int(spec["max_bytes"]), profile,
+                                          spec.get("allow_resize", False), **spec.get("params", {}))
+            # allow_resize 时可能缩小了尺寸，文件名按实际写入的尺寸生成
+            path = os.path.join(output_dir, output_filename(spec, stem, size))
+            if archive is not None:
+                return archive.write(path, buffer.getvalue(), format_code)
+            with atomic_open(path) as fp:
+                fp.write(buffer.getbuffer())
+            return path
+        path = os.path.join(output_dir, output_filename(spec, stem, size))
+        params = encoder_params(format_code, profile, **spec.get("params", {}))
+        if archive is not None:
+            return archive.save(image, path, format_code, **params)
+        return save_image_file(image, path, format_code, **params)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, path in zip(pending, executor.map(run, [specs[i] for i in pending])):
+            paths[index] = path
+    return paths
+
+
+def _export_shared(descriptor, source, recipe, output_dir, workers, source_mode=None):
+    """工作进程入口：在共享内存视图上执行编辑并导出全部输出"""
+    import shm_transport
+    image = shm_transport.view_image(descriptor)
+    base = apply_edits_tiled(image, workers=workers, **recipe.get("edits", {}))
+    return export_variants(source, recipe, output_dir, workers, base=base, passthrough=True,
+                           source_mode=source_mode)
+
+
+def all_passthrough(source, recipe, output_dir):
+    """配方的全部输出都不需要重新编码时返回True（此时不必解码源文件）"""
+    plan = passthrough_plan(source, recipe.get("edits", {}))
+    stem = source_stem(source)
+    specs = recipe_outputs(recipe)
+    return bool(specs) and all(passthrough_path(plan, spec, output_dir, stem) for spec in specs)
+
+
+def _edit_shared(descriptor, result_name, edits):
+    """工作进程入口：编辑共享内存中的图像并把结果写回主进程提供的段"""
+    import shm_transport
+    image = shm_transport.view_image(descriptor)
+    return shm_transport.write_result(apply_edits_tiled(image, workers=1, **edits), result_name)
+
+
+def _decode(source):
+    """在主进程中解码源文件并转换为工作模式
+
+    Returns:
+        (工作模式图像, 源图像解码后的模式)
+    """
+    with Image.open(source) as image:
+        image.load()
+        return to_working_mode(image), image.mode
+
+
+def job_bytes(source, edits):
+    """从文件头估算一个源文件在共享内存和工作进程中的峰值占用，无法读取时返回0"""
+    try:
+        with Image.open(source) as image:
+            mode, size = image.mode, image.size
+    except Exception:
+        return 0
+    working_mode = "RGBA" if "A" in mode or mode in ("P", "PA") else "RGB"
+    tiled = size[0] * size[1] >= TILED_MIN_PIXELS
+    return image_bytes(working_mode, size) + estimate_peak(mode, size, edits, tiled)
+
+
+def export_parallel(sources, recipe, output_dir, processes=None, workers=None, on_done=None,
+                    memory_budget=None):
+    """在多个进程中按配方导出多个源文件
+
+    主进程解码源文件并把像素写入共享内存段，工作进程在共享内存上直接创建图像视图，
+    不经过pickle传递像素。同时在处理中的源文件数有上限，共享内存段在源文件之间复用。
+
+    各任务的峰值占用从文件头估算，所有进程中在途任务的合计不超过内存预算；
+    单个超出预算的源文件等其他任务结束后单独交给工作进程读取，按预算缩小解码或分块处理。
+
+    Args:
+        sources: 源文件路径或归档成员的可迭代对象，按需逐个取出
+        processes: 工作进程数，None表示使用CPU核数
+        workers: 每个进程内的编码线程数
+        on_done: 每个源文件完成时的回调 on_done(source, paths, error)
+        memory_budget: 所有进程合计的内存预算（字节），默认为进程内共用的预算
+
+    Returns:
+        {源文件: 输出路径列表}（归档成员以成员名为键），失败的源文件不在其中
+    """
+    # 多进程和共享内存只在并行处理时才需要，不在导入本模块时加载
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    import shm_transport
+
+    processes = processes or os.cpu_count() or 1
+    budget = memory_budget or DEFAULT_GOVERNOR.budget
+    pool = shm_transport.SegmentPool(max_free=processes * 2)
+    results = {}
+    pending = {}
+    in_flight = 0
+
+    def collect(done):
+        nonlocal in_flight
+        for future in done:
+            source, segment, nbytes = pending.pop(future)
+            in_flight -= nbytes
+            if segment is not None:
+                pool.release(segment)
+            try:
+                results[source_name(source)] = future.result()
+                error = None
+            except Exception as e:
+                error = e
+            if on_done:
+                on_done(source, results.get(source_name(source)), error)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=set_default_budget,
+                                 initargs=(budget,)) as executor:
+            for source in sources:
+                if all_passthrough(source, recipe, output_dir):
+                    # 只需复制或改写方向标记，在工作进程中直接处理文件
+                    future = executor.submit(export_variants, source, recipe, output_dir, workers)
+                    pending[future] = (source, None, 0)
+                    continue
+                # 限制在途任务数和在途像素的合计，超出预算的任务等其他任务全部结束后单独执行
+                nbytes = min(job_bytes(source, recipe.get("edits", {})), budget)
+                while pending and (len(pending) >= processes * 2 or in_flight + nbytes > budget):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight += nbytes
+                if nbytes >= budget:
+                    # 由工作进程自己读取文件，按预算缩小解码或分块处理
+                    future = executor.submit(export_variants, source, recipe, output_dir, workers)
+                    pending[future] = (source, None, nbytes)
+                    continue
+                try:
+                    image, source_mode = _decode(source)
+                except Exception as e:
+                    in_flight -= nbytes
+                    if on_done:
+                        on_done(source, None, e)
+                    continue
+                segment = pool.acquire(shm_transport.image_nbytes(image.mode, image.size))
+                descriptor = shm_transport.put_image(image, segment)
+                del image
+                future = executor.submit(_export_shared, descriptor, source, recipe, output_dir, workers,
+                                         source_mode)
+                pending[future] = (source, segment, nbytes)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        pool.close()
+    return results
+
+
+def edit_images_parallel(images, edits, processes=None):
+    """在多个进程中对多张图像执行相同的编辑，像素经共享内存往返
+
+    Returns:
+        编辑后的图像列表，顺序与输入一致
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    import shm_transport
+
+    processes = processes or os.cpu_count() or 1
+    pool = shm_transport.SegmentPool(max_free=processes * 4)
+    results = [None] * len(images)
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            index, segments = pending.pop(future)
+            try:
+                results[index] = shm_transport.take_result(future.result())
+            finally:
+                for segment in segments:
+                    pool.release(segment)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for index, image in enumerate(images):
+                while len(pending) >= processes * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                image = to_working_mode(image)
+                nbytes = shm_transport.image_nbytes(image.mode, image.size)
+                segment = pool.acquire(nbytes)
+                descriptor = shm_transport.put_image(image, segment)
+                # 结果段按输入大小和目标尺寸中较大者预留，超出时工作进程另建新段
+                size = edits.get("size")
+                if size:
+                    nbytes = max(nbytes, shm_transport.image_nbytes(image.mode, size))
+                result_segment = pool.acquire(nbytes)
+                future = executor.submit(_edit_shared, descriptor, result_segment.name, edits)
+                pending[future] = (index, (segment, result_segment))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        pool.close()
+    return results
+
+
+def shared_levels_recipe(recipe, references, method):
+    """分析一次参考图片，返回把得到的色阶查找表写入 edits 的新配方"""
+    edits = {k: v for k, v in recipe.get("edits", {}).items() if k != "auto_levels"}
+    edits["levels"] = analyze_sources(references, method)
+    return dict(recipe, edits=edits)
+
+
+def shared_palette_recipe(recipe, references, max_sources=SHARED_PALETTE_SOURCES):
+    """从参考图片的代理图像生成一次调色板，返回把它作为配方级 "palette" 的新配方
+
+    参考图片过多时按蓄水池抽样最多取 max_sources 张，未抽中的图片不解码；
+    各代理图像先应用配方中的色彩调整，与实际输出的颜色一致。
+    """
+    edits = recipe.get("edits", {})
+    rng = random.Random(0)
+    proxies = []
+    for index, source in enumerate(references):
+        slot = index if index < max_sources else rng.randrange(index + 1)
+        if slot >= max_sources:
+            continue
+        with Image.open(source) as image:
+            image.draft("RGB", (256, 256))
+            proxy = adjust_colors(sample_proxy(to_working_mode(image)), edits.get("brightness", 1.0),
+                                  edits.get("contrast", 1.0), edits.get("saturation", 1.0), edits.get("levels"))
+        if slot < len(proxies):
+            proxies[slot] = proxy
+        else:
+            proxies.append(proxy)
+    if not proxies:
+        return recipe
+    specs = [spec for spec in recipe_outputs(recipe) if is_quantized(spec)]
+    colors = max((int(spec.get("colors", 256)) for spec in specs), default=256)
+    method = next((spec["quantize"] for spec in specs if "quantize" in spec), DEFAULT_QUANTIZE_METHOD)
+    return dict(recipe, palette=palette_values(build_palette(proxies, colors, method, transparent=True)))
+
+
+def duplicate_outputs(recipe, representative, duplicate, paths, output_dir, mode="link", archive=None):
+    """把代表图片的输出链接或复制为重复图片的输出
+
+    输出文件名中的 {stem} 换成重复图片的，尺寸与代表图片的输出相同（内容就是代表图片的输出）。
+
+    Args:
+        representative, duplicate: dedup.DuplicateIndex 中的条目
+        paths: 代表图片的输出路径（写入归档时为成员名），与 export_variants 的返回值相同
+        mode: "link"、"copy" 或 "symlink"（见 dedup.link_file），写入归档时忽略
+
+    Returns:
+        重复图片的输出路径列表
+    """
+    specs = recipe_outputs(recipe)
+    sizes = output_sizes(specs, representative["size"], recipe.get("edits", {}))
+    if archive is None:
+        os.makedirs(os.path.join(output_dir, os.path.dirname(duplicate["stem"])), exist_ok=True)
+    else:
+        output_dir = ""
+    linked = []
+    for spec, size, target in zip(specs, sizes, paths):
+        if spec.get("max_bytes") and spec.get("allow_resize"):
+            size = written_size(spec, representative["stem"], size, target)
+        path = os.path.join(output_dir, output_filename(spec, duplicate["stem"], size))
+        if path == target:
+            # 文件名模板中没有 {stem}，重复图片的输出与代表图片的是同一个文件
+            linked.append(path)
+        elif archive is not None:
+            linked.append(archive.link(path, target))
+        else:
+            linked.append(link_file(target, path, mode))
+    return linked
+
+
+def link_duplicates(index, recipe, results, output_dir, mode="link", archive=None, on_done=None):
+    """处理完代表图片之后，为 index 记录的每张重复图片生成输出（见 duplicate_outputs）
+
+    Args:
+        index: 过滤源文件时使用的 dedup.DuplicateIndex
+        results: {源名称: 输出路径列表}，即各代表图片的导出结果
+        on_done: 每张重复图片完成时的回调 on_done(源名称, paths, error)
+
+    Returns:
+        {重复图片的源名称: 输出路径列表}，代表图片处理失败的重复图片不在其中
+    """
+    linked = {}
+    for entry, representative, _ in index.duplicates:
+        paths = results.get(representative["name"])
+        try:
+            if paths is None:
+                raise ValueError(f"代表图片 {representative['name']} 处理失败")
+            linked[entry["name"]] = duplicate_outputs(recipe, representative, entry, paths, output_dir, mode,
+                                                      archive)
+            error = None
+        except Exception as e:
+            error = e
+        if on_done:
+            on_done(entry["name"], linked.get(entry["name"]), error)
+    return linked
+
+
+def load_recipe(path):
+    """读取JSON配方文件"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按配方批量导出图片")
+    parser.add_argument("recipe", help="JSON配方文件")
+    parser.add_argument("sources", nargs="+", help="源图片文件或ZIP/TAR归档")
+    parser.add_argument("-o", "--output", default=".", help="输出目录，以 .zip/.tar/.tar.gz 等结尾时写入输出归档")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="编码线程数")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="使用多个工作进程并行处理多个源文件（0表示在当前进程中逐个处理）")
+    parser.add_argument("-m", "--memory-budget", type=int, default=None,
+                        help="内存预算（MB），默认为物理内存的一半")
+    parser.add_argument("--auto", choices=AUTO_METHODS, default=None,
+                        help="自动色阶/对比度/白平衡，默认对每张图片分别分析")
+    parser.add_argument("--auto-once", action="store_true",
+                        help="汇总全部源图片只分析一次，所有图片使用同一张查找表")
+    parser.add_argument("--auto-reference", default=None,
+                        help="只分析这张参考图片，所有图片使用同一张查找表")
+    parser.add_argument("--shared-palette", action="store_true",
+                        help="GIF/PNG-8输出使用从全部源图片生成的同一个调色板")
+    parser.add_argument("--dedup", action="store_true",
+                        help="按感知哈希找出重复的源图片，每组只处理一张，其余的链接或复制其输出")
+    parser.add_argument("--dedup-hash", choices=HASH_METHODS, default=DEFAULT_HASH_METHOD, help="感知哈希算法")
+    parser.add_argument("--dedup-threshold", type=int, default=DEFAULT_HASH_THRESHOLD,
+                        help="视为重复的最大汉明距离（0~64）")
+    parser.add_argument("--dedup-mode", choices=LINK_MODES, default="link",
+                        help="重复图片的输出方式：硬链接（不能链接时复制）、复制或符号链接")
+    parser.add_argument("--dedup-report", default=None, help="把重复图片的分组写入这个JSON文件")
+    args = parser.parse_args(argv)
+
+    if args.memory_budget:
+        set_default_budget(args.memory_budget * 1024 * 1024)
+    if (args.auto_once or args.auto_reference) and not args.auto:
+        parser.error("--auto-once/--auto-reference 需要同时指定 --auto")
+    if args.processes and is_archive(args.output):
+        parser.error("写入输出归档时不能使用 -p，工作进程只能输出到目录")
+    if args.dedup_report and not args.dedup:
+        parser.error("--dedup-report 需要同时指定 --dedup")
+    recipe = load_recipe(args.recipe)
+    if args.auto and (args.auto_once or args.auto_reference):
+        references = [args.auto_reference] if args.auto_reference else args.sources
+        recipe = shared_levels_recipe(recipe, iter_sources(references), args.auto)
+    elif args.auto:
+        recipe = dict(recipe, edits=dict(recipe.get("edits", {}), auto_levels=args.auto))
+    if args.shared_palette:
+        recipe = shared_palette_recipe(recipe, iter_sources(args.sources))
+    # 重复的源图片在读取时只计算哈希，不交给后续处理
+    index = DuplicateIndex(args.dedup_threshold, args.dedup_hash) if args.dedup else None
+    sources = iter_sources(args.sources)
+    if index is not None:
+        sources = index.unique(sources)
+    failed = []
+
+    def report(source, paths, error):
+        if error:
+            failed.append(source)
+            print(f"{source_name(source)}: 处理失败: {error}", file=sys.stderr)
+        else:
+            print(f"{source_name(source)}: 已生成 {len(paths)} 个文件")
+
+    if args.processes:
+        results = export_parallel(sources, recipe, args.output, args.processes, args.workers, report)
+        if index is not None:
+            link_duplicates(index, recipe, results, args.output, args.dedup_mode, on_done=report)
+            if args.dedup_report:
+                index.write_report(args.dedup_report)
+        return 1 if failed else 0
+
+    # 输出归档在全部源文件处理成功后才出现在目标位置，任一源文件失败时放弃
+    archive = ArchiveWriter(args.output) if is_archive(args.output) else None
+    results = {}
+    try:
+        for source in sources:
+            try:
+                paths = export_variants(source, recipe, args.output, args.workers, archive=archive)
+            except Exception as e:
+                report(source, None, e)
+                if archive is not None:
+                    archive.abort()
+                return 1
+            results[source_name(source)] = paths
+            report(source, paths, None)
+        if index is not None:
+            link_duplicates(index, recipe, results, args.output, args.dedup_mode, archive, report)
+            if failed and archive is not None:
+                archive.abort()
+                return 1
+    except BaseException:
+        if archive is not None:
+            archive.abort()
+        raise
+    if archive is not None:
+        archive.close()
+        print(f"已写入 {args.output}（{archive.count} 个文件）")
+    if index is not None and args.dedup_report:
+        index.write_report(args.dedup_report)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
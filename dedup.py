@@ -0,0 +1,299 @@
+"""感知哈希索引：找出内容相同但文件不同的图片（重新保存、改名、缩放过的副本）
+
+每张图片只解码到很小的尺寸（JPEG用 draft 缩小解码），计算64位的感知哈希：
+
+    dhash   相邻像素的明暗差（9x8灰度图），计算最快，对重新压缩和缩放不敏感
+    phash   32x32灰度图的DCT低频系数与中位数比较，对亮度、对比度的轻微变化更稳定
+
+两张图片哈希的汉明距离不超过阈值、颜色签名（4x4格的平均RGB）也相近时视为重复；
+灰度化或改了色相的副本明暗相同，但输出的像素不同，不算重复。
+哈希存放在BK树中，按三角不等式剪枝，查找近似重复只需比较一小部分已有的哈希，不必两两比较。
+
+批量处理时 DuplicateIndex.unique 按顺序过滤源文件：每组重复图片只产生第一张（代表图片），
+其余的记录下来，之后把代表图片的输出链接或复制过去（见 batch.py 的 --dedup）。
+分辨率比代表图片更高的副本不算重复，单独处理，避免用较低分辨率的结果代替。
+"""
+import json
+import math
+import os
+import shutil
+
+from PIL import Image
+
+from archive_io import source_name, source_stem
+from background_io import atomic_open
+
+# 感知哈希算法
+HASH_METHODS = ("dhash", "phash")
+
+DEFAULT_HASH_METHOD = "dhash"
+
+# 哈希的边长，哈希为 HASH_SIZE * HASH_SIZE 位
+HASH_SIZE = 8
+
+# pHash 做DCT的灰度图边长
+PHASH_SAMPLE_SIZE = 32
+
+# 视为重复的最大汉明距离（64位中不同的位数）
+DEFAULT_HASH_THRESHOLD = 6
+
+# 颜色签名的格数（每边）
+COLOR_GRID = 4
+
+# 视为重复的颜色签名最大差值（0~255），重新压缩和缩放的副本远小于这个值
+DEFAULT_COLOR_TOLERANCE = 24
+
+# 灰度源图像的模式，输出时仍为灰度，不能与彩色图像共用输出
+GRAY_MODES = ("1", "L", "LA", "I", "I;16", "I;16L", "I;16B", "I;16N", "F")
+
+# 重复图片的输出方式：硬链接（不能链接时复制）、复制或符号链接
+LINK_MODES = ("link", "copy", "symlink")
+
+# pHash 用到的DCT系数表：_DCT[u][x] = cos((2x + 1) * u * pi / 2N)，只保留低频的 HASH_SIZE 行
+_DCT = [[math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SAMPLE_SIZE)) for x in range(PHASH_SAMPLE_SIZE)]
+        for u in range(HASH_SIZE)]
+
+
+def hamming(a, b):
+    """两个哈希之间不同的位数"""
+    return (a ^ b).bit_count()
+
+
+def _bits(values):
+    """布尔序列依次作为整数的各位（第一个为最高位）"""
+    result = 0
+    for value in values:
+        result = (result << 1) | bool(value)
+    return result
+
+
+def dhash(gray):
+    """灰度图的差异哈希：每行相邻像素比较明暗"""
+    pixels = list(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX).getdata())
+    width = HASH_SIZE + 1
+    return _bits(pixels[row * width + x] > pixels[row * width + x + 1]
+                 for row in range(HASH_SIZE) for x in range(HASH_SIZE))
+
+
+def phash(gray):
+    """灰度图的感知哈希：低频DCT系数（不含直流分量）与其中位数比较"""
+    n = PHASH_SAMPLE_SIZE
+    pixels = list(gray.resize((n, n), Image.BOX).getdata())
+    rows = [pixels[y * n:(y + 1) * n] for y in range(n)]
+    # 可分离的二维DCT，只计算低频部分：先对每行变换，再对各列变换
+    row_coeffs = [[sum(c * p for c, p in zip(basis, row)) for basis in _DCT] for row in rows]
+    coeffs = [sum(_DCT[v][y] * row_coeffs[y][u] for y in range(n)) for v in range(HASH_SIZE) for u in range(HASH_SIZE)]
+    median = sorted(coeffs[1:])[len(coeffs) // 2 - 1]
+    return _bits(c > median for c in coeffs)
+
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
+
+
+def reduced_rgb(image):
+    """缩小解码并缩小到边长约 PHASH_SAMPLE_SIZE * 2 的RGB图像，透明区域按白色底合成"""
+    image.draft(image.mode, (PHASH_SAMPLE_SIZE * 2, PHASH_SAMPLE_SIZE * 2))
+    if min(image.width, image.height) > PHASH_SAMPLE_SIZE * 4:
+        factor = min(image.width, image.height) // (PHASH_SAMPLE_SIZE * 2)
+        # reduce 不支持调色板等模式，先缩小再转换时需要可缩小的模式
+        image = image.reduce(factor) if image.mode in ("L", "LA", "RGB", "RGBA") else image
+    if "A" in image.getbands() or image.mode in ("P", "PA"):
+        # 透明区域按白色底计算，与把透明图拼到白底上的副本一致
+        rgba = image.convert("RGBA")
+        rgb = Image.new("RGB", rgba.size, (255, 255, 255))
+        rgb.paste(rgba, mask=rgba.getchannel("A"))
+        return rgb
+    return image.convert("RGB")
+
+
+def image_hash(image, method=DEFAULT_HASH_METHOD):
+    """已打开图像（或 reduced_rgb 的结果）的感知哈希，只取决于明暗分布"""
+    if method not in HASH_FUNCTIONS:
+        raise ValueError(f"不支持的哈希算法: {method}")
+    return HASH_FUNCTIONS[method](reduced_rgb(image).convert("L"))
+
+
+def color_signature(image):
+    """颜色签名：缩小到 COLOR_GRID x COLOR_GRID 后各格的平均RGB
+
+    感知哈希只看明暗，灰度化或改了色相的副本哈希几乎相同，需要再比较颜色。
+    """
+    return reduced_rgb(image).resize((COLOR_GRID, COLOR_GRID), Image.BOX).tobytes()
+
+
+def color_distance(a, b):
+    """两个颜色签名中差别最大的一格一通道的差值"""
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+class BKTree:
+    """按汉明距离组织的BK树，查找距离不超过半径的全部哈希
+
+    节点为 [哈希, 值列表, {与子节点的距离: 子节点}]，哈希相同的值放在同一节点。
+    """
+
+    def __init__(self):
+        self.root = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key, value):
+        self.count += 1
+        if self.root is None:
+            self.root = [key, [value], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [value], {}]
+                return
+            node = child
+
+    def search(self, key, radius):
+        """距离 key 不超过 radius 的全部值
+
+        Returns:
+            [(距离, 值), ...]，按距离从近到远排列
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= radius:
+                found.extend((distance, value) for value in node[1])
+            # 子树中的哈希与 key 的距离不小于 |d - distance|
+            stack.extend(child for d, child in node[2].items() if distance - radius <= d <= distance + radius)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class DuplicateIndex:
+    """批量处理中的源图片索引，记录每组重复图片的代表图片
+
+    条目为字典：name（源名称）、stem（输出文件名中的 {stem}）、size、alpha（是否有透明通道）、
+    gray（是否为灰度源图像）、hash（感知哈希）、color（颜色签名）。
+    """
+
+    def __init__(self, threshold=DEFAULT_HASH_THRESHOLD, method=DEFAULT_HASH_METHOD,
+                 color_tolerance=DEFAULT_COLOR_TOLERANCE):
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"不支持的哈希算法: {method}")
+        self.threshold = threshold
+        self.color_tolerance = color_tolerance
+        self.method = method
+        self.tree = BKTree()
+        self.duplicates = []
+
+    def entry(self, source):
+        """读取源文件并计算哈希（只缩小解码）；源文件是文件对象时读完后回到开头"""
+        with Image.open(source) as image:
+            entry = {
+                "name": source_name(source),
+                "stem": source_stem(source),
+                "size": image.size,
+                "alpha": "A" in image.getbands() or "transparency" in image.info,
+                "gray": image.mode in GRAY_MODES,
+            }
+            reduced = reduced_rgb(image)
+        entry["hash"] = image_hash(reduced, self.method)
+        entry["color"] = color_signature(reduced)
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return entry
+
+    def find(self, entry):
+        """与 entry 重复的代表图片条目，没有时返回None
+
+        哈希距离在阈值内的候选中，取距离最近的、透明通道和灰度/彩色与 entry 一致、
+        颜色签名相近且分辨率不低于 entry 的一个。
+        """
+        for distance, candidate in self.tree.search(entry["hash"], self.threshold):
+            if candidate["alpha"] == entry["alpha"] and candidate["gray"] == entry["gray"] and \
+                    color_distance(candidate["color"], entry["color"]) <= self.color_tolerance and \
+                    candidate["size"][0] >= entry["size"][0] and candidate["size"][1] >= entry["size"][1]:
+                return candidate, distance
+        return None
+
+    def add(self, source):
+        """加入一张源图片
+
+        Returns:
+            (条目, 代表图片条目或None, 距离)：代表图片为None时 source 本身就是代表图片
+        """
+        entry = self.entry(source)
+        match = self.find(entry)
+        if match is None:
+            self.tree.add(entry["hash"], entry)
+            return entry, None, 0
+        representative, distance = match
+        self.duplicates.append((entry, representative, distance))
+        return entry, representative, distance
+
+    def unique(self, sources, on_error=None):
+        """逐个产生需要处理的源文件（每组重复图片中的代表图片），重复图片只记录在 duplicates 中
+
+        Args:
+            on_error: 无法读取的源文件的回调 on_error(source, error)；不提供时原样产生，交给后续处理报告错误
+        """
+        for source in sources:
+            try:
+                _, representative, _ = self.add(source)
+            except Exception as e:
+                if on_error is None:
+                    yield source
+                else:
+                    on_error(source, e)
+                continue
+            if representative is None:
+                yield source
+
+    def report(self):
+        """重复图片报告：每组一项，列出代表图片及其重复图片和哈希距离"""
+        groups = {}
+        for entry, representative, distance in self.duplicates:
+            group = groups.setdefault(representative["name"], {
+                "representative": representative["name"],
+                "size": list(representative["size"]),
+                "duplicates": [],
+            })
+            group["duplicates"].append({"source": entry["name"], "size": list(entry["size"]), "distance": distance})
+        return list(groups.values())
+
+    def write_report(self, path):
+        """把重复图片报告写为JSON文件"""
+        data = {"method": self.method, "threshold": self.threshold, "groups": self.report()}
+        with atomic_open(path) as f:
+            f.write(json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def link_file(target, path, mode="link"):
+    """让 path 的内容与已生成的输出 target 相同
+
+    mode 为 "link" 时创建硬链接，跨文件系统等无法链接时改为复制；"symlink" 创建相对路径的符号链接。
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"不支持的输出方式: {mode}")
+    if os.path.abspath(target) == os.path.abspath(path):
+        return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    if mode == "symlink":
+        os.symlink(os.path.relpath(target, os.path.dirname(os.path.abspath(path))), path)
+        return path
+    if mode == "link":
+        try:
+            os.link(target, path)
+            return path
+        except OSError:
+            pass
+    shutil.copyfile(target, path)
+    return path
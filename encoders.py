@@ -0,0 +1,305 @@
+"""输出编码配置：按"最快/均衡/最小"三档选择各格式的编码参数
+
+    from encoders import encoder_params
+    image.save(path, "WEBP", **encoder_params("WEBP", "smallest"))
+
+PNG的"最小"档位还会在不损失像素的前提下换成更小的模式（见 reduce_png_mode），并逐一尝试
+几种 zlib 压缩策略，保留最小的结果；这一步由 save_encoded 完成，保存时应使用它代替 Image.save。
+
+有文件大小上限时用 fit_to_size/save_to_size 搜索不超过上限的最高质量（必要时缩小尺寸），
+候选质量在线程池中并行编码到内存，只有最终选中的结果写入磁盘。
+
+也可以在命令行中测量一张图片在各格式、各档位下的编码耗时和文件大小：
+
+    python encoders.py photo.jpg --formats WEBP JPEG PNG
+"""
+import io
+import math
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+from background_io import TaskCancelled, atomic_open
+
+# 编码档位
+PROFILES = ("fastest", "balanced", "smallest")
+DEFAULT_PROFILE = "balanced"
+
+# 界面中显示的档位名称
+PROFILE_LABELS = {
+    "fastest": "最快",
+    "balanced": "均衡",
+    "smallest": "最小",
+}
+
+# 各格式在各档位下的编码参数
+# WebP 的 method 和 AVIF 的 speed 决定压缩耗时，AVIF 还可以使用多线程编码
+ENCODER_PROFILES = {
+    "PNG": {
+        "fastest": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "smallest": {"compress_level": 9, "strategies": ("default", "filtered", "rle")},
+    },
+    "JPEG": {
+        "fastest": {"quality": 90},
+        "balanced": {"quality": 85, "optimize": True},
+        "smallest": {"quality": 80, "optimize": True, "progressive": True},
+    },
+    "WEBP": {
+        "fastest": {"quality": 80, "method": 0},
+        "balanced": {"quality": 80, "method": 4},
+        "smallest": {"quality": 75, "method": 6},
+    },
+    "AVIF": {
+        "fastest": {"quality": 70, "speed": 10, "max_threads": os.cpu_count() or 1},
+        "balanced": {"quality": 65, "speed": 6, "max_threads": os.cpu_count() or 1},
+        "smallest": {"quality": 60, "speed": 4, "max_threads": os.cpu_count() or 1},
+    },
+}
+
+# PNG 可尝试的 zlib 压缩策略；照片类图像用 rle 往往更小，图形类用 default/filtered 更小
+PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "rle": zlib.Z_RLE,
+}
+
+# 可以通过 quality 控制大小的格式
+QUALITY_FORMATS = ("JPEG", "WEBP", "AVIF")
+
+# 按大小搜索时的质量范围
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+
+# 每轮并行试探的候选质量数
+SEARCH_CANDIDATES = 4
+
+# 最低质量仍超出上限时，最多缩小尺寸的次数
+MAX_RESIZE_STEPS = 4
+
+
+def avif_supported():
+    """当前Pillow是否能写入AVIF"""
+    try:
+        return bool(features.check("avif"))
+    except ValueError:
+        return False
+
+
+def output_formats():
+    """当前环境支持的带编码档位的输出格式"""
+    formats = ["PNG", "JPEG"]
+    if features.check("webp"):
+        formats.append("WEBP")
+    if avif_supported():
+        formats.append("AVIF")
+    return formats
+
+
+def encoder_params(format_code, profile=DEFAULT_PROFILE, **overrides):
+    """返回指定格式和档位的编码参数，overrides 中的参数优先
+
+    没有档位设置的格式（GIF/BMP/TIFF）只返回 overrides。
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"未知的编码档位: {profile}")
+    params = dict(ENCODER_PROFILES.get(format_code, {}).get(profile, {}))
+    params.update(overrides)
+    return params
+
+
+def reduce_png_mode(image):
+    """在像素完全不变的前提下换成PNG中更小的模式
+
+    完全不透明的RGBA去掉alpha通道；三个通道相同的RGB转为L；不超过256种颜色的RGB转为调色板模式。
+    """
+    from PIL import ImageChops
+
+    if image.mode == "RGBA" and image.getchannel("A").getextrema()[0] == 255:
+        image = image.convert("RGB")
+    if image.mode != "RGB":
+        return image
+    r, g, b = image.split()
+    if ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(r, b).getbbox() is None:
+        return r
+    if image.getcolors(256):
+        from quantize import quantize_image
+        return quantize_image(image)
+    return image
+
+
+def save_encoded(image, fp, format_code, **params):
+    """按编码参数保存图像
+
+    参数中的 "strategies"（只用于PNG）不是 Image.save 的参数：此时原图和 reduce_png_mode 缩减模式后的图像
+    分别按其中的每种压缩策略编码到内存，只把最小的结果写入 fp。
+    小图换成调色板后PLTE块的开销可能超过节省的数据，所以原图也参与比较。
+    """
+    strategies = params.pop("strategies", None)
+    if not strategies or format_code != "PNG":
+        image.save(fp, format=format_code, **params)
+        return
+    reduced = reduce_png_mode(image)
+    candidates = (image,) if reduced is image else (image, reduced)
+    best = None
+    for candidate in candidates:
+        for strategy in strategies:
+            buffer = io.BytesIO()
+            candidate.save(buffer, format=format_code, compress_type=PNG_STRATEGIES[strategy], **params)
+            if best is None or buffer.tell() < best.tell():
+                best = buffer
+    fp.write(best.getbuffer())
+
+
+def _encode(image, format_code, params):
+    buffer = io.BytesIO()
+    save_encoded(image, buffer, format_code, **params)
+    return buffer
+
+
+def _search_quality(image, format_code, max_bytes, params, min_quality, executor, cancel_event):
+    """在 [min_quality, MAX_QUALITY] 中并行多路搜索不超过 max_bytes 的最高质量
+
+    每轮在当前区间内均匀取若干候选同时编码，再把区间缩小到
+    最高的合格候选与最低的超限候选之间。
+
+    Returns:
+        (结果, 最小编码字节数)：结果为 (BytesIO, 参数) 或None
+    """
+    if format_code not in QUALITY_FORMATS:
+        buffer = _encode(image, format_code, params)
+        size = buffer.tell()
+        return ((buffer, params) if size <= max_bytes else None), size
+
+    # Image.save 会在图像对象上记录编码参数，并行编码时每个候选使用各自的图像对象
+    images = [image] + [image.copy() for _ in range(SEARCH_CANDIDATES - 1)]
+    low, high = min_quality, MAX_QUALITY
+    best = None
+    smallest = None
+    while low <= high:
+        if cancel_event and cancel_event.is_set():
+            raise TaskCancelled()
+        count = min(SEARCH_CANDIDATES, high - low + 1)
+        qualities = sorted({low + round(i * (high - low) / max(1, count - 1)) for i in range(count)})
+        candidates = [dict(params, quality=q) for q in qualities]
+        buffers = list(executor.map(lambda im, p: _encode(im, format_code, p), images, candidates))
+
+        sizes = [b.tell() for b in buffers]
+        smallest = min(sizes if smallest is None else sizes + [smallest])
+        fitting = [i for i, size in enumerate(sizes) if size <= max_bytes]
+        over = [q for q, size in zip(qualities, sizes) if size > max_bytes]
+        if fitting:
+            best = (buffers[fitting[-1]], candidates[fitting[-1]])
+            low = qualities[fitting[-1]] + 1
+        if over:
+            high = min(over) - 1
+    return best, smallest
+
+
+def fit_to_size(image, format_code, max_bytes, profile=DEFAULT_PROFILE, allow_resize=False,
+                min_quality=MIN_QUALITY, workers=None, cancel_event=None, **overrides):
+    """编码出不超过 max_bytes 字节的最高质量结果
+
+    Args:
+        allow_resize: 最低质量仍超出上限时，是否按比例缩小尺寸后重新搜索
+        workers: 并行编码的线程数，默认为每轮的候选数
+
+    Returns:
+        (BytesIO, 编码参数, 输出尺寸)
+
+    Raises:
+        ValueError: 无法满足大小上限
+    """
+    params = encoder_params(format_code, profile, **overrides)
+    if "max_threads" in params:
+        # 多个候选同时编码，平分编码器线程
+        params["max_threads"] = max(1, params["max_threads"] // SEARCH_CANDIDATES)
+    current = image
+    with ThreadPoolExecutor(max_workers=workers or SEARCH_CANDIDATES) as executor:
+        for _ in range(MAX_RESIZE_STEPS + 1):
+            result, smallest = _search_quality(current, format_code, max_bytes, params,
+                                               min_quality, executor, cancel_event)
+            if result:
+                return result[0], result[1], current.size
+            if not allow_resize:
+                break
+            # 文件大小大致与像素数成正比，按面积比例估算新尺寸并留出余量
+            scale = math.sqrt(max_bytes / smallest) * 0.95
+            size = (max(1, int(current.width * scale)), max(1, int(current.height * scale)))
+            if size == current.size:
+                break
+            current = image.resize(size, Image.LANCZOS)
+    raise ValueError(f"无法在 {max_bytes} 字节内编码为 {format_code}")
+
+
+def save_to_size(image, path, format_code, max_bytes, profile=DEFAULT_PROFILE, allow_resize=False,
+                 progress=None, cancel_event=None, **overrides):
+    """按大小上限搜索编码参数，只把最终结果原子地写入 path
+
+    Returns:
+        (path, 编码参数, 输出尺寸)
+    """
+    buffer, params, size = fit_to_size(image, format_code, max_bytes, profile, allow_resize,
+                                       cancel_event=cancel_event, **overrides)
+    with atomic_open(path) as fp:
+        fp.write(buffer.getbuffer())
+    if progress:
+        progress(1.0)
+    return path, params, size
+
+
+def measure_profiles(image, formats=None, profiles=PROFILES, repeat=1):
+    """在内存中编码并测量各格式、各档位的耗时和大小
+
+    Returns:
+        [{"format", "profile", "seconds", "bytes"}, ...]，耗时取 repeat 次中的最小值
+    """
+    results = []
+    for format_code in formats or output_formats():
+        source = image.convert("RGB") if format_code == "JPEG" and image.mode not in ("RGB", "L") else image
+        for profile in profiles:
+            params = encoder_params(format_code, profile)
+            best = None
+            for _ in range(repeat):
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                save_encoded(source, buffer, format_code, **params)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({
+                "format": format_code,
+                "profile": profile,
+                "seconds": best,
+                "bytes": buffer.tell(),
+            })
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="测量各编码档位的耗时和文件大小")
+    parser.add_argument("image", help="测试图片")
+    parser.add_argument("--formats", nargs="+", default=None, help="要测量的格式，默认为全部支持的格式")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复编码次数")
+    args = parser.parse_args(argv)
+
+    with Image.open(args.image) as image:
+        image.load()
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        formats = [f.upper() for f in args.formats] if args.formats else None
+        results = measure_profiles(image, formats, repeat=args.repeat)
+
+    print(f"{'format':<8}{'profile':<12}{'ms':>10}{'KB':>12}")
+    for row in results:
+        print(f"{row['format']:<8}{row['profile']:<12}{row['seconds'] * 1000:>10.1f}{row['bytes'] / 1024:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
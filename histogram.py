@@ -0,0 +1,123 @@
+"""色彩调整时的实时直方图
+
+直方图只在加载图片时从缩小的代理图像统计一次。亮度和对比度都是逐通道的点运算，
+调整后的直方图由查找表（LUT）重新分配256个计数得到，不需要重新扫描像素，耗时在微秒级；
+饱和度会混合各通道，不能用逐通道的LUT表示（自动色阶各通道的LUT不同，亮度也无法推算），
+此时对代理图像（最多几万像素）重新统计，耗时约一两毫秒。
+两种情况都不读取原图，不会拖慢真正的色彩处理。
+"""
+from PIL import Image, ImageEnhance
+
+# 代理图像的最大边长
+HISTOGRAM_PROXY_SIZE = 256
+
+# 直方图的通道：R、G、B 以及亮度 L
+HISTOGRAM_CHANNELS = ("R", "G", "B", "L")
+
+# 0~255 的渐变，用来求出 ImageEnhance 对每个取值的实际结果
+_GRADIENT = Image.frombytes("L", (256, 1), bytes(range(256)))
+
+
+def histogram_proxy(image, max_size=HISTOGRAM_PROXY_SIZE):
+    """把图像缩小到最大边长不超过 max_size，返回 (RGB代理图像, 透明度掩码或None)"""
+    factor = max(1, -(-max(image.size) // max_size))
+    proxy = image.reduce(factor) if factor > 1 else image
+    mask = proxy.getchannel("A") if "A" in proxy.getbands() else None
+    if proxy.mode != "RGB":
+        proxy = proxy.convert("RGB")
+    return proxy, mask
+
+
+def channel_histograms(image, mask=None):
+    """统计RGB图像各通道及亮度的直方图，有掩码时只统计不透明的像素"""
+    counts = image.histogram(mask)
+    histograms = {band: counts[i * 256:(i + 1) * 256] for i, band in enumerate("RGB")}
+    histograms["L"] = image.convert("L").histogram(mask)
+    return histograms
+
+
+def enhance_lut(enhancer, factor):
+    """ImageEnhance 对 0~255 各取值的结果，作为256项的查找表"""
+    return list(enhancer(_GRADIENT).enhance(factor).tobytes())
+
+
+def contrast_lut(factor, mean):
+    """以平均灰度 mean 为中心的对比度查找表（与 ImageEnhance.Contrast 的混合方式相同）"""
+    degenerate = Image.new("L", (256, 1), mean)
+    return list(Image.blend(degenerate, _GRADIENT, factor).tobytes())
+
+
+def remap(histogram, lut):
+    """按查找表重新分配直方图的计数"""
+    result = [0] * 256
+    for value, count in enumerate(histogram):
+        if count:
+            result[lut[value]] += count
+    return result
+
+
+def histogram_mean(histogram):
+    """直方图的平均值，按 ImageEnhance.Contrast 的方式四舍五入为整数"""
+    total = sum(histogram)
+    if not total:
+        return 0
+    return int(sum(i * c for i, c in enumerate(histogram)) / total + 0.5)
+
+
+def clipping(histogram):
+    """取值为0和255的像素比例，用于提示暗部和高光是否被截断"""
+    total = sum(histogram) or 1
+    return histogram[0] / total, histogram[255] / total
+
+
+def histogram_points(histogram, width, height, peak):
+    """把直方图换算成画布上折线的坐标序列 [x0, y0, x1, y1, ...]，超过 peak 的计数画到顶部"""
+    points = []
+    peak = peak or 1
+    for value, count in enumerate(histogram):
+        points.append(value * (width - 1) / 255.0)
+        points.append(height - min(height, count * height / peak))
+    return points
+
+
+def display_peak(histograms):
+    """纵轴的满刻度：去掉两端（截断处常有尖峰）后各通道的最大计数"""
+    return max((max(h[1:255]) for h in histograms.values()), default=0)
+
+
+class LiveHistogram:
+    """一张图片的实时直方图，色彩参数变化时按 adjusted 计算调整后的直方图"""
+
+    def __init__(self, image, max_size=HISTOGRAM_PROXY_SIZE):
+        self.proxy, self.mask = histogram_proxy(image, max_size)
+        self.base = channel_histograms(self.proxy, self.mask)
+        # ImageEnhance.Contrast 的中心按全部像素（包括透明像素）计算
+        self.luma = self.base["L"] if self.mask is None else self.proxy.convert("L").histogram()
+
+    def adjusted(self, brightness=1.0, contrast=1.0, saturation=1.0, levels=None):
+        """返回按当前色彩参数（及 auto_levels 的色阶查找表）调整后的 {通道: 直方图}"""
+        if saturation != 1.0 or levels:
+            # 饱和度混合了各通道，色阶各通道的查找表不同，灰度直方图都无法由查找表推算，
+            # 只能在代理图像上重新统计
+            image = self.proxy.point(list(levels)) if levels else self.proxy
+            if brightness != 1.0:
+                image = ImageEnhance.Brightness(image).enhance(brightness)
+            if contrast != 1.0:
+                image = ImageEnhance.Contrast(image).enhance(contrast)
+            if saturation != 1.0:
+                image = ImageEnhance.Color(image).enhance(saturation)
+            return channel_histograms(image, self.mask)
+
+        lut = list(range(256))
+        luma = self.luma
+        if brightness != 1.0:
+            lut = enhance_lut(ImageEnhance.Brightness, brightness)
+            # 亮度调整后的灰度直方图按同一LUT近似，只用于求对比度的中心
+            luma = remap(luma, lut)
+        if contrast != 1.0:
+            step = contrast_lut(contrast, histogram_mean(luma))
+            lut = [step[v] for v in lut]
+        if lut == list(range(256)):
+            return dict(self.base)
+        # 亮度通道同样按LUT重新分配（各通道的LUT相同，灰度近似随之变化）
+        return {band: remap(histogram, lut) for band, histogram in self.base.items()}
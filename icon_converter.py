@@ -0,0 +1,140 @@
+"""图标格式转换（ICO、ICNS），不依赖界面"""
+import os
+import sys
+
+from PIL import Image
+
+from background_io import atomic_open
+
+
+class IconConverter:
+    """用于转换图像为各种图标格式的工具类"""
+    
+    @staticmethod
+    def create_ico(image, output_path, sizes=None):
+        """将PIL图像转换为.ico格式
+        
+        Args:
+            image: PIL图像对象
+            output_path: 输出的.ico文件路径或文件对象
+            sizes: 要包含的尺寸列表，默认为[16, 32, 48, 64, 128, 256]
+        """
+        if sizes is None:
+            sizes = [16, 32, 48, 64, 128, 256]
+        
+        # 确保图像是正方形，否则进行裁剪
+        width, height = image.size
+        if width != height:
+            # 取最小的边作为裁剪尺寸
+            size = min(width, height)
+            # 计算裁剪区域，使其居中
+            left = (width - size) // 2
+            top = (height - size) // 2
+            right = left + size
+            bottom = top + size
+            image = image.crop((left, top, right, bottom))
+        
+        # 创建不同尺寸的图像
+        icons = []
+        for size in sizes:
+            # 调整图像大小，保持纵横比
+            resized_img = image.resize((size, size), Image.LANCZOS)
+            icons.append(resized_img)
+        
+        # 保存为.ico文件（也可以直接写入已打开的文件对象）
+        params = dict(format='ICO', sizes=[(img.width, img.height) for img in icons], append_images=icons[1:])
+        if hasattr(output_path, 'write'):
+            icons[0].save(output_path, **params)
+        else:
+            with atomic_open(output_path) as fp:
+                icons[0].save(fp, **params)
+        return output_path
+    
+    @staticmethod
+    def create_icns(image, output_path):
+        """将PIL图像转换为.icns格式
+        
+        Args:
+            image: PIL图像对象
+            output_path: 输出的.icns文件路径
+        """
+        # 确保输出路径以.icns结尾
+        if not output_path.lower().endswith('.icns'):
+            output_path += '.icns'
+            
+        # 只有生成ICNS时才需要这些模块
+        import shutil
+        import subprocess
+        import tempfile
+
+        # 创建临时目录存放图标集
+        with tempfile.TemporaryDirectory() as iconset_dir:
+            iconset_path = os.path.join(iconset_dir, 'icon.iconset')
+            os.makedirs(iconset_path, exist_ok=True)
+            
+            # 确保图像是正方形
+            width, height = image.size
+            if width != height:
+                # 取最小的边作为裁剪尺寸
+                size = min(width, height)
+                # 计算裁剪区域，使其居中
+                left = (width - size) // 2
+                top = (height - size) // 2
+                right = left + size
+                bottom = top + size
+                image = image.crop((left, top, right, bottom))
+                
+            # 创建所需的各种尺寸图标
+            icon_sizes = [16, 32, 128, 256, 512]
+            retina_sizes = [32, 64, 256, 512, 1024]
+            
+            # 生成正常尺寸图标
+            for size in icon_sizes:
+                resized = image.resize((size, size), Image.LANCZOS)
+                icon_path = os.path.join(iconset_path, f'icon_{size}x{size}.png')
+                resized.save(icon_path, 'PNG')
+            
+            # 生成Retina尺寸图标（2x分辨率）
+            for i, size in enumerate(icon_sizes):
+                retina_size = retina_sizes[i]
+                resized = image.resize((retina_size, retina_size), Image.LANCZOS)
+                icon_path = os.path.join(iconset_path, f'icon_{size}x{size}@2x.png')
+                resized.save(icon_path, 'PNG')
+            
+            # 尝试使用iconutil（macOS）转换为icns
+            try:
+                if sys.platform == 'darwin':  # macOS系统
+                    icns_path = os.path.join(iconset_dir, 'icon.icns')
+                    subprocess.run(['iconutil', '-c', 'icns', iconset_path, '-o', icns_path], 
+                                   check=True)
+                    with open(icns_path, 'rb') as src, atomic_open(output_path) as dst:
+                        shutil.copyfileobj(src, dst)
+                    return output_path
+            except (subprocess.SubprocessError, FileNotFoundError):
+                pass
+            
+            # 如果iconutil失败或不是macOS，尝试使用PIL自行生成icns
+            try:
+                # 生成最大尺寸的PNG
+                max_size = 1024
+                max_image = image.resize((max_size, max_size), Image.LANCZOS)
+                
+                # 在临时目录中创建一个PNG
+                png_path = os.path.join(iconset_dir, 'temp_icon.png')
+                max_image.save(png_path, 'PNG')
+                
+                # 读取PNG数据
+                with open(png_path, 'rb') as f:
+                    png_data = f.read()
+                
+                # 创建简单的ICNS文件结构
+                # ICNS格式有点复杂，这里是简化实现
+                icns_data = b'icns' + len(png_data).to_bytes(4, byteorder='big') + b'ic10' + png_data
+                
+                # 写入ICNS文件
+                with atomic_open(output_path) as f:
+                    f.write(icns_data)
+                
+                return output_path
+            except Exception as e:
+                raise Exception(f"无法创建ICNS文件: {str(e)}")
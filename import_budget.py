@@ -0,0 +1,116 @@
+"""检查各入口模块的冷启动导入耗时
+
+在新的Python进程中用 `-X importtime` 导入模块，取多次测量的最小值与预算比较，
+同时检查无界面入口没有加载tkinter，以及只在用到时才需要的模块没有在导入时被加载：
+
+    python import_budget.py              # 检查全部入口
+    python import_budget.py batch app    # 只检查指定模块
+    python import_budget.py --scale 2    # 在较慢的机器上放宽预算
+
+超出预算或加载了不该加载的模块时返回非零退出码，可以放在构建流水线中防止启动变慢。
+"""
+import os
+import re
+import subprocess
+import sys
+
+# 各入口模块的导入耗时预算（毫秒），包含Pillow本身的导入
+IMPORT_BUDGETS = {
+    "pipeline": 80,
+    "batch": 100,
+    "encoders": 90,
+    "array_api": 90,
+    "service": 150,
+    "app": 150,
+}
+
+# 界面入口，只有它们可以加载tkinter
+GUI_MODULES = ("app",)
+
+# 无界面入口不允许加载的模块
+HEADLESS_FORBIDDEN = ("tkinter", "_tkinter", "PIL.ImageTk", "tkinterdnd2")
+
+# 任何入口在导入时都不应加载的模块，它们只在并行处理、命令行解析、生成ICNS或创建窗口时才导入
+LAZY_MODULES = ("multiprocessing", "argparse", "subprocess", "tkinterdnd2")
+
+# 每个模块测量的次数
+DEFAULT_REPEAT = 5
+
+# -X importtime 的输出行: "import time: self | cumulative | name"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\| *(\S+)\s*$")
+
+
+def parse_importtime(output):
+    """解析 -X importtime 的输出
+
+    Returns:
+        {模块名: (自身耗时, 累计耗时)}，单位为微秒
+    """
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(3)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def measure_import(module, cwd=None):
+    """在新进程中导入 module，返回 (累计耗时毫秒, 已加载的模块名集合)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr.strip()}")
+    modules = parse_importtime(result.stderr)
+    return modules[module][1] / 1000.0, set(modules)
+
+
+def check_module(module, budget_ms, repeat=DEFAULT_REPEAT, cwd=None):
+    """测量一个入口模块并检查预算和不应加载的模块
+
+    Returns:
+        {"module", "ms", "budget", "loaded"(不应加载却被加载的模块列表), "ok"}
+    """
+    best = None
+    loaded = set()
+    for _ in range(repeat):
+        ms, names = measure_import(module, cwd)
+        best = ms if best is None else min(best, ms)
+        loaded = names
+    forbidden = LAZY_MODULES if module in GUI_MODULES else LAZY_MODULES + HEADLESS_FORBIDDEN
+    unexpected = sorted({name for name in forbidden if name in loaded})
+    return {
+        "module": module,
+        "ms": best,
+        "budget": budget_ms,
+        "loaded": unexpected,
+        "ok": best <= budget_ms and not unexpected,
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="检查入口模块的导入耗时预算")
+    parser.add_argument("modules", nargs="*", help="要检查的模块，默认为全部入口")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每个模块测量的次数")
+    parser.add_argument("--scale", type=float, default=1.0, help="预算的放大倍数")
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    # 先导入一次，生成字节码缓存，避免把编译时间算进冷启动
+    for module in args.modules or IMPORT_BUDGETS:
+        measure_import(module, cwd)
+
+    failed = False
+    print(f"{'module':<12}{'ms':>10}{'budget':>10}  note")
+    for module in args.modules or IMPORT_BUDGETS:
+        budget = IMPORT_BUDGETS.get(module, max(IMPORT_BUDGETS.values())) * args.scale
+        row = check_module(module, budget, args.repeat, cwd)
+        note = "" if row["ok"] else "超出预算" if not row["loaded"] else "加载了 " + ", ".join(row["loaded"])
+        print(f"{module:<12}{row['ms']:>10.1f}{row['budget']:>10.0f}  {note}")
+        failed = failed or not row["ok"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
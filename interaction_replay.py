@@ -0,0 +1,617 @@
+"""录制界面交互并回放，测量界面响应速度
+
+卡顿大多出现在连续的交互中：滚轮连续缩放（zoom_image）、拖动色彩滑块（update_color_adjustments）、
+拖动裁剪框（update_crop）。录制时把这些事件及其时间写入文件，回放时按原来的节奏驱动
+ImageTrimmerApp，统计每个事件的延迟分位数和丢帧数，便于复现和比较性能变化：
+
+    python interaction_replay.py record session.jsonl           # 打开界面并录制，关闭窗口时保存
+    python interaction_replay.py synth session.jsonl            # 生成一段标准的合成交互
+    python interaction_replay.py replay session.jsonl -i 图片    # 无界面回放（使用替身画布）
+    xvfb-run python interaction_replay.py replay session.jsonl -i 图片 --tk   # 使用真实的Tk回放
+
+回放时界面线程的定时器（root.after）由回放循环执行，事件延迟为事件发生时刻到处理完成并刷新显示的时间，
+包括排在前面的工作造成的等待；延迟渲染等定时回调单独统计为 deferred。
+界面线程每被连续占用一个帧间隔，就记为丢失一帧。
+"""
+import heapq
+import itertools
+import json
+import sys
+import time
+import tkinter.constants
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# 显示器刷新间隔（毫秒），界面线程连续占用超过这一时间就会丢帧
+FRAME_MS = 1000.0 / 60
+
+# 替身画布的默认尺寸，录制文件中记录了画布尺寸时以录制的为准
+DEFAULT_CANVAS_SIZE = (800, 600)
+
+# 最后一个事件之后继续执行定时回调的最长时间（秒），让延迟渲染完成
+DRAIN_SECONDS = 2.0
+
+# 录制的画布事件及其类型
+CANVAS_EVENTS = {
+    "<MouseWheel>": "wheel",
+    "<Button-4>": "wheel",
+    "<Button-5>": "wheel",
+    "<ButtonPress-1>": "press",
+    "<B1-Motion>": "drag",
+    "<ButtonRelease-1>": "release",
+}
+
+# 录制的色彩滑块：名称 -> 界面中对应变量的属性名
+SLIDERS = {
+    "brightness": "brightness_value",
+    "contrast": "contrast_value",
+    "saturation": "saturation_value",
+}
+
+# 报告中各类事件的显示顺序
+REPORT_KINDS = ("wheel", "slider", "press", "drag", "release", "deferred")
+
+# 录制文件格式版本
+SESSION_VERSION = 1
+
+
+class InteractionRecorder:
+    """在运行中的界面上录制滚轮、滑块和裁剪框拖动事件
+
+    只录制图片加载之后的事件，时间从第一个事件开始计算。绑定使用 add="+"，不影响界面原有的处理。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.events = []
+        self.start = None
+        self.slider_values = {name: getattr(app, attr).get() for name, attr in SLIDERS.items()}
+
+    def attach(self):
+        for sequence, kind in CANVAS_EVENTS.items():
+            self.app.canvas.bind(sequence, lambda event, kind=kind: self.on_canvas(kind, event), add="+")
+        for name, attr in SLIDERS.items():
+            getattr(self.app, attr).trace_add("write", lambda *args, name=name: self.on_slider(name))
+        return self
+
+    def record(self, event):
+        if self.app.original_image is None:
+            return
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        event["t"] = round(now - self.start, 4)
+        self.events.append(event)
+
+    def on_canvas(self, kind, event):
+        entry = {"type": kind, "x": event.x, "y": event.y}
+        if kind == "wheel":
+            # 原样记录Tk给出的两个字段，回放时 zoom_image 按相同的分支处理
+            entry["delta"] = event.delta
+            entry["num"] = event.num
+        elif kind == "press":
+            # 记录按下时裁剪框的位置，回放时据此恢复裁剪框
+            crop_rect = self.app.crop_rect
+            entry["crop"] = self.app.canvas.coords(crop_rect) if crop_rect else None
+            entry["mode"] = self.app.operation_mode.get()
+        self.record(entry)
+
+    def on_slider(self, name):
+        value = getattr(self.app, SLIDERS[name]).get()
+        # 加载图片或重置时写入相同的值不算拖动
+        if value == self.slider_values[name]:
+            return
+        self.slider_values[name] = value
+        self.record({"type": "slider", "name": name, "value": value})
+
+    def meta(self):
+        canvas = self.app.canvas
+        return {
+            "type": "meta",
+            "version": SESSION_VERSION,
+            "image": self.app.source_path.get(),
+            "canvas": [canvas.winfo_width(), canvas.winfo_height()],
+        }
+
+    def save(self, path):
+        save_session(path, self.meta(), self.events)
+        return path
+
+
+def save_session(path, meta, events):
+    """写入录制文件：第一行为元信息，之后每行一个事件"""
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in [meta] + list(events):
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def load_session(path):
+    """读取录制文件，返回 (元信息, 按时间排序的事件列表)"""
+    meta = {}
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("type") == "meta":
+                meta = entry
+            else:
+                events.append(entry)
+    events.sort(key=lambda e: e["t"])
+    return meta, events
+
+
+def synthetic_session(canvas_size=DEFAULT_CANVAS_SIZE):
+    """生成一段标准交互：滚轮连续缩放、拖动两个色彩滑块、拖动裁剪框
+
+    Returns:
+        (元信息, 事件列表)
+    """
+    width, height = canvas_size
+    cx, cy = width // 2, height // 2
+    events = []
+    t = 0.0
+
+    # 滚轮：连续放大再缩小，每15毫秒一格
+    for delta in [120] * 6 + [-120] * 6:
+        events.append({"t": round(t, 4), "type": "wheel", "x": cx, "y": cy, "delta": delta, "num": "??"})
+        t += 0.015
+    t += 0.5
+
+    # 滑块：每帧移动一次
+    for name, start, end in (("brightness", 1.0, 1.4), ("saturation", 1.0, 0.6)):
+        steps = 30
+        for i in range(1, steps + 1):
+            value = round(start + (end - start) * i / steps, 4)
+            events.append({"t": round(t, 4), "type": "slider", "name": name, "value": value})
+            t += FRAME_MS / 1000
+        t += 0.5
+
+    # 裁剪框：在画布中央放一个200x150的框，按住后每帧拖动3像素
+    crop = [cx - 100, cy - 75, cx + 100, cy + 75]
+    events.append({"t": round(t, 4), "type": "press", "x": cx, "y": cy, "crop": crop, "mode": "crop"})
+    for i in range(1, 41):
+        t += FRAME_MS / 1000
+        events.append({"t": round(t, 4), "type": "drag", "x": cx + 3 * i, "y": cy + 2 * i})
+    t += FRAME_MS / 1000
+    events.append({"t": round(t, 4), "type": "release", "x": cx + 120, "y": cy + 80})
+
+    meta = {"type": "meta", "version": SESSION_VERSION, "image": "", "canvas": list(canvas_size)}
+    return meta, events
+
+
+class EventLoop:
+    """代替Tk执行界面线程的定时器，由回放循环驱动，记录每个回调占用界面线程的时间
+
+    Args:
+        flush: 每个回调之后调用，把绘制结果刷新到屏幕（真实Tk为 root.update）
+    """
+
+    def __init__(self, flush=None):
+        self.flush = flush
+        self.timers = []
+        self.cancelled = set()
+        self.counter = itertools.count()
+        self.busy = []  # (类别, 开始时间, 耗时秒)
+
+    def after(self, ms, func=None, *args):
+        if func is None:
+            time.sleep(ms / 1000.0)
+            return None
+        n = next(self.counter)
+        heapq.heappush(self.timers, (time.perf_counter() + ms / 1000.0, n, func, args))
+        return f"after#{n}"
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, job):
+        self.cancelled.add(job)
+
+    def call(self, kind, func, *args):
+        """在界面线程中执行一个回调并刷新显示，返回完成的时刻"""
+        start = time.perf_counter()
+        try:
+            func(*args)
+            if self.flush:
+                self.flush()
+        finally:
+            end = time.perf_counter()
+            self.busy.append((kind, start, end - start))
+        return end
+
+    def run_until(self, deadline=None):
+        """执行到期的定时回调，直到 deadline；deadline 为None时执行到没有定时器为止"""
+        while True:
+            now = time.perf_counter()
+            if self.timers and self.timers[0][0] <= now:
+                _, n, func, args = heapq.heappop(self.timers)
+                job = f"after#{n}"
+                if job in self.cancelled:
+                    self.cancelled.discard(job)
+                else:
+                    self.call("deferred", func, *args)
+                continue
+            if deadline is None and not self.timers:
+                return
+            if deadline is not None and now >= deadline:
+                return
+            wake = self.timers[0][0] if self.timers else deadline
+            if deadline is not None:
+                wake = min(wake, deadline)
+            time.sleep(max(0.0, wake - now))
+
+
+class StubWidget:
+    """不需要显示器的控件替身，接受任意参数，未定义的方法什么也不做"""
+
+    def __init__(self, *args, **kwargs):
+        self.options = dict(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+    def __getitem__(self, key):
+        return self.options.get(key)
+
+    def __setitem__(self, key, value):
+        self.options[key] = value
+
+
+class StubVar:
+    """tkinter 变量的替身"""
+    default = ""
+    cast = str
+
+    def __init__(self, master=None, value=None, name=None):
+        self.value = self.default if value is None else value
+        self.callbacks = []
+
+    def get(self):
+        return self.cast(self.value)
+
+    def set(self, value):
+        self.value = value
+        for callback in self.callbacks:
+            callback()
+
+    def trace_add(self, mode, callback):
+        self.callbacks.append(callback)
+
+
+class StubIntVar(StubVar):
+    default = 0
+    cast = int
+
+
+class StubDoubleVar(StubVar):
+    default = 0.0
+    cast = float
+
+
+class StubBooleanVar(StubVar):
+    default = False
+    cast = bool
+
+
+class StubCanvas(StubWidget):
+    """记录图元坐标的画布替身，没有滚动"""
+
+    def __init__(self, *args, size=DEFAULT_CANVAS_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size = tuple(size)
+        self.items = {}
+        self.counter = itertools.count(1)
+
+    def create(self, *coords):
+        item = next(self.counter)
+        self.items[item] = [float(c) for c in coords]
+        return item
+
+    def create_image(self, x, y, **kwargs):
+        return self.create(x, y)
+
+    def create_rectangle(self, x1, y1, x2, y2, **kwargs):
+        return self.create(x1, y1, x2, y2)
+
+    def create_text(self, x, y, **kwargs):
+        return self.create(x, y)
+
+    def create_line(self, *coords, **kwargs):
+        return self.create(*coords)
+
+    def coords(self, item, *coords):
+        if coords:
+            self.items[item] = [float(c) for c in coords]
+        return list(self.items.get(item, []))
+
+    def delete(self, item):
+        self.items.pop(item, None)
+
+    def bbox(self, *args):
+        return None
+
+    def winfo_width(self):
+        return self.size[0]
+
+    def winfo_height(self):
+        return self.size[1]
+
+    def canvasx(self, x):
+        return float(x)
+
+    def canvasy(self, y):
+        return float(y)
+
+
+class StubPhotoImage:
+    """ImageTk.PhotoImage 的替身：复制一次像素数据，近似把图像交给Tk的开销"""
+
+    def __init__(self, image=None, **kwargs):
+        self.data = image.tobytes() if image is not None else b""
+
+
+class StubRoot(EventLoop, StubWidget):
+    """主窗口替身，定时器由 EventLoop 执行"""
+
+    def __init__(self):
+        EventLoop.__init__(self)
+        StubWidget.__init__(self)
+
+
+class StubMessagebox:
+    """记录弹窗内容而不显示，需要确认时一律确认"""
+
+    def __init__(self):
+        self.errors = []
+
+    def showerror(self, title, message, **kwargs):
+        self.errors.append(message)
+
+    def showwarning(self, title, message, **kwargs):
+        self.errors.append(message)
+
+    def showinfo(self, title, message, **kwargs):
+        pass
+
+    def askyesno(self, *args, **kwargs):
+        return True
+
+
+class StubTtk:
+    """ttk 的替身，所有控件都是 StubWidget"""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return StubWidget
+
+
+def stub_tk(canvas_size):
+    """tkinter 的替身：常量照用，变量、画布和窗口换成替身"""
+    names = {k: v for k, v in vars(tkinter.constants).items() if k.isupper()}
+    return SimpleNamespace(
+        StringVar=StubVar, IntVar=StubIntVar, DoubleVar=StubDoubleVar, BooleanVar=StubBooleanVar,
+        Canvas=lambda *args, **kwargs: StubCanvas(*args, size=canvas_size, **kwargs),
+        Tk=StubRoot, PhotoImage=StubWidget, TclError=tkinter.TclError, **names)
+
+
+@contextmanager
+def patched_toolkit(gui, canvas_size, headless):
+    """回放期间替换界面模块使用的弹窗，无界面时同时替换 tkinter 和 ImageTk
+
+    Yields:
+        StubMessagebox，回放结束后从中取出处理事件时弹出的错误
+    """
+    messagebox = StubMessagebox()
+    replaced = {"messagebox": messagebox}
+    if headless:
+        replaced.update(tk=stub_tk(canvas_size), ttk=StubTtk(),
+                        ImageTk=SimpleNamespace(PhotoImage=StubPhotoImage))
+    saved = {name: getattr(gui, name) for name in replaced}
+    for name, value in replaced.items():
+        setattr(gui, name, value)
+    try:
+        yield messagebox
+    finally:
+        for name, value in saved.items():
+            setattr(gui, name, value)
+
+
+def build_app(gui, canvas_size, headless):
+    """创建界面，返回 (app, EventLoop)；真实Tk的定时器也改由 EventLoop 执行"""
+    root = gui.tk.Tk()
+    app = gui.ImageTrimmerApp(root)
+    if headless:
+        # 替身窗口本身就是 EventLoop
+        return app, root
+    root.update()
+    loop = EventLoop(root.update)
+    root.after, root.after_idle, root.after_cancel = loop.after, loop.after_idle, loop.after_cancel
+    return app, loop
+
+
+def prepare_crop(app, event):
+    """按下鼠标前恢复录制时的裁剪框（不计入延迟）"""
+    crop = event.get("crop")
+    if not crop:
+        return
+    app.operation_mode.set(event.get("mode", "crop"))
+    if app.crop_rect and app.canvas.coords(app.crop_rect) == [float(c) for c in crop]:
+        return
+    if app.crop_rect:
+        app.canvas.delete(app.crop_rect)
+    app.crop_rect = app.canvas.create_rectangle(*crop, outline="red", width=2)
+
+
+def event_handler(app, event):
+    """返回处理一个录制事件的回调，与Tk调用界面的方式相同"""
+    kind = event["type"]
+    if kind == "slider":
+        variable = getattr(app, SLIDERS[event["name"]])
+
+        def slide():
+            # ttk.Scale 拖动时先写入变量，再以新值调用 command
+            variable.set(event["value"])
+            app.update_color_adjustments(str(event["value"]))
+        return slide
+    if kind == "wheel":
+        tk_event = SimpleNamespace(x=event["x"], y=event["y"], delta=event.get("delta", 0), num=event.get("num", "??"))
+        return lambda: app.zoom_image(tk_event)
+    handler = {"press": app.start_crop, "drag": app.update_crop, "release": app.end_crop}[kind]
+    tk_event = SimpleNamespace(x=event["x"], y=event["y"])
+    return lambda: handler(tk_event)
+
+
+def percentile(values, q):
+    """最近秩法的百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def replay(events, image_path, canvas_size=DEFAULT_CANVAS_SIZE, headless=True, speed=1.0, frame_ms=FRAME_MS):
+    """按录制的节奏回放事件，返回延迟和丢帧统计
+
+    Args:
+        events: load_session 或 synthetic_session 返回的事件列表
+        image_path: 回放前加载的图片
+        headless: True 时使用替身画布，不需要显示器
+        speed: 回放速度倍数，2 表示事件间隔缩短一半
+
+    Returns:
+        {"kinds": {类别: {"count", "p50", "p90", "p99", "max", "dropped"}}（毫秒），
+         "dropped_frames", "frames", "duration", "errors"}
+    """
+    import app as gui
+
+    with patched_toolkit(gui, canvas_size, headless) as messagebox:
+        app, loop = build_app(gui, canvas_size, headless)
+        try:
+            # 同步加载图片，加载本身不计入统计
+            image, working = app.read_image(image_path)
+            app.source_path.set(image_path)
+            app.on_image_loaded(image_path, image, working)
+            loop.run_until()
+            loop.busy = []
+
+            latencies = {}
+            start = time.perf_counter()
+            for event in events:
+                due = start + event["t"] / speed
+                loop.run_until(due)
+                if event["type"] == "press":
+                    prepare_crop(app, event)
+                done = loop.call(event["type"], event_handler(app, event))
+                latencies.setdefault(event["type"], []).append((done - due) * 1000)
+            loop.run_until(time.perf_counter() + DRAIN_SECONDS)
+            duration = time.perf_counter() - start
+        finally:
+            app.cancel_speculation()
+            if not headless:
+                app.root.destroy()
+
+    frame = frame_ms / 1000.0
+    dropped = {}
+    deferred = []
+    for kind, _, seconds in loop.busy:
+        dropped[kind] = dropped.get(kind, 0) + int(seconds // frame)
+        if kind == "deferred":
+            deferred.append(seconds * 1000)
+    latencies["deferred"] = deferred
+
+    kinds = {}
+    for kind, values in latencies.items():
+        if values:
+            kinds[kind] = dict(summarize(values), dropped=dropped.get(kind, 0))
+    return {
+        "kinds": kinds,
+        "dropped_frames": sum(dropped.values()),
+        "frames": int(duration // frame),
+        "duration": duration,
+        "errors": list(messagebox.errors),
+    }
+
+
+def format_report(result):
+    lines = [f"{'event':<10}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'dropped':>9}"]
+    order = [k for k in REPORT_KINDS if k in result["kinds"]] + \
+            [k for k in result["kinds"] if k not in REPORT_KINDS]
+    for kind in order:
+        row = result["kinds"][kind]
+        lines.append(f"{kind:<10}{row['count']:>7}{row['p50']:>9.1f}{row['p90']:>9.1f}"
+                     f"{row['p99']:>9.1f}{row['max']:>9.1f}{row['dropped']:>9}")
+    lines.append(f"丢帧: {result['dropped_frames']} / {result['frames']} 帧（{result['duration']:.2f} 秒，延迟单位为毫秒）")
+    for message in result["errors"]:
+        lines.append(f"弹窗: {message}")
+    return "\n".join(lines)
+
+
+def record(path):
+    """打开界面并录制，关闭窗口时保存到 path"""
+    import app as gui
+
+    root = gui.create_root()
+    app = gui.ImageTrimmerApp(root)
+    recorder = InteractionRecorder(app).attach()
+
+    def on_close():
+        recorder.save(path)
+        print(f"已录制 {len(recorder.events)} 个事件: {path}")
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.mainloop()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="录制和回放界面交互，测量响应速度")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="打开界面并录制交互")
+    record_parser.add_argument("session", help="录制文件")
+    synth_parser = commands.add_parser("synth", help="生成标准的合成交互")
+    synth_parser.add_argument("session", help="录制文件")
+    replay_parser = commands.add_parser("replay", help="回放录制文件并报告延迟")
+    replay_parser.add_argument("session", help="录制文件")
+    replay_parser.add_argument("-i", "--image", help="回放时加载的图片，默认为录制时的图片")
+    replay_parser.add_argument("--tk", action="store_true", help="使用真实的Tk（需要显示器，可配合xvfb-run）")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数")
+    replay_parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.session)
+        return 0
+    if args.command == "synth":
+        save_session(args.session, *synthetic_session())
+        return 0
+
+    meta, events = load_session(args.session)
+    image_path = args.image or meta.get("image")
+    if not image_path:
+        parser.error("录制文件中没有图片路径，请用 -i 指定")
+    canvas_size = tuple(meta.get("canvas") or DEFAULT_CANVAS_SIZE)
+    result = replay(events, image_path, canvas_size, headless=not args.tk, speed=args.speed)
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
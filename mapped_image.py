@@ -0,0 +1,236 @@
+"""未压缩图像的内存映射读取
+
+PPM/PGM、未压缩TIFF、NPY和裸像素文件的像素在文件中按行连续存放，
+可以直接用 mmap 映射文件并通过 Image.frombuffer 读取需要的行，不需要解码，也不会把整个文件读入内存。
+裁剪和缩放只读取目标区域所在的行，并按条带处理，处理完的条带随即从内存中释放，
+因此常驻内存取决于正在处理的区域，而不是文件大小。
+
+L/RGBA 图像的视图直接引用映射内存；Pillow内部按每像素4字节存储RGB，RGB的行在读取时会展开复制。
+"""
+import math
+import mmap
+import os
+import struct
+
+from PIL import Image
+
+# 可以映射的图像模式及每像素字节数
+MAPPED_MODES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4}
+
+# NPY 通道数对应的图像模式
+NPY_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+# 文件大于该值时才使用内存映射，小文件直接解码更简单
+MAP_MIN_BYTES = 64 * 1024 * 1024
+
+# 按条带生成缩小级别时每个条带的目标字节数
+STRIP_BYTES = 8 * 1024 * 1024
+
+
+class MappedSource:
+    """一个内存映射的未压缩图像文件
+
+    提供 size/width/height/mode 以及 resize/reduce/crop，可以在批量导出和智能裁剪中代替PIL图像使用，
+    这些操作只读取所需区域的行。
+
+    Attributes:
+        mode: 图像模式
+        size: (width, height)
+        offset: 像素数据在文件中的起始位置
+        stride: 每行字节数
+    """
+
+    def __init__(self, path, mode, size, offset):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.offset = offset
+        self.stride = size[0] * MAPPED_MODES[mode]
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if offset + self.stride * size[1] > len(self.map):
+            self.map.close()
+            raise ValueError("文件长度小于图像数据长度")
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def rows(self, top, bottom):
+        """返回 top 到 bottom 行的图像（L/RGBA为只读视图，RGB只复制这些行）"""
+        start = self.offset + top * self.stride
+        end = self.offset + bottom * self.stride
+        view = memoryview(self.map)[start:end]
+        return Image.frombuffer(self.mode, (self.size[0], bottom - top), view, "raw", self.mode, 0, 1)
+
+    def image(self):
+        """返回整幅图像，L/RGBA的像素在访问时才从文件读入"""
+        view = self.rows(0, self.size[1])
+        view.filename = self.path
+        view.mapped_source = self
+        return view
+
+    def release(self, top, bottom):
+        """通知系统 top 到 bottom 行的内存页可以丢弃（之后访问会重新从文件读取）"""
+        if not hasattr(self.map, "madvise") or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        page = mmap.PAGESIZE
+        start = (self.offset + top * self.stride) // page * page
+        end = self.offset + bottom * self.stride
+        try:
+            self.map.madvise(mmap.MADV_DONTNEED, start, end - start)
+        except (OSError, ValueError):
+            pass
+
+    def crop(self, box):
+        """只读取 box 覆盖的行并裁剪出该区域（返回独立的图像）"""
+        left, top, right, bottom = (int(v) for v in box)
+        region = self.rows(top, bottom).crop((left, 0, right, bottom - top))
+        region.load()
+        self.release(top, bottom)
+        return region
+
+    def reduce(self, factor, box=None):
+        """按条带把 box 区域缩小 factor 倍，每次只有一个条带驻留内存"""
+        left, top, right, bottom = box or (0, 0, self.width, self.height)
+        out_w = (right - left + factor - 1) // factor
+        out_h = (bottom - top + factor - 1) // factor
+        strip = max(factor, STRIP_BYTES // self.stride // factor * factor)
+        output = Image.new(self.mode, (out_w, out_h))
+        for y in range(top, bottom, strip):
+            y_end = min(bottom, y + strip)
+            band = self.rows(y, y_end)
+            output.paste(band.reduce(factor, (left, 0, right, y_end - y)), (0, (y - top) // factor))
+            del band
+            self.release(y, y_end)
+        return output
+
+    def resize(self, size, resample=Image.BICUBIC, box=None, reducing_gap=None):
+        """缩放 box 区域到 size，只读取该区域所需的行
+
+        缩小倍数较大时先按条带 reduce，再完成剩余的缩放，与Pillow的 reducing_gap 做法相同。
+        """
+        box = box or (0, 0, self.width, self.height)
+        scale_x = (box[2] - box[0]) / size[0]
+        scale_y = (box[3] - box[1]) / size[1]
+        factor = int(min(scale_x, scale_y) / (reducing_gap or 2.0))
+        if factor >= 2:
+            # 对齐到 factor 的整数区域
+            band = (int(box[0]) // factor * factor, int(box[1]) // factor * factor,
+                    min(self.width, int(math.ceil(box[2]))), min(self.height, int(math.ceil(box[3]))))
+            reduced = self.reduce(factor, band)
+            local = ((box[0] - band[0]) / factor, (box[1] - band[1]) / factor,
+                     (box[2] - band[0]) / factor, (box[3] - band[1]) / factor)
+            local = (local[0], local[1], min(local[2], reduced.width), min(local[3], reduced.height))
+            return reduced.resize(size, resample, box=local)
+
+        # 按输出的行分成条带，每个条带只取出其采样区域加滤镜支撑范围的行，缩放后拼接；
+        # 各条带的缩放比例和采样中心与整块缩放相同，每次只有一个条带展开在内存中
+        margin = int(math.ceil(3.0 * max(scale_y, 1.0))) + 2
+        band_rows = max(1, int(STRIP_BYTES // self.stride / max(scale_y, 1.0)))
+        output = Image.new(self.mode, size)
+        for out_top in range(0, size[1], band_rows):
+            out_bottom = min(size[1], out_top + band_rows)
+            y0 = box[1] + out_top * scale_y
+            y1 = box[1] + out_bottom * scale_y
+            top = max(0, int(math.floor(y0)) - margin)
+            bottom = min(self.height, int(math.ceil(y1)) + margin)
+            region = self.rows(top, bottom)
+            output.paste(region.resize((size[0], out_bottom - out_top), resample,
+                                       box=(box[0], y0 - top, box[2], min(y1 - top, bottom - top))), (0, out_top))
+            del region
+            self.release(top, bottom)
+        return output
+
+    def close(self):
+        self.map.close()
+
+
+def source_of(image):
+    """返回映射视图对应的 MappedSource，普通图像返回None"""
+    return getattr(image, "mapped_source", None)
+
+
+def _read_npy_header(path):
+    """解析NPY文件头，返回 (mode, size, offset)，不支持的数组返回None"""
+    import ast
+
+    with open(path, "rb") as f:
+        magic = f.read(8)
+        if magic[:6] != b"\x93NUMPY":
+            return None
+        if magic[6] == 1:
+            header_len = struct.unpack("<H", f.read(2))[0]
+        else:
+            header_len = struct.unpack("<I", f.read(4))[0]
+        header = ast.literal_eval(f.read(header_len).decode("latin1"))
+        offset = f.tell()
+    shape = tuple(header["shape"])
+    bands = 1 if len(shape) == 2 else shape[2] if len(shape) == 3 else 0
+    if header["descr"] not in ("|u1", "<u1", ">u1") or header["fortran_order"] or bands not in NPY_MODES:
+        return None
+    return NPY_MODES[bands], (shape[1], shape[0]), offset
+
+
+def _read_raw_layout(path):
+    """通过Pillow读取文件头，判断像素是否按行连续、未压缩地存放
+
+    Returns:
+        (mode, size, offset)，不能映射时返回None
+    """
+    try:
+        with Image.open(path) as image:
+            mode, size, tiles = image.mode, image.size, image.tile
+    except Exception:
+        return None
+    if mode not in MAPPED_MODES or not tiles:
+        return None
+
+    stride = size[0] * MAPPED_MODES[mode]
+    offset = tiles[0].offset
+    for tile in tiles:
+        args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+        rawmode = args[0]
+        tile_stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        left, top, right, _ = tile.extents
+        # 只接受整行宽、自上而下、与图像模式相同且首尾相接的条带
+        if (tile.codec_name != "raw" or rawmode != mode or tile_stride not in (0, stride)
+                or orientation != 1 or (left, right) != (0, size[0])
+                or tile.offset != offset + top * stride):
+            return None
+    return mode, size, offset
+
+
+def open_mapped(path, mode=None, size=None, offset=0):
+    """以内存映射方式打开未压缩的图像文件
+
+    Args:
+        path: 文件路径
+        mode, size, offset: 裸像素文件（没有文件头）需要给出模式、尺寸和数据起始位置
+
+    Returns:
+        MappedSource，文件格式不支持映射时返回None
+    """
+    if mode and size:
+        layout = (mode, tuple(size), offset)
+    elif path.lower().endswith(".npy"):
+        layout = _read_npy_header(path)
+    else:
+        layout = _read_raw_layout(path)
+    if layout is None:
+        return None
+    return MappedSource(path, *layout)
+
+
+def should_map(path):
+    """文件足够大且能够映射时返回True"""
+    try:
+        return os.path.getsize(path) >= MAP_MIN_BYTES
+    except (OSError, TypeError):
+        # 文件对象（例如归档中的成员）不能映射
+        return False
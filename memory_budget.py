@@ -0,0 +1,191 @@
+"""内存预算：执行前估算操作的峰值内存，限制同时处理中的像素总量
+
+    with Image.open(path) as image:
+        factor = proxy_factor(image, DEFAULT_GOVERNOR.budget, edits, max_scale)
+        with DEFAULT_GOVERNOR.reserve(estimate_peak(image.mode, proxy_size(image.size, factor), edits)):
+            factor = load_proxy(image, factor)
+            ...
+
+估算只需要文件头中的尺寸和模式，不解码像素。多个任务的预留额度合计超出预算时，
+后来的任务等待前面的任务结束；单个任务本身就超出预算时不直接解码整图，
+JPEG 用 draft 以 1/2~1/8 的尺寸解码出代理图像（输出本来就要缩小时画质不受影响），
+其他格式改为分块调整色彩并独占预算执行，而不是让进程因内存不足失败或频繁换页。
+"""
+import math
+import os
+import threading
+from contextlib import contextmanager
+
+from pipeline import WORKING_MODES, inscribed_box, is_identity, rotated_size
+
+# Pillow内部每像素占用的字节数，未列出的多通道模式按每像素4字节存储
+PIXEL_BYTES = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2, "I": 4, "F": 4}
+DEFAULT_PIXEL_BYTES = 4
+
+# 默认预算占物理内存的比例
+BUDGET_FRACTION = 0.5
+
+# 无法取得物理内存大小时的默认预算
+FALLBACK_BUDGET = 2 * 1024 * 1024 * 1024
+
+# JPEG 的 draft 支持的缩小倍数
+DRAFT_FACTORS = (2, 4, 8)
+
+
+def physical_memory():
+    """返回物理内存字节数，无法取得时返回None"""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_budget():
+    """默认的内存预算：物理内存的一半"""
+    total = physical_memory()
+    return int(total * BUDGET_FRACTION) if total else FALLBACK_BUDGET
+
+
+def image_bytes(mode, size):
+    """指定模式和尺寸的图像在Pillow中占用的字节数"""
+    return PIXEL_BYTES.get(mode, DEFAULT_PIXEL_BYTES) * size[0] * size[1]
+
+
+def geometry_size(size, rotation=0, auto_crop=False):
+    """旋转（expand=True，auto_crop 时裁去四角）后的图像尺寸"""
+    rotation %= 360
+    if rotation in (90, 270):
+        return size[1], size[0]
+    if rotation in (0, 180):
+        return tuple(size)
+    if auto_crop:
+        left, top, right, bottom = inscribed_box(size, rotation)
+        return right - left, bottom - top
+    return rotated_size(size, rotation)
+
+
+def estimate_peak(mode, size, edits=None, tiled=False):
+    """估算解码并执行编辑时同时存在的像素字节数的峰值
+
+    解码结果与工作模式的转换结果同时存在；旋转生成一张新图，
+    色彩调整每一步都要生成退化图和结果图，分块处理时只多出结果图。
+
+    Args:
+        mode, size: 源图像的模式和尺寸（来自文件头）
+        edits: 编辑参数，与 pipeline.apply_edits 相同
+        tiled: 色彩调整是否分块进行
+    """
+    edits = edits or {}
+    working_mode = "RGBA" if "A" in mode or mode in ("P", "PA") else "RGB"
+    source = image_bytes(mode, size)
+    working = image_bytes(working_mode, geometry_size(size, edits.get("rotation", 0)))
+    peak = source + (working if mode not in WORKING_MODES else 0)
+    if edits.get("rotation", 0) % 360 or edits.get("flip_h") or edits.get("flip_v"):
+        peak += working
+    colors = {k: edits[k] for k in ("brightness", "contrast", "saturation") if k in edits}
+    if not is_identity(**colors):
+        peak += working if tiled else 2 * working
+    elif edits.get("levels") or edits.get("auto_levels"):
+        # 只有色阶时 point() 生成一张结果图
+        peak += working
+    return peak
+
+
+class MemoryGovernor:
+    """进程内的内存预算
+
+    每个操作按估算的峰值预留额度，已预留的总量加上新操作超出预算时等待；
+    超出整个预算的单个操作只在没有其他操作时执行。
+    """
+
+    def __init__(self, budget=None):
+        self.budget = int(budget or default_budget())
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def fits(self, nbytes):
+        """单个操作的峰值是否在预算之内"""
+        return nbytes <= self.budget
+
+    def acquire(self, nbytes):
+        """预留 nbytes 字节，额度不足时阻塞，返回实际预留的字节数"""
+        nbytes = min(int(nbytes), self.budget)
+        with self.condition:
+            while self.in_use and self.in_use + nbytes > self.budget:
+                self.condition.wait()
+            self.in_use += nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.in_use -= nbytes
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """在 with 块执行期间预留 nbytes 字节"""
+        reserved = self.acquire(nbytes)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+
+# 进程内共用的内存预算，批量导出和界面加载图片时使用
+DEFAULT_GOVERNOR = MemoryGovernor()
+
+
+def set_default_budget(budget):
+    """设置进程内共用的内存预算（字节），也用作工作进程的初始化函数"""
+    if budget:
+        DEFAULT_GOVERNOR.budget = int(budget)
+
+
+def proxy_size(size, factor):
+    """按 factor 缩小后的代理尺寸"""
+    return math.ceil(size[0] / factor), math.ceil(size[1] / factor)
+
+
+def proxy_factor(image, budget, edits=None, max_scale=1.0, tiled=True):
+    """为超出预算的图像选择 draft 缩小倍数
+
+    只有JPEG支持在解码时缩小。倍数不超过 1/max_scale，保证代理图像的分辨率不低于输出需要的分辨率；
+    在此范围内取能放进预算的最小倍数，都放不进时取允许的最大倍数。
+
+    Returns:
+        1 表示按原尺寸解码
+    """
+    if image.format != "JPEG" or estimate_peak(image.mode, image.size, edits, tiled) <= budget:
+        return 1
+    allowed = [f for f in DRAFT_FACTORS if f * max_scale <= 1.0]
+    for factor in allowed:
+        if estimate_peak(image.mode, proxy_size(image.size, factor), edits, tiled) <= budget:
+            return factor
+    return allowed[-1] if allowed else 1
+
+
+def reduce_factor(mode, size, budget, edits=None, tiled=True):
+    """为超出预算的内存映射图像选择按条带 reduce 的倍数（见 mapped_image.MappedSource.reduce）
+
+    与 draft 不同，reduce 可以按任意倍数缩小；取能放进预算的最小的2的幂，缩到1像素为止。
+
+    Returns:
+        1 表示整幅图像放得进预算
+    """
+    factor = 1
+    while estimate_peak(mode, proxy_size(size, factor), edits, tiled) > budget and min(size) >= factor * 2:
+        factor *= 2
+    return factor
+
+
+def load_proxy(image, factor):
+    """解码已打开的图像，factor 大于1时用 draft 以约 1/factor 的尺寸解码
+
+    Returns:
+        源图像尺寸与解码尺寸之比（draft 只能按 1/2、1/4、1/8 缩放，以实际解码结果为准）
+    """
+    full_width = image.width
+    if factor > 1:
+        image.draft(image.mode, proxy_size(image.size, factor))
+    image.load()
+    return full_width / image.width
@@ -0,0 +1,177 @@
+"""像素不变时跳过重新编码
+
+- 没有任何编辑、输出格式与源文件相同时，直接复制源文件的字节；
+- JPEG 只做了90度整数倍的旋转或翻转时，只改写EXIF方向标记，像素数据原样保留，不损失画质。
+
+编辑作用在文件中存储的像素上（与界面预览一致），因此输出的方向标记就是编辑本身对应的方向。
+"""
+import shutil
+import struct
+
+from PIL import Image, ImageChops
+
+from background_io import atomic_open, open_source
+from pipeline import is_identity, transform_geometry
+
+# EXIF方向标记
+ORIENTATION_TAG = 0x0112
+
+# 方向标记对应的显示变换（与 ImageOps.exif_transpose 相同）
+ORIENTATION_TRANSPOSE = {
+    1: None,
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# JPEG中没有长度字段的标记
+JPEG_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+
+def geometry_orientation(rotation=0, flip_h=False, flip_v=False):
+    """返回与旋转/翻转组合等价的EXIF方向值，不是90度整数倍时返回None"""
+    if rotation % 90:
+        return None
+    # 用一张各像素不同的小图找出等价的转置
+    probe = Image.frombytes("L", (3, 2), bytes(range(6)))
+    target = transform_geometry(probe, rotation, flip_h, flip_v).tobytes()
+    for orientation, method in ORIENTATION_TRANSPOSE.items():
+        result = probe if method is None else probe.transpose(method)
+        if result.tobytes() == target:
+            return orientation
+    return None
+
+
+class PassthroughPlan:
+    """源文件信息及能否跳过重新编码的判断
+
+    Attributes:
+        format: 源文件格式
+        size: 应用旋转/翻转后的尺寸
+        orientation: 输出应写入的方向值；None 表示需要重新编码
+        copy: True 表示可以直接复制源文件字节
+    """
+
+    def __init__(self, path, edits):
+        self.path = path
+        geometry = {k: edits.get(k, d) for k, d in (("rotation", 0), ("flip_h", False), ("flip_v", False))}
+        with Image.open(path) as image:
+            self.format = image.format
+            source_size = image.size
+            source_orientation = image.getexif().get(ORIENTATION_TAG, 1)
+
+        others = {k: v for k, v in edits.items() if k not in geometry and k != "size"}
+        orientation = geometry_orientation(**geometry) if is_identity(**others) else None
+        self.size = (source_size[1], source_size[0]) if orientation in (5, 6, 7, 8) else source_size
+        if edits.get("size") and tuple(edits["size"]) != self.size:
+            orientation = None
+        self.copy = orientation == 1 and source_orientation == 1
+        if not self.copy and self.format != "JPEG":
+            # 只有JPEG实现了方向标记改写
+            orientation = None
+        self.orientation = orientation
+
+    def applies(self, format_code, size=None):
+        """输出为 format_code、尺寸为 size 时能否跳过重新编码"""
+        return (self.orientation is not None and format_code == self.format
+                and (size is None or tuple(size) == self.size))
+
+    def write(self, output_path):
+        """复制源文件或改写方向标记，原子地写入 output_path"""
+        with atomic_open(output_path) as fp:
+            self.write_to(fp)
+        return output_path
+
+    def write_to(self, fp):
+        """把复制或改写方向标记后的字节写入已打开的文件对象 fp（例如输出归档的成员缓冲区）"""
+        if self.copy:
+            with open_source(self.path) as src:
+                shutil.copyfileobj(src, fp, 1024 * 1024)
+        else:
+            fp.writelines(jpeg_orientation_chunks(self.path, self.orientation))
+
+
+def matches_geometry(image, original, rotation=0, flip_h=False, flip_v=False):
+    """判断 image 是否恰好是 original 经过旋转/翻转后的结果（没有裁剪、缩放或调色）"""
+    expected = transform_geometry(original, rotation, flip_h, flip_v)
+    if expected.size != image.size or expected.mode != image.mode:
+        return False
+    return ImageChops.difference(expected, image).getbbox() is None
+
+
+def _patch_orientation(segment, orientation):
+    """在原有EXIF段中就地改写方向值，其他数据不动；没有方向标记时返回None"""
+    tiff = segment[10:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+    count = struct.unpack(endian + "H", tiff[ifd:ifd + 2])[0]
+    for i in range(count):
+        entry = ifd + 2 + i * 12
+        tag, value_type = struct.unpack(endian + "HH", tiff[entry:entry + 4])
+        if tag == ORIENTATION_TAG and value_type == 3:
+            patched = bytearray(segment)
+            struct.pack_into(endian + "H", patched, 10 + entry + 8, orientation)
+            return bytes(patched)
+    return None
+
+
+def _exif_segment(exif):
+    payload = exif.tobytes()
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError("EXIF数据过大")
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def jpeg_orientation_chunks(source, orientation):
+    """只改写EXIF方向标记后的JPEG文件内容（按段分块），压缩数据原样保留"""
+    with Image.open(source) as image:
+        exif = image.getexif()
+    exif[ORIENTATION_TAG] = orientation
+
+    with open_source(source) as f:
+        data = f.read()
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("不是有效的JPEG文件")
+
+    # 逐段扫描到图像数据开始处，替换已有的EXIF段，没有时插入到APP0之后
+    segments = []
+    insert_at = 0
+    replaced = False
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("JPEG段结构无效")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            segments.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        if marker == 0xDA:
+            break
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        if marker == 0xE1 and segment[4:10] == b"Exif\x00\x00" and not replaced:
+            segment = _patch_orientation(segment, orientation) or _exif_segment(exif)
+            replaced = True
+        segments.append(segment)
+        if marker == 0xE0 and insert_at == len(segments) - 1:
+            insert_at = len(segments)
+        pos += 2 + length
+    if not replaced:
+        segments.insert(insert_at, _exif_segment(exif))
+
+    return [b"\xff\xd8"] + segments + [memoryview(data)[pos:]]
+
+
+def write_jpeg_orientation(source, path, orientation):
+    """复制JPEG文件并只改写EXIF方向标记，原子地写入 path"""
+    with atomic_open(path) as fp:
+        fp.writelines(jpeg_orientation_chunks(source, orientation))
+    return path
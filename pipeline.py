@@ -0,0 +1,334 @@
+"""图像处理核心：不依赖界面的旋转、翻转、色彩调整、裁剪和缩放操作"""
+import math
+
+from PIL import Image, ImageEnhance
+
+from auto_levels import apply_levels, is_identity_levels, resolve_levels
+from quantize import PALETTE_FORMATS, quantize_image
+
+# 90度整数倍的旋转对应的无损转置（Image.rotate 的正角度为逆时针）
+RIGHT_ANGLE_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# 处理时使用的规范模式：不透明图像为RGB，带透明度的图像为RGBA
+WORKING_MODES = ("RGB", "RGBA")
+
+# 灰度源图像的模式，保存时还原为灰度
+GRAYSCALE_MODES = ("1", "L", "LA", "I", "I;16", "I;16L", "I;16B", "I;16N", "F")
+
+# 调色板模式的源图像，保存为支持调色板的格式时还原为调色板模式
+PALETTE_SOURCE_MODES = ("P", "PA")
+
+# 高位深灰度模式，直接 convert 会把超过255的值截断，需要先按取值范围缩放到8位
+HIGH_DEPTH_MODES = ("I", "I;16", "I;16L", "I;16B", "I;16N", "F")
+
+# 各输出格式不能直接保存的模式及保存前要转换成的模式
+FORMAT_FALLBACK_MODES = {
+    "JPEG": {"RGBA": "RGB", "LA": "L"},
+    "BMP": {"LA": "RGBA"},
+}
+
+# 裁剪预设及其宽高比
+CROP_PRESETS = {
+    "自定义": None,  # 不做特殊处理
+    "正方形 (1:1)": (1, 1),
+    "Instagram (4:5)": (4, 5),
+    "Facebook (16:9)": (16, 9),
+    "Twitter (2:1)": (2, 1),
+    "LinkedIn (1.91:1)": (1.91, 1),
+    "微信 (4:3)": (4, 3)
+}
+
+
+def ratio_crop_size(width, height, ratio_w, ratio_h):
+    """计算指定宽高比下能放进图像的最大裁剪尺寸"""
+    # 先尝试用原始宽度来计算
+    crop_w = width
+    crop_h = int(crop_w * ratio_h / ratio_w)
+
+    # 如果计算出的高度超出原图，就用原始高度来计算
+    if crop_h > height:
+        crop_h = height
+        crop_w = int(crop_h * ratio_w / ratio_h)
+    return crop_w, crop_h
+
+
+def convert_cached(image, mode, convert=None):
+    """返回图像的 mode 模式表示，同一图像的每种转换只做一次
+
+    转换结果保存在图像对象的 converted_modes 属性中，只用于之后不会被原地修改的图像。
+
+    Args:
+        convert: 自定义的转换函数，默认为 image.convert(mode)
+    """
+    if image.mode == mode and convert is None:
+        return image
+    cache = getattr(image, "converted_modes", None)
+    if cache is None:
+        cache = image.converted_modes = {}
+    if mode not in cache:
+        cache[mode] = convert(image) if convert else image.convert(mode)
+    return cache[mode]
+
+
+def _high_depth_to_rgb(image):
+    """把16位/32位整数或浮点灰度按取值范围缩放到8位后转为RGB"""
+    if image.mode.startswith("I;16"):
+        scale = 1 / 257
+    else:
+        low, high = image.getextrema()
+        if image.mode == "F" and high <= 1.0:
+            scale = 255.0
+        elif high <= 255:
+            scale = 1.0
+        else:
+            scale = 255 / (65535 if high <= 65535 else high)
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    return image.point(lambda v: v * scale).convert("L").convert("RGB")
+
+
+def to_working_mode(image):
+    """解码后把图像统一转换为规范的工作模式 RGB/RGBA
+
+    调色板、灰度、CMYK和16位等模式在旋转、色彩调整和缩放中会反复发生隐式转换，
+    部分模式甚至无法调整色彩，因此只在读取时转换一次（结果缓存在源图像上）；
+    保存时再由 to_output_mode 按输出格式转换回去。
+    """
+    if image.mode in WORKING_MODES:
+        return image
+    if image.mode in HIGH_DEPTH_MODES:
+        working = convert_cached(image, "RGB", _high_depth_to_rgb)
+    elif image.mode in ("P", "PA") and "transparency" in image.info or "A" in image.getbands():
+        working = convert_cached(image, "RGBA")
+    else:
+        working = convert_cached(image, "RGB")
+    working.source_mode = image.mode
+    return working
+
+
+def to_output_mode(image, format_code, source_mode=None):
+    """保存前把工作模式的图像转换为输出格式合适的模式（转换结果缓存在图像上）
+
+    源图像为灰度时还原为 L/LA；JPEG 不支持透明度，去掉alpha通道；
+    彩色图像保存为GIF、调色板源图像保存为PNG/GIF时量化为调色板模式：颜色不超过256种时原样保留，
+    否则先在代理图像上生成调色板再映射（见 quantize.py），不交给Pillow在整图上隐式量化。
+
+    Args:
+        source_mode: 源图像解码后的模式，默认取 to_working_mode 记录的模式
+    """
+    source_mode = source_mode or getattr(image, "source_mode", None)
+    mode = image.mode
+    if source_mode in GRAYSCALE_MODES and mode in WORKING_MODES:
+        mode = "LA" if mode == "RGBA" else "L"
+    mode = FORMAT_FALLBACK_MODES.get(format_code, {}).get(mode, mode)
+    if mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "CMYK"):
+        mode = "RGBA" if "A" in image.getbands() else "RGB"
+    if mode in WORKING_MODES and (format_code == "GIF" or
+                                  source_mode in PALETTE_SOURCE_MODES and format_code in PALETTE_FORMATS):
+        return convert_cached(image, "P", quantize_image)
+    return convert_cached(image, mode)
+
+
+def rotated_size(size, rotation):
+    """Image.rotate(rotation, expand=True) 输出的尺寸，按Pillow相同的方式计算（不生成图像）"""
+    w, h = size
+    angle = -math.radians(rotation % 360.0)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    d, e = round(-math.sin(angle), 15), round(math.cos(angle), 15)
+    cx, cy = w / 2, h / 2
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+    xs = [a * x + b * y + c for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    ys = [d * x + e * y + f for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    return (math.ceil(max(xs)) - math.floor(min(xs)),
+            math.ceil(max(ys)) - math.floor(min(ys)))
+
+
+def inscribed_box(size, rotation):
+    """旋转后（expand=True）的图像中，不含填充角的最大矩形
+
+    Args:
+        size: 旋转前的尺寸
+        rotation: 旋转角度（度）
+
+    Returns:
+        (left, top, right, bottom)，以旋转后的图像坐标表示，位于图像中心
+    """
+    w, h = size
+    out_w, out_h = rotated_size(size, rotation)
+    radians = math.radians(rotation % 180)
+    sin_a, cos_a = abs(math.sin(radians)), abs(math.cos(radians))
+    if sin_a < 1e-12 or cos_a < 1e-12:
+        return 0, 0, out_w, out_h
+    long_side, short_side = max(w, h), min(w, h)
+    if short_side <= 2 * sin_a * cos_a * long_side or abs(sin_a - cos_a) < 1e-12:
+        # 矩形的两个角碰到旋转后图像的长边
+        half = short_side / 2
+        inner_w, inner_h = (half / sin_a, half / cos_a) if w >= h else (half / cos_a, half / sin_a)
+    else:
+        cos_2a = cos_a * cos_a - sin_a * sin_a
+        inner_w = (w * cos_a - h * sin_a) / cos_2a
+        inner_h = (h * cos_a - w * sin_a) / cos_2a
+    left = int(math.ceil((out_w - inner_w) / 2))
+    top = int(math.ceil((out_h - inner_h) / 2))
+    right = max(left + 1, int(math.floor((out_w + inner_w) / 2)))
+    bottom = max(top + 1, int(math.floor((out_h + inner_h) / 2)))
+    return left, top, right, bottom
+
+
+def transform_box(box, size, rotation=0, flip_h=False, flip_v=False, auto_crop=False):
+    """把以源图像坐标表示的矩形映射到 transform_geometry 之后的图像坐标
+
+    非90度整数倍的旋转得到的是旋转后矩形的外接矩形。
+
+    Args:
+        box: (left, top, right, bottom)，源图像坐标
+        size: 源图像尺寸
+
+    Returns:
+        (left, top, right, bottom)，变换后的图像坐标，限制在图像范围内
+    """
+    w, h = size
+    rotation %= 360
+    out_w, out_h = (w, h) if rotation == 0 else rotated_size(size, rotation)
+    radians = math.radians(rotation)
+    cos_a, sin_a = math.cos(radians), math.sin(radians)
+    xs, ys = [], []
+    for x, y in ((box[0], box[1]), (box[2], box[1]), (box[2], box[3]), (box[0], box[3])):
+        # 绕中心逆时针旋转（y轴向下），再移到扩展后的画布上
+        dx, dy = x - w / 2, y - h / 2
+        xs.append(dx * cos_a + dy * sin_a + out_w / 2)
+        ys.append(-dx * sin_a + dy * cos_a + out_h / 2)
+    left, top, right, bottom = min(xs), min(ys), max(xs), max(ys)
+    if auto_crop and rotation not in RIGHT_ANGLE_TRANSPOSE and rotation:
+        crop_left, crop_top, crop_right, crop_bottom = inscribed_box(size, rotation)
+        left, top, right, bottom = left - crop_left, top - crop_top, right - crop_left, bottom - crop_top
+        out_w, out_h = crop_right - crop_left, crop_bottom - crop_top
+    if flip_h:
+        left, right = out_w - right, out_w - left
+    if flip_v:
+        top, bottom = out_h - bottom, out_h - top
+    left, top = max(0, round(left)), max(0, round(top))
+    return left, top, max(left + 1, min(out_w, round(right))), max(top + 1, min(out_h, round(bottom)))
+
+
+def transform_geometry(image, rotation=0, flip_h=False, flip_v=False, auto_crop=False):
+    """对图像应用旋转和翻转
+
+    90度整数倍的旋转和翻转用 transpose 精确完成，其他角度才需要插值。
+
+    Args:
+        image: PIL图像对象
+        rotation: 旋转角度（度），可以是任意角度
+        flip_h: 是否水平翻转
+        flip_v: 是否垂直翻转
+        auto_crop: 任意角度旋转后裁去四角的填充，只保留最大的内接矩形
+    """
+    rotation %= 360
+    if rotation in RIGHT_ANGLE_TRANSPOSE:
+        image = image.transpose(RIGHT_ANGLE_TRANSPOSE[rotation])
+    elif rotation:
+        size = image.size
+        image = image.rotate(rotation, expand=True, resample=Image.BICUBIC)
+        if auto_crop:
+            image = image.crop(inscribed_box(size, rotation))
+    if flip_h:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if flip_v:
+        image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+    return image
+
+
+def adjust_colors(image, brightness=1.0, contrast=1.0, saturation=1.0, levels=None):
+    """对图像应用色阶查找表（见 auto_levels）以及亮度、对比度和饱和度调整"""
+    image = apply_levels(image, levels)
+    if brightness != 1.0:
+        image = ImageEnhance.Brightness(image).enhance(brightness)
+    if contrast != 1.0:
+        image = ImageEnhance.Contrast(image).enhance(contrast)
+    if saturation != 1.0:
+        image = ImageEnhance.Color(image).enhance(saturation)
+    return image
+
+
+def is_identity(rotation=0, flip_h=False, flip_v=False,
+                brightness=1.0, contrast=1.0, saturation=1.0,
+                crop_box=None, size=None, levels=None, auto_levels=None, auto_crop=False):
+    """判断编辑参数是否不会改变图像（auto_crop 只在任意角度旋转时起作用）"""
+    return (not rotation % 360 and not flip_h and not flip_v and not crop_box and not size
+            and (brightness, contrast, saturation) == (1.0, 1.0, 1.0)
+            and is_identity_levels(levels) and not auto_levels)
+
+
+def apply_edits(image, rotation=0, flip_h=False, flip_v=False,
+                brightness=1.0, contrast=1.0, saturation=1.0,
+                crop_box=None, size=None, levels=None, auto_levels=None, auto_crop=False):
+    """按界面相同的顺序执行完整的编辑流程：旋转/翻转 -> 色阶 -> 色彩调整 -> 裁剪 -> 缩放
+
+    Args:
+        image: PIL图像对象
+        crop_box: (left, top, right, bottom)，以变换后的图像坐标表示，None表示不裁剪
+        size: 最终输出尺寸 (width, height)，None表示保持不变
+        levels: 768项的色阶查找表
+        auto_levels: 没有给出 levels 时按该方法分析本图像得到查找表（见 auto_levels.AUTO_METHODS）
+        auto_crop: 任意角度旋转后只保留最大的内接矩形
+
+    Returns:
+        处理后的新图像
+    """
+    levels = resolve_levels(image, levels, auto_levels)
+    image = transform_geometry(image, rotation, flip_h, flip_v, auto_crop)
+    image = adjust_colors(image, brightness, contrast, saturation, levels)
+    if crop_box:
+        image = image.crop(tuple(int(round(v)) for v in crop_box))
+    if size and image.size != tuple(size):
+        image = image.resize(tuple(size), Image.LANCZOS)
+    return image
+
+
+def clip_box(box, width, height):
+    """把裁剪框排序并限制在图像范围内
+
+    Returns:
+        (left, top, right, bottom)，与图像没有有效交集时返回None
+    """
+    x1, x2 = sorted((box[0], box[2]))
+    y1, y2 = sorted((box[1], box[3]))
+    if x1 >= width or y1 >= height or x2 <= 0 or y2 <= 0:
+        return None
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def scale_and_crop(image, mode="scale", zoom_scale=1.0, crop_box=None, size=None):
+    """按界面"预览更改"的规则缩放和裁剪
+
+    Args:
+        image: PIL图像对象
+        mode: "scale" 只缩放，"crop" 只裁剪，"both" 先按 zoom_scale 缩放再裁剪
+        zoom_scale: 缩放比例
+        crop_box: 裁剪框（缩放后的图像坐标），超出部分会被截掉
+        size: 最终输出尺寸，None表示不再调整
+
+    Raises:
+        ValueError: "crop" 模式下裁剪框与图像没有交集
+    """
+    if mode in ("scale", "both") and zoom_scale != 1.0:
+        scaled = (int(image.width * zoom_scale), int(image.height * zoom_scale))
+        image = image.resize(scaled, Image.LANCZOS)
+    if mode in ("crop", "both") and crop_box:
+        box = clip_box(crop_box, image.width, image.height)
+        if box:
+            image = image.crop(box)
+        elif mode == "crop":
+            raise ValueError("裁剪框未与图片重叠")
+    if size and image.size != tuple(size):
+        image = image.resize(tuple(size), Image.LANCZOS)
+    return image
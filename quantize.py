@@ -0,0 +1,135 @@
+"""GIF 和 PNG-8 输出的调色板量化
+
+保存时让 Pillow 隐式转换为调色板模式，会在全分辨率图像上做中位切分，大图很慢，
+而且每张图片、每一帧得到的调色板都不同。这里分成两步显式完成：
+
+1. build_palette：在缩小的代理图像上用中位切分或八叉树生成调色板。代理图像最多几万像素，
+   耗时与原图大小无关；多张图片（或动画的多帧）的代理拼接在一起，得到共用的调色板；
+2. apply_palette：按调色板把全分辨率图像映射为P模式，可选 Floyd-Steinberg 抖动。
+   不抖动时每个像素只是一次查表（Pillow 按颜色缓存最近的调色板项）。
+
+调色板可以只计算一次，再用于一批图片或动画的全部帧，颜色在各输出之间保持一致。
+调色板可以表示为768项以内的整数列表（见 palette_values），能写入配方并传给工作进程。
+含透明度的图像中，透明度低于一半的像素映射到保留的透明索引 PALETTE_TRANSPARENT_INDEX。
+"""
+from PIL import Image
+
+# 量化方法
+QUANTIZE_METHODS = {
+    "mediancut": Image.Quantize.MEDIANCUT,
+    "octree": Image.Quantize.FASTOCTREE,
+}
+
+DEFAULT_QUANTIZE_METHOD = "mediancut"
+
+# 每张图片的代理图像最多的像素数
+QUANTIZE_PROXY_PIXELS = 65536
+
+# 透明像素使用的调色板索引，需要透明时调色板只使用前255种颜色
+PALETTE_TRANSPARENT_INDEX = 255
+
+# 可以保存为调色板模式的格式
+PALETTE_FORMATS = ("GIF", "PNG")
+
+# 输出项中与量化有关的字段
+QUANTIZE_KEYS = ("colors", "dither", "quantize", "palette")
+
+
+def sample_proxy(image, max_pixels=QUANTIZE_PROXY_PIXELS):
+    """缩小到不超过 max_pixels 像素的RGB代理图像"""
+    factor = 1
+    while image.width * image.height > max_pixels * factor * factor:
+        factor += 1
+    proxy = image.reduce(factor) if factor > 1 else image
+    return proxy.convert("RGB") if proxy.mode != "RGB" else proxy
+
+
+def has_transparency(image):
+    """图像中有透明度低于一半的像素时返回True"""
+    return "A" in image.getbands() and image.getchannel("A").getextrema()[0] < 128
+
+
+def build_palette(images, colors=256, method=DEFAULT_QUANTIZE_METHOD, transparent=False):
+    """从一张或多张图像的代理图像生成调色板
+
+    Args:
+        images: 图像列表（或可迭代对象），按相同的权重参与量化
+        colors: 调色板颜色数（2~256）
+        method: "mediancut" 或 "octree"
+        transparent: 为透明像素保留索引 PALETTE_TRANSPARENT_INDEX，颜色数最多为255
+
+    Returns:
+        P模式的调色板图像
+    """
+    if method not in QUANTIZE_METHODS:
+        raise ValueError(f"不支持的量化方法: {method}")
+    colors = max(2, min(int(colors), PALETTE_TRANSPARENT_INDEX if transparent else 256))
+    # 各代理图像的像素首尾相接成一行，不同尺寸之间不需要填充
+    data = b"".join(sample_proxy(image).tobytes() for image in images)
+    strip = Image.frombytes("RGB", (len(data) // 3, 1), data).quantize(colors, method=QUANTIZE_METHODS[method])
+    # 未用到的调色板项默认为黑色，映射时可能被选中（包括透明索引），只保留实际用到的颜色
+    used = strip.getextrema()[1] + 1
+    return palette_image(strip.getpalette()[:used * 3])
+
+
+def palette_values(palette):
+    """调色板中的颜色，作为 [r, g, b, ...] 整数列表（可写入JSON）"""
+    values = palette.getpalette()
+    return values[:getattr(palette, "palette_colors", len(values) // 3) * 3]
+
+
+def palette_image(values):
+    """由 [r, g, b, ...] 列表创建调色板图像；未用到的项填充第一种颜色，映射时不会被选中"""
+    values = list(values)
+    count = len(values) // 3
+    image = Image.new("P", (1, 1))
+    image.putpalette(values[:count * 3] + values[:3] * (256 - count))
+    image.palette_colors = count
+    return image
+
+
+def apply_palette(image, palette, dither=False):
+    """按调色板把RGB/RGBA图像映射为P模式，透明像素使用 PALETTE_TRANSPARENT_INDEX
+
+    Args:
+        palette: build_palette 或 palette_image 得到的调色板图像；图像含透明像素时最多使用前255种颜色
+        dither: 是否使用 Floyd-Steinberg 抖动
+    """
+    transparent = has_transparency(image)
+    values = palette_values(palette)
+    if transparent and len(values) > PALETTE_TRANSPARENT_INDEX * 3:
+        # 调色板有256种颜色时透明索引本身也是一种颜色，去掉最后一种，否则映射到它的不透明像素会变成透明
+        palette = palette_image(values[:PALETTE_TRANSPARENT_INDEX * 3])
+    rgb = image.convert("RGB") if image.mode != "RGB" else image
+    indexed = rgb.quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    if transparent:
+        mask = image.getchannel("A").point([255] * 128 + [0] * 128)
+        indexed.paste(PALETTE_TRANSPARENT_INDEX, mask=mask)
+        indexed.info["transparency"] = PALETTE_TRANSPARENT_INDEX
+    return indexed
+
+
+def quantize_image(image, colors=256, dither=False, quantize=DEFAULT_QUANTIZE_METHOD, palette=None):
+    """量化单张图像：没有给出调色板时从它自己的代理图像生成
+
+    参数名与输出项中的字段相同（见 QUANTIZE_KEYS），palette 为 palette_values 得到的列表或调色板图像。
+    """
+    if palette is None:
+        transparent = has_transparency(image)
+        # 颜色本来就不超过调色板容量时（例如调色板模式的源图像）直接使用这些颜色，不做近似
+        limit = min(int(colors), PALETTE_TRANSPARENT_INDEX if transparent else 256)
+        exact = (image.convert("RGB") if image.mode != "RGB" else image).getcolors(limit)
+        if exact:
+            palette = palette_image([v for _, color in exact for v in color])
+        else:
+            palette = build_palette([image], colors, quantize, transparent)
+    elif not isinstance(palette, Image.Image):
+        palette = palette_image(palette)
+    return apply_palette(image, palette, dither)
+
+
+def quantize_options(spec):
+    """从输出项中取出量化参数，没有任何量化字段时返回None"""
+    if not any(key in spec for key in QUANTIZE_KEYS):
+        return None
+    return {key: spec[key] for key in QUANTIZE_KEYS if key in spec}
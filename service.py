@@ -0,0 +1,398 @@
+"""本地图片处理服务：常驻进程接收缩放、裁剪、旋转/翻转、调色和图标任务
+
+构建流水线不必为每个素材重新启动Python和Pillow，只需向本服务发送请求：
+
+    curl --data-binary @in.jpg "http://127.0.0.1:8765/process?width=512&format=PNG" -o out.png
+    curl -X POST "http://127.0.0.1:8765/process?path=/abs/in.png&format=ICO" -o app.ico
+
+查询参数：
+    path                 服务器本地的源文件路径（不提供时以请求体作为图片数据）
+    rotation             旋转角度，可以是任意角度
+    flip_h, flip_v       1/true 表示翻转
+    auto_crop            1/true 时裁去任意角度旋转后的空白角
+    brightness, contrast, saturation
+    auto                 自动调整 levels/contrast/white_balance（自动色阶/对比度/白平衡）
+    crop                 left,top,right,bottom
+    preset / ratio       裁剪预设名或 w,h 宽高比；smart_crop=1 时自动定位
+    width, height        输出尺寸，只给一边时按比例计算
+    format               PNG/JPEG/GIF/BMP/TIFF/WEBP/AVIF/ICO/ICNS，默认PNG
+    profile              编码档位 fastest/balanced/smallest，默认balanced
+    max_bytes            输出大小上限（字节），自动搜索质量；allow_resize=1 时必要时缩小尺寸
+    colors, quantize, dither
+                         GIF或PNG-8（PNG给出colors时）的颜色数、量化方法 mediancut/octree 和是否抖动
+    watermark_text / watermark_image
+                         文字水印或服务器本地的水印图片路径，watermark_position/opacity/scale/tile
+                         对应配方中 "watermark" 的同名参数（见 watermark.py）
+
+工作线程数固定，排队的任务数有上限，队列满时立即返回503，调用方稍后重试即可。
+各任务按文件头估算的峰值内存预留额度（--memory-budget），合计超出预算时排队等待，
+单个超出预算的JPEG按输出尺寸缩小解码。
+"""
+import io
+import json
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from batch import PyramidCache, decode_source, prepare_for_format, render_output, resolve_output, scale_crop
+from encoders import DEFAULT_PROFILE, PROFILES, encoder_params, fit_to_size, save_encoded
+from icon_converter import IconConverter
+from memory_budget import MemoryGovernor
+from auto_levels import AUTO_METHODS
+from watermark import WATERMARK_POSITIONS, apply_watermark
+from quantize import QUANTIZE_METHODS
+
+# 响应分块大小
+CHUNK_SIZE = 64 * 1024
+
+# 请求体大小上限
+MAX_BODY_SIZE = 512 * 1024 * 1024
+
+# 出错时丢弃请求体以保持连接可用的大小上限，更大的请求直接断开连接
+DISCARD_LIMIT = 16 * 1024 * 1024
+
+# 编码结果超过该大小时从内存转存到临时文件
+SPOOL_SIZE = 8 * 1024 * 1024
+
+CONTENT_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+    "WEBP": "image/webp",
+    "AVIF": "image/avif",
+    "ICO": "image/x-icon",
+    "ICNS": "image/icns",
+}
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+class ServiceError(Exception):
+    """带HTTP状态码的请求错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_job(query):
+    """把查询参数解析为 (源路径, 编辑参数, 输出规格, 输出格式)"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    try:
+        edits = {}
+        for key in ("rotation", "brightness", "contrast", "saturation"):
+            if key in params:
+                edits[key] = float(params[key])
+        for key in ("flip_h", "flip_v", "auto_crop"):
+            if key in params:
+                edits[key] = params[key].lower() in TRUE_VALUES
+        if "auto" in params:
+            if params["auto"] not in AUTO_METHODS:
+                raise ValueError(f"不支持的自动调整方法 {params['auto']}")
+            edits["auto_levels"] = params["auto"]
+
+        spec = {}
+        if "crop" in params:
+            crop = [int(float(v)) for v in params["crop"].split(",")]
+            # 是否超出图像范围要解码后才知道（超出时返回422），这里先拒绝面积不为正的区域
+            if len(crop) != 4 or min(crop[:2]) < 0 or crop[2] <= crop[0] or crop[3] <= crop[1]:
+                raise ValueError(f"crop 应为面积为正的 left,top,right,bottom: {params['crop']}")
+            spec["crop"] = crop
+        if "ratio" in params:
+            spec["ratio"] = [float(v) for v in params["ratio"].split(",")]
+        if "preset" in params:
+            spec["preset"] = params["preset"]
+        if "smart_crop" in params:
+            spec["smart_crop"] = params["smart_crop"].lower() in TRUE_VALUES
+        for key in ("width", "height", "max_bytes", "colors"):
+            if key in params:
+                spec[key] = int(params[key])
+        if "allow_resize" in params:
+            spec["allow_resize"] = params["allow_resize"].lower() in TRUE_VALUES
+        if "quantize" in params:
+            if params["quantize"] not in QUANTIZE_METHODS:
+                raise ValueError(f"不支持的量化方法 {params['quantize']}")
+            spec["quantize"] = params["quantize"]
+        if "dither" in params:
+            spec["dither"] = params["dither"].lower() in TRUE_VALUES
+        watermark = {}
+        for key in ("text", "image", "position"):
+            if f"watermark_{key}" in params:
+                watermark[key] = params[f"watermark_{key}"]
+        for key in ("opacity", "scale"):
+            if f"watermark_{key}" in params:
+                watermark[key] = float(params[f"watermark_{key}"])
+        if "watermark_tile" in params:
+            watermark["tile"] = params["watermark_tile"].lower() in TRUE_VALUES
+        if watermark:
+            if "position" in watermark and watermark["position"] not in WATERMARK_POSITIONS:
+                raise ValueError(f"未知的水印位置 {watermark['position']}")
+            spec["watermark"] = watermark
+    except ValueError as e:
+        raise ServiceError(400, f"参数格式错误: {e}")
+
+    format_code = params.get("format", "PNG").upper()
+    if format_code not in CONTENT_TYPES:
+        raise ServiceError(400, f"不支持的格式: {format_code}")
+    spec["profile"] = params.get("profile", DEFAULT_PROFILE)
+    if spec["profile"] not in PROFILES:
+        raise ServiceError(400, f"未知的编码档位: {spec['profile']}")
+    return params.get("path"), edits, spec, format_code
+
+
+def run_job(source, edits, spec, format_code, output, governor):
+    """执行一个处理任务，把编码结果写入 output 文件对象
+
+    解码和编辑在 governor 的内存预算内进行，超出预算的JPEG按输出尺寸缩小解码。
+    """
+    base, source_mode, factor, reserved = decode_source(source, edits, [spec], governor=governor)
+    try:
+        box, size = resolve_output(scale_crop(spec, "crop", factor), base)
+        result = apply_watermark(render_output(PyramidCache(base), box, size), spec.get("watermark"))
+        _encode_result(result, source_mode, spec, format_code, output)
+    finally:
+        governor.release(reserved)
+
+
+def _encode_result(result, source_mode, spec, format_code, output):
+    """按输出格式编码处理结果"""
+    if format_code == "ICO":
+        IconConverter.create_ico(result, output)
+    elif format_code == "ICNS":
+        # ICNS可能需要调用iconutil，只能先写到临时文件
+        with tempfile.TemporaryDirectory() as temp_dir:
+            icns_path = IconConverter.create_icns(result, os.path.join(temp_dir, "icon.icns"))
+            with open(icns_path, "rb") as f:
+                shutil.copyfileobj(f, output)
+    else:
+        result = prepare_for_format(result, format_code, source_mode, dict(spec, format=format_code))
+        profile = spec.get("profile", DEFAULT_PROFILE)
+        if spec.get("max_bytes"):
+            try:
+                buffer = fit_to_size(result, format_code, spec["max_bytes"], profile, spec.get("allow_resize", False))[0]
+            except ValueError as e:
+                raise ServiceError(422, str(e))
+            output.write(buffer.getbuffer())
+        else:
+            save_encoded(result, output, format_code, **encoder_params(format_code, profile))
+
+
+class ProcessingService:
+    """固定大小的工作线程池加有上限的等待队列"""
+
+    def __init__(self, workers=None, queue_size=16, memory_budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.governor = MemoryGovernor(memory_budget)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self.capacity = self.workers + queue_size
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        """为新任务占用一个名额，队列已满时返回False"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self.slots.release()
+
+    def submit(self, *args):
+        return self.executor.submit(run_job, *args, self.governor)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "memory_budget": self.governor.budget,
+                "memory_reserved": self.governor.in_use,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理：解析参数、排队执行并分块返回结果"""
+
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def address_string(self):
+        # Unix套接字没有客户端地址
+        return self.client_address[0] if self.client_address else "unix"
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def discard_body(self):
+        """拒绝请求时读掉未处理的请求体，过大时改为关闭连接"""
+        length = int(self.headers.get("Content-Length", 0))
+        if length > DISCARD_LIMIT:
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {"error": "未知的路径"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/process":
+            self.send_json(404, {"error": "未知的路径"})
+            return
+
+        try:
+            path, edits, spec, format_code = parse_job(url.query)
+        except ServiceError as e:
+            self.discard_body()
+            self.send_json(e.status, {"error": str(e)})
+            return
+
+        # 先占用名额再读取请求体，队列满时不接收图片数据
+        if not self.service.try_acquire():
+            self.discard_body()
+            self.send_json(503, {"error": "服务繁忙，请稍后重试"}, {"Retry-After": "1"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_BODY_SIZE:
+                self.discard_body()
+                raise ServiceError(413, "图片数据过大")
+            body = self.rfile.read(length) if length else b""
+
+            if path:
+                if not os.path.isfile(path):
+                    raise ServiceError(404, f"文件不存在: {path}")
+                source = path
+            elif body:
+                source = io.BytesIO(body)
+            else:
+                raise ServiceError(400, "请求中没有图片数据或path参数")
+
+            output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            try:
+                self.service.submit(source, edits, spec, format_code, output).result()
+            except ServiceError:
+                output.close()
+                raise
+            except Exception as e:
+                output.close()
+                raise ServiceError(422, f"处理失败: {e}")
+        except ServiceError as e:
+            self.service.release()
+            self.send_json(e.status, {"error": str(e)})
+            return
+
+        # 处理完成即释放名额，返回数据时不再占用工作线程
+        self.service.release()
+        with output:
+            size = output.seek(0, os.SEEK_END)
+            output.seek(0)
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPES[format_code])
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            while True:
+                chunk = output.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"[service] {self.address_string()} {format % args}\n")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听Unix套接字的多线程HTTP服务"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def create_server(service, host="127.0.0.1", port=8765, unix_socket=None):
+    """创建绑定到本地地址或Unix套接字的HTTP服务"""
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    if unix_socket:
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("当前系统不支持Unix套接字")
+        return UnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地图片处理服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认只监听本机）")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--unix", default=None, help="改为监听指定的Unix套接字文件")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作线程数")
+    parser.add_argument("--queue", type=int, default=16, help="排队任务数上限")
+    parser.add_argument("-m", "--memory-budget", type=int, default=None,
+                        help="所有任务合计的内存预算（MB），默认为物理内存的一半")
+    args = parser.parse_args(argv)
+
+    budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    service = ProcessingService(args.workers, args.queue, budget)
+    server = create_server(service, args.host, args.port, args.unix)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    print(f"图片处理服务已启动: {where} (工作线程 {service.workers}, 队列 {args.queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""进程间通过共享内存传递图像像素
+
+主进程把解码后的像素写入共享内存段，只把段名、模式和尺寸发给工作进程；
+工作进程用 Image.frombuffer 直接在共享内存上创建图像视图，不经过pickle序列化。
+L/RGBA 图像的视图直接引用共享内存；Pillow内部按每像素4字节存储RGB，RGB视图会在工作进程中展开复制一次。
+处理结果同样写回主进程提供的共享内存段。共享内存段在任务之间循环复用。
+"""
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+# 各模式每像素的字节数
+MODE_BYTES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4}
+
+# 工作进程中保持映射的共享内存段数量上限
+ATTACH_CACHE_SIZE = 8
+
+
+def image_nbytes(mode, size):
+    """计算指定模式和尺寸的原始像素字节数"""
+    return MODE_BYTES[mode] * size[0] * size[1]
+
+
+class SegmentPool:
+    """主进程中可复用的共享内存段池
+
+    acquire 优先复用容量足够的最小空闲段，空闲段过多时释放最小的段。
+    """
+
+    def __init__(self, max_free=4):
+        self.max_free = max_free
+        self.free = []
+        self.all = {}
+        self.lock = threading.Lock()
+        # 在创建进程池之前启动资源跟踪进程，工作进程会共用它；
+        # 否则先于第一个共享内存段创建的工作进程会各自启动跟踪进程，退出时误报泄漏
+        resource_tracker.ensure_running()
+
+    def acquire(self, nbytes):
+        """取得一个容量不小于 nbytes 的共享内存段"""
+        nbytes = max(1, nbytes)
+        with self.lock:
+            candidates = [s for s in self.free if s.size >= nbytes]
+            if candidates:
+                segment = min(candidates, key=lambda s: s.size)
+                self.free.remove(segment)
+                return segment
+        segment = shared_memory.SharedMemory(create=True, size=nbytes)
+        with self.lock:
+            self.all[segment.name] = segment
+        return segment
+
+    def release(self, segment):
+        """归还共享内存段以便后续任务复用"""
+        with self.lock:
+            self.free.append(segment)
+            while len(self.free) > self.max_free:
+                smallest = min(self.free, key=lambda s: s.size)
+                self.free.remove(smallest)
+                self._destroy(smallest)
+
+    def _destroy(self, segment):
+        self.all.pop(segment.name, None)
+        segment.close()
+        segment.unlink()
+
+    def close(self):
+        """释放池中所有共享内存段"""
+        with self.lock:
+            for segment in list(self.all.values()):
+                self._destroy(segment)
+            self.free = []
+
+
+def put_image(image, segment):
+    """把图像像素写入共享内存段，返回可以发送给其他进程的描述信息"""
+    nbytes = image_nbytes(image.mode, image.size)
+    if nbytes > segment.size:
+        raise ValueError("共享内存段容量不足")
+    segment.buf[:nbytes] = image.tobytes()
+    return {"name": segment.name, "mode": image.mode, "size": image.size}
+
+
+# 工作进程中已映射的共享内存段，按段名缓存，跨任务复用
+_attached = OrderedDict()
+
+
+def attach_segment(name):
+    """在当前进程中映射指定的共享内存段（带缓存）"""
+    segment = _attached.pop(name, None)
+    if segment is None:
+        segment = shared_memory.SharedMemory(name=name)
+    _attached[name] = segment
+    while len(_attached) > ATTACH_CACHE_SIZE:
+        _, oldest = _attached.popitem(last=False)
+        try:
+            oldest.close()
+        except BufferError:
+            # 仍有图像视图引用该段，交给垃圾回收处理
+            pass
+    return segment
+
+
+def view_image(descriptor):
+    """根据描述信息在共享内存上创建图像（L/RGBA为不复制像素的只读视图）"""
+    segment = attach_segment(descriptor["name"])
+    mode = descriptor["mode"]
+    size = tuple(descriptor["size"])
+    return Image.frombuffer(mode, size, segment.buf, "raw", mode, 0, 1)
+
+
+def write_result(image, result_name):
+    """在工作进程中把结果写入主进程提供的共享内存段
+
+    容量不足时新建一个段，由主进程读取后负责释放。
+
+    Returns:
+        结果描述信息，"owned" 为True表示该段需要由主进程删除
+    """
+    segment = attach_segment(result_name)
+    if image_nbytes(image.mode, image.size) <= segment.size:
+        descriptor = put_image(image, segment)
+        descriptor["owned"] = False
+        return descriptor
+
+    segment = shared_memory.SharedMemory(create=True, size=image_nbytes(image.mode, image.size))
+    descriptor = put_image(image, segment)
+    descriptor["owned"] = True
+    segment.close()
+    return descriptor
+
+
+def _detach(image):
+    """共享内存段会被复用，视图需要复制为独立的图像（RGB已经是复制出来的）"""
+    return image.copy() if image.readonly else image
+
+
+def take_result(descriptor):
+    """在主进程中取回工作进程写入的结果图像"""
+    if descriptor.get("owned"):
+        segment = shared_memory.SharedMemory(name=descriptor["name"])
+        try:
+            mode = descriptor["mode"]
+            image = _detach(Image.frombuffer(mode, tuple(descriptor["size"]), segment.buf, "raw", mode, 0, 1))
+        finally:
+            segment.close()
+            segment.unlink()
+        return image
+    return _detach(view_image(descriptor))
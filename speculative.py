@@ -0,0 +1,179 @@
+"""空闲时预先渲染下一步可能的几何编辑
+
+旋转或翻转之后，用户往往马上再点一次旋转或翻转。界面空闲时在后台线程中按预览分辨率
+渲染相邻的几何状态（±90度、水平/垂直翻转），放进容量有限的缓存，下一次点击直接取出显示。
+缩小显示时各状态都由缓存的显示分辨率代理图像转置得到（90度整数倍的转置与缩放可以交换顺序），
+不处理全分辨率的原图。
+有真正的任务到来时立即取消：后台线程在每个状态、每个处理步骤以及色彩调整的每个图块之前检查取消标记，
+界面线程从不等待它，取消之后产生的结果会被丢弃。
+"""
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from background_io import TaskCancelled
+from memory_budget import geometry_size
+from pipeline import transform_geometry
+from tiling import adjust_colors_tiled
+
+# 缓存的预渲染状态数上限（当前状态的4个相邻状态）
+SPECULATIVE_CACHE_SIZE = 4
+
+# 上一次编辑之后界面空闲多久才开始预渲染（毫秒）
+SPECULATIVE_DELAY_MS = 150
+
+# 显示图像色彩调整的图块边长，图块之间检查取消标记
+PREVIEW_TILE_SIZE = 256
+
+
+class RenderCancelled(Exception):
+    """预渲染被取消"""
+
+
+def preview_state(rotation, flip_h, flip_v, brightness, contrast, saturation, zoom_scale, levels=None,
+                  auto_crop=False):
+    """界面渲染一帧所依赖的全部参数，用作缓存键"""
+    levels = tuple(levels) if levels else None
+    return (rotation % 360, bool(flip_h), bool(flip_v), brightness, contrast, saturation, zoom_scale, levels,
+            bool(auto_crop))
+
+
+def neighbor_states(state):
+    """当前状态再旋转±90度、水平翻转或垂直翻转一次后的状态"""
+    rotation, flip_h, flip_v = state[:3]
+    rest = state[3:]
+    return [
+        ((rotation + 90) % 360, flip_h, flip_v) + rest,
+        ((rotation - 90) % 360, flip_h, flip_v) + rest,
+        (rotation, not flip_h, flip_v) + rest,
+        (rotation, flip_h, not flip_v) + rest,
+    ]
+
+
+def scaled_proxy(original, size):
+    """原图缩小到 size 的代理图像，缓存在原图上（只保留最近一个尺寸）"""
+    cached = getattr(original, "scaled_proxy", None)
+    if cached is None or cached.size != size:
+        cached = original.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        original.scaled_proxy = cached
+    return cached
+
+
+def render_state(original, state, cancel_event=None, proxy=True):
+    """按界面的流程渲染一个状态：旋转/翻转 -> 色阶和色彩调整 -> 按缩放比例缩放
+
+    缩小显示时先把原图缩到显示分辨率（缓存在原图上），再旋转/翻转和调色（proxy=True），
+    拖动角度滑块或连续点击旋转、翻转时只处理显示大小的图像；全分辨率的处理只在应用或导出时执行一次。
+    90度整数倍的旋转和翻转是精确的转置，结果就是显示尺寸；任意角度的显示尺寸与先旋转再缩放时完全相同。
+
+    Returns:
+        (显示图像, 缩放前的尺寸)
+
+    Raises:
+        RenderCancelled: cancel_event 在处理步骤之间或色彩调整的图块之间被设置
+    """
+    def check():
+        if cancel_event is not None and cancel_event.is_set():
+            raise RenderCancelled()
+
+    def adjust(image):
+        try:
+            return adjust_colors_tiled(image, brightness, contrast, saturation, levels,
+                                       tile_size=PREVIEW_TILE_SIZE, cancel_event=cancel_event)
+        except TaskCancelled:
+            raise RenderCancelled()
+
+    rotation, flip_h, flip_v, brightness, contrast, saturation, zoom_scale, levels, auto_crop = state
+    if proxy and zoom_scale < 1.0:
+        full_size = geometry_size(original.size, rotation, auto_crop)
+        display_size = (int(full_size[0] * zoom_scale), int(full_size[1] * zoom_scale))
+        # 与显示尺寸一样向下取整，转置后正好是显示尺寸
+        source = scaled_proxy(original, (max(1, int(original.width * zoom_scale)),
+                                         max(1, int(original.height * zoom_scale))))
+        check()
+        image = transform_geometry(source, rotation, flip_h, flip_v, auto_crop)
+        check()
+        image = adjust(image)
+        check()
+        if image.size != display_size:
+            # 代理图像任意角度旋转后的尺寸可能与按比例计算的差一两个像素
+            image = image.resize(display_size, Image.BICUBIC)
+        return image, full_size
+
+    image = transform_geometry(original, rotation, flip_h, flip_v, auto_crop)
+    check()
+    image = adjust(image)
+    check()
+    size = (int(image.width * zoom_scale), int(image.height * zoom_scale))
+    return image.resize(size, Image.LANCZOS), image.size
+
+
+class SpeculativeRenderer:
+    """在后台线程中预渲染相邻状态，结果放入有限容量的缓存
+
+    缓存只对同一张原图有效，原图更换后旧的结果自动失效。
+    """
+
+    def __init__(self, max_entries=SPECULATIVE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.source = None
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, original, state):
+        """取出已预渲染的状态，没有时返回None"""
+        with self.lock:
+            entry = self.cache.pop(state, None) if self.source is original else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def cancel(self):
+        """取消正在进行的预渲染"""
+        self.cancel_event.set()
+
+    def clear(self):
+        """取消预渲染并清空缓存"""
+        self.cancel()
+        with self.lock:
+            self.cache.clear()
+            self.source = None
+
+    def start(self, original, state):
+        """取消之前的预渲染，在后台线程中渲染 state 的相邻状态"""
+        self.cancel()
+        cancel_event = self.cancel_event = threading.Event()
+        with self.lock:
+            if self.source is not original:
+                self.cache.clear()
+                self.source = original
+            todo = [s for s in neighbor_states(state) if s not in self.cache]
+        if not todo:
+            return None
+        thread = threading.Thread(target=self._run, args=(original, todo, cancel_event), daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, original, states, cancel_event):
+        for state in states:
+            if cancel_event.is_set():
+                return
+            try:
+                entry = render_state(original, state, cancel_event)
+            except RenderCancelled:
+                return
+            except Exception:
+                # 预渲染失败不影响界面，真正执行时会重新渲染并报告错误
+                return
+            with self.lock:
+                if cancel_event.is_set() or self.source is not original:
+                    return
+                self.cache[state] = entry
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
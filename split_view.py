@@ -0,0 +1,72 @@
+"""修改前后的分屏对比
+
+分隔线左侧显示修改前、右侧显示修改后的图像。两半都是显示分辨率的缓存图像：
+修改后就是界面当前的显示图像；修改前按相同的旋转/翻转和缩放比例渲染、但不做色彩调整，
+两者逐像素对齐。修改前的图像只在几何状态或缩放比例改变时渲染一次，调整色彩时直接复用。
+
+拖动分隔线时只裁出修改前图像左侧的一段交给画布，不重新处理任何像素。
+"""
+from collections import OrderedDict
+
+from speculative import render_state
+
+# 缓存的修改前图像数（当前和上一个几何/缩放状态，来回切换时不必重新渲染）
+SPLIT_CACHE_SIZE = 2
+
+# 分隔线的初始位置（占图像宽度的比例）
+SPLIT_DEFAULT_POSITION = 0.5
+
+
+def before_state(state):
+    """去掉色彩调整和色阶后的预览状态（见 speculative.preview_state），几何和缩放不变"""
+    rotation, flip_h, flip_v, _, _, _, zoom_scale, _, auto_crop = state
+    return (rotation, flip_h, flip_v, 1.0, 1.0, 1.0, zoom_scale, None, auto_crop)
+
+
+class SplitView:
+    """修改前图像的缓存和分隔线位置
+
+    缓存只对同一张原图有效，原图更换后旧的结果自动失效。
+    """
+
+    def __init__(self, max_entries=SPLIT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.source = None
+        self.position = SPLIT_DEFAULT_POSITION
+
+    def clear(self):
+        self.cache.clear()
+        self.source = None
+
+    def before(self, original, state, after=None):
+        """state 对应的修改前图像；state 本身没有色彩调整时直接返回修改后的图像 after"""
+        key = before_state(state)
+        if key == state and after is not None:
+            return after
+        if self.source is not original:
+            self.clear()
+            self.source = original
+        image = self.cache.get(key)
+        if image is None:
+            image = render_state(original, key)[0]
+            self.cache[key] = image
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return image
+
+    def divider(self, width):
+        """分隔线在宽为 width 的图像中的横坐标"""
+        return int(round(self.position * width))
+
+    def move(self, x, width):
+        """把分隔线移到图像中的横坐标 x（超出图像时停在边缘），返回新的横坐标"""
+        self.position = min(1.0, max(0.0, x / width)) if width else SPLIT_DEFAULT_POSITION
+        return self.divider(width)
+
+    def left_part(self, before):
+        """修改前图像在分隔线左侧的部分，分隔线在最左边时返回None"""
+        x = self.divider(before.width)
+        return before.crop((0, 0, x, before.height)) if x else None
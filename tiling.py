@@ -0,0 +1,188 @@
+"""超大图像的分块并行处理
+
+色彩调整是逐像素运算，LANCZOS/BICUBIC缩放只依赖有限邻域，因此可以把输出划分为图块，
+每个图块连同足够宽的边缘（halo）一起从源图中取出，在线程池中独立完成调色和缩放后再拼接。
+Pillow在缩放和混合运算中会释放GIL，多个图块可以真正并行。
+
+唯一的全局量是对比度调整使用的平均灰度，先分块统计直方图再汇总。色彩调整的结果与整图处理逐位一致；
+缩放时各图块采样框的浮点舍入略有不同，个别像素可能相差1~2个色阶。
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageEnhance
+
+from auto_levels import apply_levels, resolve_levels
+from background_io import TaskCancelled
+from pipeline import apply_edits, is_identity, transform_geometry
+
+# 默认图块边长（输出像素）
+DEFAULT_TILE_SIZE = 1024
+
+# 像素数低于该值时分块的调度开销大于收益，直接整图处理
+TILED_MIN_PIXELS = 8_000_000
+
+# 可以分块处理的图像模式
+TILED_MODES = ("L", "LA", "RGB", "RGBA")
+
+# 各重采样滤镜的支撑半径（源图像素，缩小时按比例放大）
+FILTER_SUPPORT = {
+    Image.NEAREST: 0.5,
+    Image.BOX: 0.5,
+    Image.BILINEAR: 1.0,
+    Image.HAMMING: 1.0,
+    Image.BICUBIC: 2.0,
+    Image.LANCZOS: 3.0,
+}
+
+
+def tile_boxes(width, height, tile_size=DEFAULT_TILE_SIZE):
+    """把 width x height 的区域划分为图块，返回 (left, top, right, bottom) 列表"""
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+
+def should_tile(image, tile_size=DEFAULT_TILE_SIZE):
+    """判断图像是否值得分块处理"""
+    return (image.mode in TILED_MODES
+            and image.width * image.height >= TILED_MIN_PIXELS
+            and (image.width > tile_size or image.height > tile_size))
+
+
+def _contrast(tile, factor, mean):
+    """使用整图平均灰度调整单个图块的对比度，与 ImageEnhance.Contrast 结果一致"""
+    degenerate = Image.new("L", tile.size, mean)
+    if degenerate.mode != tile.mode:
+        degenerate = degenerate.convert(tile.mode)
+    if "A" in tile.getbands():
+        degenerate.putalpha(tile.getchannel("A"))
+    return Image.blend(degenerate, tile, factor)
+
+
+def _adjust_tile(tile, brightness, contrast, saturation, mean, levels=None):
+    """对单个图块应用色阶和色彩调整"""
+    tile = apply_levels(tile, levels)
+    if brightness != 1.0:
+        tile = ImageEnhance.Brightness(tile).enhance(brightness)
+    if contrast != 1.0:
+        tile = _contrast(tile, contrast, mean)
+    if saturation != 1.0:
+        tile = ImageEnhance.Color(tile).enhance(saturation)
+    return tile
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise TaskCancelled()
+
+
+def _global_mean(image, brightness, tile_size, executor, levels=None, cancel_event=None):
+    """分块统计色阶和亮度调整后的平均灰度（与 ImageEnhance.Contrast 的取整方式一致）"""
+    def tile_sum(box):
+        _check_cancelled(cancel_event)
+        tile = apply_levels(image.crop(box), levels)
+        if brightness != 1.0:
+            tile = ImageEnhance.Brightness(tile).enhance(brightness)
+        histogram = tile.convert("L").histogram()
+        return sum(i * count for i, count in enumerate(histogram))
+
+    total = sum(executor.map(tile_sum, tile_boxes(image.width, image.height, tile_size)))
+    return int(total / (image.width * image.height) + 0.5)
+
+
+def _source_window(box, out_tile, scale_x, scale_y, support):
+    """计算输出图块在源图中的采样区域，以及加上halo后需要取出的整数区域
+
+    Returns:
+        (window, local_box)：window 为源图中要裁出的整数区域，
+        local_box 为相对于 window 的浮点采样框。window 不会超出裁剪框，
+        保证边缘处的滤镜截断方式与先裁剪再缩放时相同
+    """
+    ox0, oy0, ox1, oy1 = out_tile
+    sx0 = box[0] + ox0 * scale_x
+    sx1 = box[0] + ox1 * scale_x
+    sy0 = box[1] + oy0 * scale_y
+    sy1 = box[1] + oy1 * scale_y
+
+    # 缩小时滤镜支撑范围随缩放比例扩大
+    halo_x = int(math.ceil(support * max(scale_x, 1.0))) + 2
+    halo_y = int(math.ceil(support * max(scale_y, 1.0))) + 2
+    window = (
+        max(box[0], int(math.floor(sx0)) - halo_x),
+        max(box[1], int(math.floor(sy0)) - halo_y),
+        min(box[2], int(math.ceil(sx1)) + halo_x),
+        min(box[3], int(math.ceil(sy1)) + halo_y),
+    )
+    local_box = (sx0 - window[0], sy0 - window[1], sx1 - window[0], sy1 - window[1])
+    return window, local_box
+
+
+def adjust_colors_tiled(image, brightness=1.0, contrast=1.0, saturation=1.0, levels=None,
+                        tile_size=DEFAULT_TILE_SIZE, workers=None, cancel_event=None):
+    """分块并行的色彩调整，结果与 pipeline.adjust_colors 逐位一致"""
+    return apply_edits_tiled(image, brightness=brightness, contrast=contrast, saturation=saturation,
+                             levels=levels, tile_size=tile_size, workers=workers, cancel_event=cancel_event)
+
+
+def apply_edits_tiled(image, rotation=0, flip_h=False, flip_v=False,
+                      brightness=1.0, contrast=1.0, saturation=1.0,
+                      crop_box=None, size=None, levels=None, auto_levels=None, auto_crop=False,
+                      resample=Image.LANCZOS,
+                      tile_size=DEFAULT_TILE_SIZE, workers=None, cancel_event=None):
+    """分块并行版本的 pipeline.apply_edits
+
+    旋转/翻转整图执行一次；裁剪、色彩调整和缩放按输出图块融合执行，
+    每个图块只读取其采样区域加halo的源像素。小图或不支持的模式直接整图处理，
+    给出 cancel_event 时小图也分块处理，以便在图块之间取消。
+
+    Args:
+        resample: 缩放滤镜，决定halo宽度
+        tile_size: 输出图块边长
+        workers: 线程数，None表示使用默认值
+        cancel_event: 每个图块开始前检查，被设置时抛出 TaskCancelled
+    """
+    if is_identity(rotation, flip_h, flip_v, brightness, contrast, saturation, crop_box, size, levels, auto_levels,
+                   auto_crop):
+        return image
+    # 色阶只分析一次缩小的代理图像，之后与其他色彩调整一起逐图块执行
+    levels = resolve_levels(image, levels, auto_levels)
+    if not should_tile(image, tile_size) and (cancel_event is None or image.mode not in TILED_MODES):
+        return apply_edits(image, rotation, flip_h, flip_v, brightness, contrast, saturation, crop_box, size,
+                           levels, auto_crop=auto_crop)
+
+    image = transform_geometry(image, rotation, flip_h, flip_v, auto_crop)
+    image.load()
+
+    box = tuple(crop_box) if crop_box else (0, 0, image.width, image.height)
+    box = tuple(int(round(v)) for v in box)
+    box_w = box[2] - box[0]
+    box_h = box[3] - box[1]
+    out_w, out_h = tuple(size) if size else (box_w, box_h)
+    resizing = (out_w, out_h) != (box_w, box_h)
+    scale_x = box_w / out_w
+    scale_y = box_h / out_h
+    support = FILTER_SUPPORT.get(resample, 3.0) if resizing else 0.0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        mean = _global_mean(image, brightness, tile_size, executor, levels, cancel_event) if contrast != 1.0 else 0
+
+        def render(out_tile):
+            _check_cancelled(cancel_event)
+            if resizing:
+                window, local_box = _source_window(box, out_tile, scale_x, scale_y, support)
+            else:
+                window = (box[0] + out_tile[0], box[1] + out_tile[1],
+                          box[0] + out_tile[2], box[1] + out_tile[3])
+            tile = _adjust_tile(image.crop(window), brightness, contrast, saturation, mean, levels)
+            if resizing:
+                tile = tile.resize((out_tile[2] - out_tile[0], out_tile[3] - out_tile[1]),
+                                   resample, box=local_box)
+            return out_tile, tile
+
+        output = Image.new(image.mode, (out_w, out_h))
+        for out_tile, tile in executor.map(render, tile_boxes(out_w, out_h, tile_size)):
+            output.paste(tile, out_tile[:2])
+    return output
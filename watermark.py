@@ -0,0 +1,172 @@
+"""导出时叠加水印（图片或文字）
+
+配方中的 "watermark" 作用于全部输出，单个输出项中的 "watermark" 优先（为false时该输出不加水印）：
+
+    {"image": "logo.png", "position": "bottom-right", "scale": 0.2, "opacity": 0.6}
+    {"text": "© ACME", "color": "#ffffff", "tile": true, "spacing": 1.0}
+
+    image / text     水印图片路径或文字，二选一
+    position         top-left/top/top-right/left/center/right/bottom-left/bottom/bottom-right，默认 bottom-right
+    scale            水印宽度占输出宽度的比例，默认0.2
+    margin           与边缘的距离占输出短边的比例，默认0.02
+    opacity          不透明度 0~1，默认0.5
+    tile             平铺满整张图片，spacing 为相邻水印的间距（占水印尺寸的比例），默认0.5
+    font, color      文字水印的TrueType字体文件（默认使用内置字体）和颜色
+
+水印的源图像只读取或渲染一次，并预先乘上不透明度；按输出尺寸缩放、定位（平铺时铺满整幅）的
+结果按尺寸缓存。成千上万张同一尺寸的输出每张只需一次合成：RGBA图像用 alpha_composite，
+RGB图像用以水印透明度为掩码的 paste，不平铺时只处理水印所在的区域。
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# 水印位置对应的水平、垂直对齐比例
+WATERMARK_POSITIONS = {
+    "top-left": (0.0, 0.0),
+    "top": (0.5, 0.0),
+    "top-right": (1.0, 0.0),
+    "left": (0.0, 0.5),
+    "center": (0.5, 0.5),
+    "right": (1.0, 0.5),
+    "bottom-left": (0.0, 1.0),
+    "bottom": (0.5, 1.0),
+    "bottom-right": (1.0, 1.0),
+}
+
+# 水印参数的默认值
+WATERMARK_DEFAULTS = {
+    "position": "bottom-right",
+    "scale": 0.2,
+    "margin": 0.02,
+    "opacity": 0.5,
+    "tile": False,
+    "spacing": 0.5,
+    "color": "#ffffff",
+}
+
+# 文字水印先按这个字号渲染，之后和图片水印一样按输出尺寸缩放
+TEXT_RENDER_SIZE = 128
+
+# 每个水印缓存的输出尺寸数
+WATERMARK_SIZES_CACHED = 16
+
+# 进程内缓存的水印数
+WATERMARK_CACHE_SIZE = 4
+
+
+def render_text(text, font=None, color=WATERMARK_DEFAULTS["color"], size=TEXT_RENDER_SIZE):
+    """把文字渲染为恰好包住文字的RGBA图像"""
+    face = ImageFont.truetype(font, size) if font else ImageFont.load_default(size)
+    left, top, right, bottom = face.getbbox(text)
+    fill = ImageColor.getrgb(color)
+    image = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), fill[:3] + (0,))
+    ImageDraw.Draw(image).text((-left, -top), text, font=face, fill=fill)
+    return image
+
+
+def with_opacity(image, opacity):
+    """把RGBA图像的透明度整体乘上 opacity"""
+    if opacity >= 1.0:
+        return image
+    image = image.copy()
+    image.putalpha(image.getchannel("A").point([int(a * opacity + 0.5) for a in range(256)]))
+    return image
+
+
+class Watermark:
+    """一个水印的源图像，以及按输出尺寸缓存的缩放、定位结果
+
+    可以在多个线程中同时使用；同一尺寸只渲染一次。
+    """
+
+    def __init__(self, spec, max_sizes=WATERMARK_SIZES_CACHED):
+        options = dict(WATERMARK_DEFAULTS, **spec)
+        if options["position"] not in WATERMARK_POSITIONS:
+            raise ValueError(f"未知的水印位置: {options['position']}")
+        if options.get("image"):
+            with Image.open(options["image"]) as image:
+                source = image.convert("RGBA")
+        elif options.get("text"):
+            source = render_text(str(options["text"]), options.get("font"), options["color"])
+        else:
+            raise ValueError("水印需要指定 image 或 text")
+        self.source = with_opacity(source, float(options["opacity"]))
+        self.options = options
+        self.max_sizes = max_sizes
+        self.layers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def layer(self, size):
+        """输出尺寸为 size 时要合成的 (RGBA图像, 左上角位置)"""
+        size = tuple(size)
+        with self.lock:
+            entry = self.layers.pop(size, None)
+            if entry is None:
+                entry = self._render(size)
+            self.layers[size] = entry
+            while len(self.layers) > self.max_sizes:
+                self.layers.popitem(last=False)
+        return entry
+
+    def _render(self, size):
+        width, height = size
+        options = self.options
+        source = self.source
+        # 宽度按输出宽度的比例，同时整个水印不超出输出图像
+        scale = min(float(options["scale"]) * width / source.width, width / source.width,
+                    height / source.height)
+        patch_size = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+        patch = source.resize(patch_size, Image.LANCZOS) if patch_size != source.size else source
+
+        if options["tile"]:
+            step_x = patch.width + round(patch.width * float(options["spacing"]))
+            step_y = patch.height + round(patch.height * float(options["spacing"]))
+            layer = Image.new("RGBA", size, (0, 0, 0, 0))
+            for row, y in enumerate(range(0, height, step_y)):
+                # 隔行错开半个间距
+                for x in range(-(row % 2) * step_x // 2, width, step_x):
+                    layer.paste(patch, (x, y))
+            return layer, (0, 0)
+
+        fx, fy = WATERMARK_POSITIONS[options["position"]]
+        margin = round(float(options["margin"]) * min(width, height))
+        x = round(margin + (width - 2 * margin - patch.width) * fx)
+        y = round(margin + (height - 2 * margin - patch.height) * fy)
+        return patch, (min(max(0, x), width - patch.width), min(max(0, y), height - patch.height))
+
+    def apply(self, image):
+        """把水印合成到 image 上（就地修改，只读图像会先被复制），返回合成后的图像"""
+        patch, dest = self.layer(image.size)
+        if image.mode == "RGBA":
+            image.alpha_composite(patch, dest)
+        else:
+            image.paste(patch, dest, patch)
+        return image
+
+
+# 按参数缓存的水印，批量处理时所有源文件共用
+_watermarks = OrderedDict()
+_watermarks_lock = threading.Lock()
+
+
+def get_watermark(spec):
+    """返回参数为 spec 的水印（带缓存）"""
+    key = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    with _watermarks_lock:
+        watermark = _watermarks.pop(key, None)
+        if watermark is None:
+            watermark = Watermark(spec)
+        _watermarks[key] = watermark
+        while len(_watermarks) > WATERMARK_CACHE_SIZE:
+            _watermarks.popitem(last=False)
+    return watermark
+
+
+def apply_watermark(image, spec):
+    """按水印参数 spec 合成水印；spec 为空或false时原样返回 image"""
+    if not spec:
+        return image
+    return get_watermark(spec).apply(image)